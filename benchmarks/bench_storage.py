@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""
+This is the storage benchmark of Tagsy, run from the repository root with
+`python -m benchmarks.bench_storage`.
+
+It fills a temporary SQLite database with synthetic guilds and tags, then
+calls every function of db/sqlite_handler.py from many concurrent tasks and
+records the throughput and latency percentiles of each one. Everything runs
+offline and is seeded, so two runs with the same options do the same work and
+can be compared before and after a storage change.
+
+Functions:
+- generate(path, guilds, tags, seed):
+Fills a new database with synthetic guilds and tags.
+
+- read_layout(path):
+Reads the tag names of every guild of a database, biggest guild first.
+
+- percentile(ordered, share):
+Returns the nearest-rank percentile of a sorted list.
+
+- to_ms(seconds):
+Converts a duration to milliseconds, rounded to the microsecond.
+
+- revision():
+Returns the current git commit, or None outside of a git checkout.
+
+- write_report(benchmark, options, results):
+Writes the results of a benchmark as JSON, to the path of `--output`.
+
+- run(options, layout=None):
+Runs every workload and returns the results.
+
+- main():
+Parses the command line, runs the benchmark and writes the results as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import accumulate
+
+# Read by config.py, so it must be set before db.sqlite_handler is imported.
+os.environ.setdefault("METRICS_PORT", "0")
+
+# Popular tag names, the rest are made of pseudo-words.
+COMMON_WORDS = (
+    "rules",
+    "faq",
+    "help",
+    "welcome",
+    "roles",
+    "links",
+    "invite",
+    "setup",
+    "guide",
+    "docs",
+    "support",
+    "bug",
+    "install",
+    "error",
+    "update",
+    "event",
+    "server",
+    "mods",
+    "bot",
+    "info",
+    "wiki",
+    "build",
+    "download",
+    "config",
+    "ping",
+)
+SEPARATORS = ("", "-", "_", "-", "")
+LOREM = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua ut enim ad minim veniam "
+    "quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo "
+    "consequat duis aute irure dolor in reprehenderit in voluptate velit esse "
+    "cillum dolore eu fugiat nulla pariatur https://example.com/docs"
+).split()
+
+
+def _zipf_sizes(total, count, exponent):
+    """Splits `total` items between `count` buckets following Zipf's law."""
+    weights = [1 / rank**exponent for rank in range(1, count + 1)]
+    scale = total / sum(weights)
+    sizes = [max(1, int(weight * scale)) for weight in weights]
+    # Rounding leaves a few items over, given to the biggest buckets.
+    for index in range(max(0, total - sum(sizes))):
+        sizes[index % count] += 1
+    return sizes
+
+
+def _word(rng):
+    """Returns a pronounceable pseudo-word of two to four syllables."""
+    return "".join(
+        rng.choice("bcdfghjklmnprstvz") + rng.choice("aeiou")
+        for _ in range(rng.randint(2, 4))
+    )
+
+
+def _tag_name(rng):
+    """Returns a tag name shaped like the ones users create."""
+    shape = rng.random()
+    if shape < 0.3:
+        name = rng.choice(COMMON_WORDS) + rng.choice(SEPARATORS) + _word(rng)
+    elif shape < 0.6:
+        name = _word(rng)
+    elif shape < 0.85:
+        name = _word(rng) + rng.choice(SEPARATORS) + _word(rng)
+    else:
+        name = _word(rng) + str(rng.randint(1, 999))
+    if rng.random() < 0.1:
+        name = name.capitalize()
+    return name[:25].ljust(3, "x")
+
+
+# Rules, FAQs and snippets many guilds copy word for word.
+BOILERPLATE = [
+    " ".join(random.Random(index).choices(LOREM, k=40 + 10 * index))
+    for index in range(50)
+]
+
+
+def _content(rng):
+    """Returns a tag content, mostly short with a long tail, often boilerplate."""
+    if rng.random() < 0.2:
+        return rng.choice(BOILERPLATE)
+    words = min(300, int(rng.lognormvariate(3, 0.8)) + 1)
+    return " ".join(rng.choice(LOREM) for _ in range(words))
+
+
+def _guild_tags(rng, size):
+    """Returns `size` distinct tag names for a guild."""
+    names = dict.fromkeys(COMMON_WORDS[: min(size, rng.randint(0, 10))])
+    while len(names) < size:
+        names[_tag_name(rng)] = None
+    return list(names)
+
+
+def generate(path, guilds, tags, seed):
+    """
+    Fills a new database with synthetic guilds and tags.
+
+    Tags are split between guilds following Zipf's law, so a few guilds hold
+    most of them as on the real bot, and their names mix common words,
+    pseudo-words, separators and numbers.
+
+    Args:
+    - path (str): The path of the database file to create.
+    - guilds (int): The number of guilds.
+    - tags (int): The total number of tags.
+    - seed (int): The seed of the random generator.
+
+    Returns:
+    - dict: Maps every guild ID to the list of its tag names, most popular first.
+    """
+    rng = random.Random(seed)
+    layout = {}
+    db = sqlite3.connect(path)
+    try:
+        # Same schema as db/migrations.py, without its indexes, which are
+        # created by the migrations once the rows are in.
+        db.execute(
+            """CREATE TABLE messages (
+                        id INTEGER PRIMARY KEY,
+                        server_id TEXT NOT NULL,
+                        tag TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        created_by TEXT NOT NULL,
+                        usage_count INTEGER DEFAULT 1,
+                        UNIQUE(server_id, tag)
+                    )"""
+        )
+        db.execute("PRAGMA user_version = 1")
+        users = [str(rng.randrange(10**17, 10**18)) for _ in range(max(1, guilds))]
+        for size in _zipf_sizes(tags, guilds, 1.0):
+            server_id = str(rng.randrange(10**17, 10**18))
+            names = _guild_tags(rng, size)
+            layout[server_id] = names
+            db.executemany(
+                "INSERT INTO messages (server_id, tag, content, created_by, usage_count)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        server_id,
+                        name,
+                        _content(rng),
+                        rng.choice(users),
+                        # The first names of a guild are its most used ones.
+                        max(1, int(1000 / (rank + 1) ** 1.2)),
+                    )
+                    for rank, name in enumerate(names)
+                ),
+            )
+        db.commit()
+    finally:
+        db.close()
+    return layout
+
+
+def read_layout(path):
+    """Reads the tag names of every guild of a database, biggest guild first."""
+    layout = {}
+    db = sqlite3.connect(path)
+    try:
+        for server_id, tag in db.execute(
+            "SELECT server_id, tag FROM messages ORDER BY server_id, usage_count DESC"
+        ):
+            layout.setdefault(server_id, []).append(tag)
+    finally:
+        db.close()
+    return dict(sorted(layout.items(), key=lambda item: -len(item[1])))
+
+
+def percentile(ordered, share):
+    """Returns the nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(share * len(ordered) + 0.5) - 1))]
+
+
+class _Workload:  # pylint: disable=too-few-public-methods
+    """Picks the guilds and tags of the benchmarked calls, skewed by popularity."""
+
+    def __init__(self, layout, seed):
+        self.rng = random.Random(seed)
+        self.guilds = list(layout)
+        self.tags = layout
+        # Busy guilds trigger most calls, in proportion to their size.
+        self.weights = list(accumulate(len(layout[guild]) for guild in self.guilds))
+        self._created = 0
+        self.added = []
+
+    def guild(self):
+        """Returns a guild, big ones more often."""
+        return self.rng.choices(self.guilds, cum_weights=self.weights)[0]
+
+    def tag(self, guild):
+        """Returns an existing tag of a guild, popular ones more often."""
+        names = self.tags[guild]
+        return names[int(len(names) * self.rng.random() ** 3)]
+
+    def typo(self, guild):
+        """Returns a misspelt tag of a guild, which most likely does not exist."""
+        name = self.tag(guild)
+        position = self.rng.randrange(len(name))
+        return (
+            name[:position] + self.rng.choice(string.ascii_lowercase) + name[position:]
+        )[:25]
+
+    def new_tag(self):
+        """Returns a tag name that no guild has yet."""
+        self._created += 1
+        return f"bench-{self._created}"
+
+
+def _workloads(handler, work):  # pylint: disable=too-many-locals
+    """Returns the benchmarked calls, by name, in the order they are run."""
+
+    async def get_message_hit():
+        guild = work.guild()
+        await handler.get_message(guild, work.tag(guild))
+
+    async def get_message_miss():
+        guild = work.guild()
+        await handler.get_message(guild, work.typo(guild))
+
+    async def get_messages():
+        guild = work.guild()
+        tags = [work.tag(guild) for _ in range(3)] + [work.typo(guild)]
+        await handler.get_messages(guild, tags)
+
+    async def get_similar_tags():
+        guild = work.guild()
+        await handler.get_similar_tags(guild, work.typo(guild))
+
+    async def complete_tags():
+        guild = work.guild()
+        await handler.complete_tags(guild, work.tag(guild)[:2])
+
+    async def get_all_messages():
+        guild = work.guild()
+        names = work.tags[guild]
+        after = names[work.rng.randrange(len(names))] if len(names) > 25 else None
+        await handler.get_all_messages(guild, after_tag=after, limit=25)
+
+    async def increment_usage_count():
+        guild = work.guild()
+        await handler.increment_usage_count(guild, work.tag(guild))
+
+    async def increment_usage_counts():
+        guild = work.guild()
+        await handler.increment_usage_counts(
+            guild, list({work.tag(guild) for _ in range(3)})
+        )
+
+    async def add_message():
+        guild, tag = work.guild(), work.new_tag()
+        await handler.add_message(guild, tag, "benchmark content", "0")
+        work.added.append((guild, tag))
+
+    async def update_message():
+        guild = work.guild()
+        await handler.update_message(guild, work.tag(guild), "updated content")
+
+    async def reset_usage_count():
+        guild = work.guild()
+        await handler.reset_usage_count(guild, work.tag(guild))
+
+    async def delete_message():
+        if work.added:
+            await handler.delete_message(*work.added.pop())
+
+    async def iter_all_tags_for_all_servers():
+        async for _ in handler.iter_all_tags_for_all_servers():
+            pass
+
+    async def purge_tags():
+        # The smallest guilds, so the other workloads keep their data.
+        guild = work.guilds.pop()
+        await handler.purge_tags(guild)
+        del work.tags[guild]
+        work.weights.pop()
+
+    return {
+        "get_message_hit": (get_message_hit, 1.0),
+        "get_message_miss": (get_message_miss, 1.0),
+        "get_messages": (get_messages, 1.0),
+        "get_similar_tags": (get_similar_tags, 1.0),
+        "complete_tags": (complete_tags, 1.0),
+        "get_all_messages": (get_all_messages, 1.0),
+        "increment_usage_count": (increment_usage_count, 1.0),
+        "increment_usage_counts": (increment_usage_counts, 1.0),
+        "add_message": (add_message, 0.2),
+        "update_message": (update_message, 0.2),
+        "reset_usage_count": (reset_usage_count, 0.1),
+        "delete_message": (delete_message, 0.2),
+        "iter_all_tags_for_all_servers": (iter_all_tags_for_all_servers, 0),
+        "purge_tags": (purge_tags, 0.01),
+    }
+
+
+async def _measure(call, operations, concurrency):
+    """Runs `operations` calls from `concurrency` tasks and times each one."""
+    latencies = []
+    errors = 0
+    remaining = operations
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                await call()
+            except Exception:  # pylint: disable=broad-exception-caught
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, operations))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "operations": operations,
+        "errors": errors,
+        "concurrency": min(concurrency, operations),
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": to_ms(percentile(latencies, 0.50)),
+        "p90_ms": to_ms(percentile(latencies, 0.90)),
+        "p99_ms": to_ms(percentile(latencies, 0.99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+    }
+
+
+def to_ms(seconds):
+    """Converts a duration to milliseconds, rounded to the microsecond."""
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+async def run(options, layout=None):
+    """
+    Runs every workload and returns the results.
+
+    Args:
+    - options (argparse.Namespace): The parsed command line.
+    - layout (dict): The tag names of every guild, as returned by
+      `generate()`; read from the database if not given.
+
+    Returns:
+    - dict: The results of each workload, by name, plus the setup timings.
+    """
+    # pylint: disable=import-outside-toplevel
+    from db import sqlite_handler as handler
+
+    results = {}
+    started = time.perf_counter()
+    await handler.db_setup()
+    results["db_setup"] = {"seconds": time.perf_counter() - started}
+
+    work = _Workload(layout or read_layout(options.db), options.seed)
+    try:
+        for name, (call, share) in _workloads(handler, work).items():
+            if options.only and name not in options.only:
+                continue
+            # Slow and destructive calls run fewer times than lookups, also
+            # when warming up, so they do not use up the guilds and tags the
+            # timed calls need.
+            operations = max(1, int(options.operations * share))
+            if options.warmup and share:
+                warmup = max(1, int(options.warmup * share))
+                await _measure(call, warmup, options.concurrency)
+            results[name] = await _measure(call, operations, options.concurrency)
+            print(_format_row(name, results[name]), file=sys.stderr)
+    finally:
+        started = time.perf_counter()
+        await handler.db_teardown()
+        results["db_teardown"] = {"seconds": time.perf_counter() - started}
+    return results
+
+
+def _format_row(name, result):
+    """Formats the results of a workload for the terminal."""
+    return (
+        f"{name:<30} {result['throughput'] or 0:>10.0f} ops/s"
+        f"  p50 {result['p50_ms'] or 0:>8.3f} ms"
+        f"  p99 {result['p99_ms'] or 0:>8.3f} ms"
+        f"  errors {result['errors']}"
+    )
+
+
+def revision():
+    """Returns the current git commit, or None outside of a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(benchmark, options, results):
+    """
+    Writes the results of a benchmark as JSON, to the path of `--output`.
+
+    The report also records the git revision, Python and SQLite versions and
+    options of the run, so two reports tell what was compared.
+
+    Args:
+    - benchmark (str): The name of the benchmark.
+    - options (argparse.Namespace): The parsed command line.
+    - results (dict): The results of the benchmark.
+    """
+    report = {
+        "benchmark": benchmark,
+        "revision": revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "options": vars(options),
+        "results": results,
+    }
+    with open(options.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {options.output}", file=sys.stderr)
+
+
+def _parse_args():
+    """Parses the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    parser.add_argument("--guilds", type=int, default=10_000)
+    parser.add_argument("--tags", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--operations", type=int, default=5000, help="calls per lookup workload"
+    )
+    parser.add_argument("--warmup", type=int, default=500, help="untimed calls")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--only", nargs="*", help="only run these workloads, by function name"
+    )
+    parser.add_argument(
+        "--db",
+        help="copy of a database to reuse instead of generating one; it is modified",
+    )
+    parser.add_argument("--output", default="bench_storage.json")
+    return parser.parse_args()
+
+
+def main():
+    """Parses the command line, runs the benchmark and writes the results as JSON."""
+    options = _parse_args()
+    layout = None
+    with tempfile.TemporaryDirectory() as directory:
+        if options.db is None:
+            options.db = os.path.join(directory, "bench.db")
+            started = time.perf_counter()
+            layout = generate(options.db, options.guilds, options.tags, options.seed)
+            print(
+                f"Generated {options.tags} tags in {options.guilds} guilds"
+                f" in {time.perf_counter() - started:.1f}s",
+                file=sys.stderr,
+            )
+        os.environ["DB_PATH"] = options.db
+        results = asyncio.run(run(options, layout))
+
+    write_report("storage", options, results)
+
+
+if __name__ == "__main__":
+    main()
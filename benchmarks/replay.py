@@ -0,0 +1,619 @@
+# -*- coding: utf-8 -*-
+"""
+This is the end-to-end load test of Tagsy, run from the repository root with
+`python -m benchmarks.replay`.
+
+It replays a trace of Discord events through the real handlers: the
+`on_message` listener and the slash commands of `TagCommands`, and the
+callbacks of the add and update modals. The handlers get fake disnake
+objects whose API calls go to a local stand-in for Discord instead of the
+network. The stand-in records every call, adds a configurable latency and
+answers with 429s when a route or the global rate limit is exceeded; the
+call is then retried after `retry_after`, as disnake does.
+
+The trace is either synthetic, generated at a configurable rate, or read from
+a JSON lines file, which `--record` writes from a synthetic run. The report
+gives the end-to-end latency percentiles of each kind of event, from the
+moment it is due to the end of its handler, or for tag triggers to the moment
+their reply is sent, and the API calls made per event.
+
+Functions:
+- synthetic_trace(layout, rate, duration, seed):
+Yields random events at `rate` per second, shaped like real traffic.
+
+- replay(trace, options):
+Dispatches the events of a trace to the handlers when they are due.
+
+- main():
+Parses the command line, replays the trace and writes the results as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from itertools import accumulate
+
+from benchmarks.bench_storage import (
+    generate,
+    percentile,
+    read_layout,
+    to_ms,
+    write_report,
+)
+
+# Read by config.py, so it must be set before the handlers are imported.
+os.environ.setdefault("METRICS_PORT", "0")
+
+# The share of each kind of event in synthetic traces.
+EVENT_MIX = {
+    "message": 0.40,
+    "message_tag": 0.40,
+    "get": 0.08,
+    "autocomplete": 0.06,
+    "getall": 0.02,
+    "reset": 0.015,
+    "add": 0.01,
+    "update": 0.01,
+    "remove": 0.005,
+}
+CHANNELS_PER_GUILD = 5
+USERS_PER_GUILD = 50
+CHATTER = "thanks, anyone knows how to fix this? see the pinned message".split()
+
+
+class _RateLimit:  # pylint: disable=too-few-public-methods
+    """A fixed-window bucket of `limit` requests every `period` seconds."""
+
+    __slots__ = ("limit", "period", "_reset_at", "_remaining")
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._reset_at = 0.0
+        self._remaining = limit
+
+    def take(self, now):
+        """Uses a request, returns the seconds to wait if there is none left."""
+        if now >= self._reset_at:
+            self._reset_at, self._remaining = now + self.period, self.limit
+        if self._remaining > 0:
+            self._remaining -= 1
+            return None
+        return self._reset_at - now
+
+
+# pylint: disable-next=too-few-public-methods,too-many-instance-attributes
+class FakeDiscord:
+    """
+    A local stand-in for the Discord API, recording the calls it receives.
+
+    Attributes:
+    - calls (dict): The number of requests, including rate limited ones, by route.
+    - rate_limited (int): The number of requests answered with a 429.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, latency, jitter, route_limit, route_period, global_limit, seed):
+        self.calls = {}
+        self.rate_limited = 0
+        self._latency = latency
+        self._jitter = jitter
+        self._route_limit = (route_limit, route_period)
+        self._global = _RateLimit(global_limit, 1.0) if global_limit else None
+        self._buckets = {}
+        self._rng = random.Random(seed)
+
+    async def request(self, record, route, bucket=None):
+        """
+        Sends a request, retrying it until it is not rate limited.
+
+        Args:
+        - record (_Record): The event the request is made for.
+        - route (str): The route of the request, e.g. "POST /channels/{id}/messages".
+        - bucket (str): The rate limit bucket of the request, if it has one;
+          interaction callbacks have none, as on Discord.
+        """
+        while True:
+            self.calls[route] = self.calls.get(route, 0) + 1
+            record.calls += 1
+            await asyncio.sleep(
+                max(0.0, self._rng.gauss(self._latency, self._jitter))
+                if self._latency
+                else 0
+            )
+            retry_after = self._take(bucket)
+            if retry_after is None:
+                return
+            self.rate_limited += 1
+            record.rate_limited += 1
+            await asyncio.sleep(retry_after)
+
+    def _take(self, bucket):
+        """Uses a request of a bucket and of the global limit."""
+        if bucket is None:
+            return None
+        now = time.monotonic()
+        if self._global is not None:
+            retry_after = self._global.take(now)
+            if retry_after is not None:
+                return retry_after
+        limit = self._buckets.get(bucket)
+        if limit is None:
+            limit = self._buckets[bucket] = _RateLimit(*self._route_limit)
+        return limit.take(now)
+
+
+class _Record:  # pylint: disable=too-few-public-methods
+    """What happened to a single event of the trace."""
+
+    __slots__ = ("kind", "calls", "rate_limited", "latency", "error")
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.calls = 0
+        self.rate_limited = 0
+        self.latency = None
+        self.error = None
+
+
+class _Permissions:  # pylint: disable=too-few-public-methods
+    """The permissions of a fake member."""
+
+    def __init__(self, manage_messages):
+        self.manage_messages = manage_messages
+
+
+class FakeMember:  # pylint: disable=too-few-public-methods
+    """A fake disnake Member, moderator or not depending on its ID."""
+
+    bot = False
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self.display_name = f"user-{user_id}"
+        self.guild_permissions = _Permissions(manage_messages=user_id % 5 == 0)
+
+
+class FakeGuild:
+    """
+    A fake disnake Guild, whose member cache holds a share of its members.
+
+    Members missing from it are fetched through the stand-in.
+    """
+
+    def __init__(self, discord, record, guild_id, cached_share):
+        self.id = int(guild_id)
+        self._discord = discord
+        self._record = record
+        self._cached_share = cached_share
+
+    def get_member(self, user_id):
+        """Returns the member if it is in the member cache."""
+        if (user_id * 2654435761) % 1000 < self._cached_share * 1000:
+            return FakeMember(user_id)
+        return None
+
+    async def fetch_member(self, user_id):
+        """Fetches a member through the stand-in."""
+        await self._discord.request(
+            self._record,
+            "GET /guilds/{id}/members/{id}",
+            f"members:{self.id}",
+        )
+        return FakeMember(user_id)
+
+
+class FakeChannel:  # pylint: disable=too-few-public-methods
+    """
+    A fake disnake TextChannel, sending its messages through the stand-in.
+
+    Tag trigger replies are sent by the dispatcher, merged with the replies
+    to other events of the channel, so their calls are not counted for the
+    event whose channel object sends them. The message returned records them
+    instead, and `delivered` tells when the reply to this event went out.
+    """
+
+    def __init__(self, discord, channel_id):
+        self.id = channel_id
+        self._discord = discord
+        self.delivered = None
+
+    async def send(self, content=None, **kwargs):  # pylint: disable=unused-argument
+        """Sends a message through the stand-in, returning its record."""
+        sent = _Record("send")
+        await self._discord.request(
+            sent, "POST /channels/{id}/messages", f"channel:{self.id}"
+        )
+        return sent
+
+
+class FakeMessage:  # pylint: disable=too-few-public-methods
+    """A fake disnake Message, as received by `on_message`."""
+
+    def __init__(self, guild, channel, author, content):
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.content = content
+
+
+class FakeResponse:
+    """A fake disnake InteractionResponse, answering through the stand-in."""
+
+    def __init__(self, discord, record):
+        self._discord = discord
+        self._record = record
+
+    async def _callback(self):
+        await self._discord.request(
+            self._record, "POST /interactions/{id}/{token}/callback"
+        )
+
+    async def send_message(self, *args, **kwargs):  # pylint: disable=unused-argument
+        """Answers with a message."""
+        await self._callback()
+
+    async def send_modal(self, modal):  # pylint: disable=unused-argument
+        """Answers with a modal."""
+        await self._callback()
+
+    async def edit_message(self, *args, **kwargs):  # pylint: disable=unused-argument
+        """Answers by editing the message of a component."""
+        await self._callback()
+
+
+class FakeInteraction:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """A fake disnake slash command, autocomplete or modal interaction."""
+
+    _ids = 0
+
+    def __init__(self, response, guild, author, text_values=None):
+        FakeInteraction._ids += 1
+        self.id = FakeInteraction._ids
+        self.guild = guild
+        self.guild_id = guild.id
+        self.author = self.user = author
+        self.response = response
+        self.text_values = text_values or {}
+
+
+class _Scene:
+    """The guild, channel and author of an event, with the stand-in behind them."""
+
+    def __init__(self, discord, record, event, member_cache):
+        self.guild = FakeGuild(discord, record, event["guild"], member_cache)
+        self.channel = FakeChannel(discord, event["channel"])
+        self.author = FakeMember(event["user"])
+        self.record = record
+        self._discord = discord
+
+    def message(self, content):
+        """Returns a message of the author in the channel."""
+        return FakeMessage(self.guild, self.channel, self.author, content)
+
+    def interaction(self, text_values=None):
+        """Returns an interaction of the author in the guild."""
+        return FakeInteraction(
+            FakeResponse(self._discord, self.record),
+            self.guild,
+            self.author,
+            text_values,
+        )
+
+
+def synthetic_trace(layout, rate, duration, seed):
+    """
+    Yields random events at `rate` per second, shaped like real traffic.
+
+    Events arrive as a Poisson process. Busy guilds get more of them and
+    popular tags are referenced more often; a fifth of the tag references are
+    misspelt. The kinds of events follow EVENT_MIX.
+
+    Args:
+    - layout (dict): The tag names of every guild, most popular first.
+    - rate (float): The average number of events per second.
+    - duration (float): The length of the trace in seconds.
+    - seed (int): The seed of the random generator.
+
+    Yields:
+    - dict: An event, with the second it is due at as "at".
+    """
+    rng = random.Random(seed)
+    guilds = list(layout)
+    weights = list(accumulate(len(layout[guild]) for guild in guilds))
+    kinds, shares = zip(*EVENT_MIX.items())
+    created = 0
+
+    def tag(guild):
+        names = layout[guild]
+        name = names[int(len(names) * rng.random() ** 3)]
+        if rng.random() < 0.2:
+            position = rng.randrange(len(name))
+            name = (name[:position] + rng.choice("aeiou") + name[position:])[:25]
+        return name
+
+    at = 0.0
+    while True:
+        at += rng.expovariate(rate)
+        if at >= duration:
+            return
+        guild = rng.choices(guilds, cum_weights=weights)[0]
+        event = {
+            "at": round(at, 6),
+            "type": rng.choices(kinds, weights=shares)[0],
+            "guild": guild,
+            "channel": int(guild) + rng.randrange(CHANNELS_PER_GUILD),
+            "user": rng.randrange(1, USERS_PER_GUILD + 1),
+        }
+        if event["type"] == "message":
+            event["content"] = " ".join(rng.choices(CHATTER, k=rng.randint(1, 12)))
+        elif event["type"] == "message_tag":
+            references = " ".join(f"§{tag(guild)}" for _ in range(rng.randint(1, 3)))
+            event["content"] = f"{rng.choice(CHATTER)} {references}"
+        elif event["type"] == "autocomplete":
+            event["prefix"] = tag(guild)[: rng.randint(0, 3)]
+        elif event["type"] == "add":
+            created += 1
+            event["tag"], event["content"] = f"replay-{seed}-{created}", "added"
+        elif event["type"] != "getall":
+            event["tag"] = tag(guild)
+            event["content"] = "updated"
+        yield event
+
+
+def _handlers(cog):
+    """Returns the coroutine running each kind of event, by name."""
+    # pylint: disable=import-outside-toplevel
+    from modals import AddTagModal, UpdateTagModal
+
+    async def message(event, scene):
+        await cog.on_message(scene.message(event["content"]))
+        if scene.channel.delivered is not None:
+            # Done once the reply is sent; a merged message counts for every
+            # event it answers.
+            sent = await scene.channel.delivered
+            if sent is not None:
+                scene.record.calls += sent.calls
+                scene.record.rate_limited += sent.rate_limited
+
+    async def slash(event, scene):
+        command = getattr(type(cog), event["type"])
+        arguments = () if event["type"] == "getall" else (event["tag"],)
+        await command.callback(cog, scene.interaction(), *arguments)
+
+    async def autocomplete(event, scene):
+        await cog.tag_autocomplete(scene.interaction(), event["prefix"])
+
+    async def modal(event, scene):
+        modal_class = AddTagModal if event["type"] == "add" else UpdateTagModal
+        values = {"tag": event["tag"], "message": event["content"]}
+        # The slash command opens the modal, then its submission is handled.
+        await getattr(type(cog), event["type"]).callback(cog, scene.interaction())
+        await modal_class(server_id=event["guild"]).callback(
+            scene.interaction(text_values=values)
+        )
+
+    return {
+        "message": message,
+        "message_tag": message,
+        "get": slash,
+        "getall": slash,
+        "remove": slash,
+        "reset": slash,
+        "autocomplete": autocomplete,
+        "add": modal,
+        "update": modal,
+    }
+
+
+async def _dispatch(handler, event, scene, record, due):
+    """Runs the handler of an event and records its outcome."""
+    try:
+        await handler(event, scene)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        record.error = f"{type(error).__name__}: {error}"
+    record.latency = time.perf_counter() - due
+
+
+class _TracedDispatcher:  # pylint: disable=too-few-public-methods
+    """Hands the future of every queued reply to the channel of its event."""
+
+    def __init__(self, dispatcher):
+        self._dispatcher = dispatcher
+
+    def enqueue(self, channel, parts):
+        """Queues replies with the wrapped dispatcher."""
+        channel.delivered = self._dispatcher.enqueue(channel, parts)
+        return channel.delivered
+
+
+async def replay(trace, options):
+    """
+    Dispatches the events of a trace to the handlers when they are due.
+
+    Every event runs in its own task, as disnake dispatches them, so slow
+    handlers do not delay the events after them.
+
+    Args:
+    - trace (iterable): The events, ordered by their "at" second.
+    - options (argparse.Namespace): The parsed command line.
+
+    Returns:
+    - tuple: The list of event records and the FakeDiscord stand-in.
+    """
+    # pylint: disable=import-outside-toplevel
+    from commands import tag_command
+    from dispatcher import dispatcher
+
+    tag_command.dispatcher = _TracedDispatcher(dispatcher)
+
+    discord = FakeDiscord(
+        options.api_latency,
+        options.api_jitter,
+        options.route_limit,
+        options.route_period,
+        options.global_limit,
+        options.seed,
+    )
+
+    class _Bot:  # pylint: disable=too-few-public-methods
+        user = FakeMember(0)
+
+    handlers = _handlers(tag_command.TagCommands(_Bot()))
+    records, tasks = [], []
+    started = time.perf_counter()
+    for event in trace:
+        due = started + event["at"] / options.speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        record = _Record(event["type"])
+        records.append(record)
+        scene = _Scene(discord, record, event, options.member_cache)
+        tasks.append(
+            asyncio.create_task(
+                _dispatch(handlers[event["type"]], event, scene, record, due)
+            )
+        )
+    await asyncio.gather(*tasks)
+    return records, discord
+
+
+def _summarize(records):
+    """Returns the latency percentiles and API calls of a set of event records."""
+    latencies = sorted(record.latency for record in records)
+    errors = [record.error for record in records if record.error]
+    return {
+        "events": len(records),
+        "errors": len(errors),
+        "first_errors": sorted(set(errors))[:5],
+        "p50_ms": to_ms(percentile(latencies, 0.50)),
+        "p90_ms": to_ms(percentile(latencies, 0.90)),
+        "p99_ms": to_ms(percentile(latencies, 0.99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+        "api_calls": sum(record.calls for record in records),
+        "api_calls_per_event": (
+            sum(record.calls for record in records) / len(records) if records else None
+        ),
+        "rate_limited": sum(record.rate_limited for record in records),
+    }
+
+
+async def _run(options, layout):
+    """Prepares the database, replays the trace and returns the report."""
+    # pylint: disable=import-outside-toplevel
+    from db.sqlite_handler import db_setup, db_teardown
+
+    if options.trace:
+        with open(options.trace, encoding="utf-8") as file:
+            trace = [json.loads(line) for line in file if line.strip()]
+    else:
+        trace = list(
+            synthetic_trace(layout, options.rate, options.duration, options.seed)
+        )
+        if options.record:
+            with open(options.record, "w", encoding="utf-8") as file:
+                file.writelines(json.dumps(event) + "\n" for event in trace)
+
+    await db_setup()
+    try:
+        started = time.perf_counter()
+        records, discord = await replay(trace, options)
+        elapsed = time.perf_counter() - started
+    finally:
+        await db_teardown()
+
+    kinds = {}
+    for record in records:
+        kinds.setdefault(record.kind, []).append(record)
+    total = _summarize(records)
+    # Merged messages count for every event they answer, so the sum over
+    # events counts them several times; the stand-in counts each call once.
+    total["api_calls"] = sum(discord.calls.values())
+    total["api_calls_per_event"] = (
+        total["api_calls"] / len(records) if records else None
+    )
+    total["rate_limited"] = discord.rate_limited
+    return {
+        "seconds": elapsed,
+        "events_per_second": len(records) / elapsed if elapsed else None,
+        "total": total,
+        "events": {kind: _summarize(kinds[kind]) for kind in sorted(kinds)},
+        "api_routes": discord.calls,
+    }
+
+
+def _format_row(name, result):
+    """Formats the results of a kind of event for the terminal."""
+    return (
+        f"{name:<14} {result['events']:>7} events"
+        f"  p50 {result['p50_ms'] or 0:>8.3f} ms"
+        f"  p99 {result['p99_ms'] or 0:>8.3f} ms"
+        f"  {result['api_calls_per_event'] or 0:>5.2f} calls/event"
+        f"  429s {result['rate_limited']}  errors {result['errors']}"
+    )
+
+
+def _parse_args():
+    """Parses the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--tags", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="copy of a database to use; it is modified")
+    parser.add_argument("--trace", help="JSON lines trace to replay")
+    parser.add_argument("--record", help="write the synthetic trace to this file")
+    parser.add_argument("--rate", type=float, default=200, help="events per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="replay speed of the trace"
+    )
+    parser.add_argument(
+        "--api-latency", type=float, default=0.05, help="seconds per API call"
+    )
+    parser.add_argument("--api-jitter", type=float, default=0.01)
+    parser.add_argument(
+        "--route-limit", type=int, default=5, help="requests per route bucket"
+    )
+    parser.add_argument(
+        "--route-period", type=float, default=5.0, help="seconds per route bucket"
+    )
+    parser.add_argument(
+        "--global-limit", type=int, default=50, help="requests per second, 0 for none"
+    )
+    parser.add_argument(
+        "--member-cache",
+        type=float,
+        default=0.8,
+        help="share of members in the gateway member cache",
+    )
+    parser.add_argument("--output", default="replay.json")
+    return parser.parse_args()
+
+
+def main():
+    """Parses the command line, replays the trace and writes the results as JSON."""
+    options = _parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        if options.db is None:
+            options.db = os.path.join(directory, "replay.db")
+            layout = generate(options.db, options.guilds, options.tags, options.seed)
+        else:
+            layout = read_layout(options.db)
+        os.environ["DB_PATH"] = options.db
+        results = asyncio.run(_run(options, layout))
+
+    for kind, result in results["events"].items():
+        print(_format_row(kind, result), file=sys.stderr)
+    print(_format_row("total", results["total"]), file=sys.stderr)
+
+    write_report("replay", options, results)
+
+
+if __name__ == "__main__":
+    main()
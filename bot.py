@@ -12,24 +12,155 @@ import sentry_sdk
 from disnake.ext import commands
 
 import config
+import metrics
+from cluster import listen_supervisor, metrics_options, report_health
 from context_menu import ContextMenuCommands
-from db.sqlite_handler import db_setup
+from db.sqlite_handler import db_setup, db_teardown, forget_guild, partition_state
+from dispatcher import dispatcher
 from helper import sentry_capture
+from member_cache import display_names
+from sampling import AdaptiveSampler, parse_rates, transaction
+from sharding import shard_options
+from startup import startup_timings, sync_commands
 
+sampler = AdaptiveSampler(
+    rates=parse_rates(config.SENTRY_TRACES_RATES),
+    default_rate=config.SENTRY_TRACES_SAMPLE_RATE,
+    profiles_rate=config.SENTRY_PROFILES_SAMPLE_RATE,
+    slow_threshold=config.SENTRY_SLOW_TRANSACTION,
+    max_per_second=config.SENTRY_MAX_TRANSACTIONS_PER_SECOND,
+)
 sentry_sdk.init(
     dsn=config.SENTRY_DSN,
-    traces_sample_rate=1.0,
-    profiles_sample_rate=1.0,
+    traces_sampler=sampler.traces_sampler,
+    profiles_sampler=sampler.profiles_sampler,
+    before_send_transaction=sampler.before_send_transaction,
 )
 
-intents = disnake.Intents.all()
-intents.presences = False
 
-bot = commands.Bot(
+# A single gateway connection, unless sharding is configured. AUTO_SHARD
+# alone uses the shard count recommended by Discord.
+BotBase = (
+    commands.AutoShardedBot
+    if config.AUTO_SHARD or config.SHARD_COUNT or config.SHARD_IDS
+    else commands.Bot
+)
+
+
+class TagsyBot(BotBase):
+    """
+    The Tagsy bot, preparing its storage and cogs once before connecting,
+    tracing its commands and releasing its storage resources when it shuts
+    down.
+    """
+
+    async def start(self, token, *, reconnect=True, ignore_session_start_limit=False):
+        """
+        Runs the startup pipeline, then connects to Discord.
+
+        Storage, cogs and metrics are set up here rather than in `on_ready`,
+        which fires again after every reconnect, and before connecting, so no
+        event is handled before they are ready. Application commands are
+        registered in the background, only when they changed.
+        """
+        with startup_timings.phase("storage"):
+            await db_setup()
+        with startup_timings.phase("extensions"):
+            self._load_cogs()
+        with startup_timings.phase("metrics"):
+            report_health(self)  # Only when running as a worker of cluster.py
+            listen_supervisor(forget_guild)
+            await metrics.start(self, **metrics_options())
+        self.loop.create_task(self._sync_commands())
+
+        startup_timings.begin("gateway")
+        await super().start(
+            token,
+            reconnect=reconnect,
+            ignore_session_start_limit=ignore_session_start_limit,
+        )
+
+    def _load_cogs(self):
+        """Loads every extension of the "./commands" directory and the context menus."""
+        for filename in sorted(os.listdir("./commands")):
+            if filename.endswith(".py") and not filename.startswith("_"):
+                extension = filename[:-3]
+                try:
+                    self.load_extension(f"commands.{extension}")
+                    print(f"Loaded extension: {extension}")
+                except commands.errors.ExtensionNotFound as e:
+                    sentry_capture(
+                        commands.errors.ExtensionNotFound(
+                            f"Extension not found: {extension}"
+                        ),
+                        0,
+                        0,
+                    )
+                    print(f"Failed to load extension {extension}.", e)
+        self.add_cog(ContextMenuCommands(self))
+
+    async def _sync_commands(self):
+        """Registers the application commands, reporting failures to Sentry."""
+        try:
+            if await sync_commands(self):
+                print("Application commands registered")
+        except disnake.HTTPException as e:
+            sentry_capture(e)
+            print("Failed to register the application commands.", e)
+
+    async def process_application_commands(self, interaction):
+        """Runs an application command in a Sentry transaction."""
+        with transaction("application_command", interaction.data.name):
+            await super().process_application_commands(interaction)
+
+    async def invoke(self, ctx):
+        """Runs a prefix command, all of them owner commands, in a Sentry transaction."""
+        if ctx.command is None:
+            # Every message goes through here; only trace actual commands.
+            await super().invoke(ctx)
+            return
+        with transaction("owner_command", ctx.command.qualified_name):
+            await super().invoke(ctx)
+
+    async def close(self):
+        """
+        Sends the queued replies, closes the connection to Discord, then the
+        database connection pool.
+        """
+        await dispatcher.close()
+        await super().close()
+        await db_teardown()
+
+
+if config.LEAN_GATEWAY:
+    # Only what tag triggers and owner commands need. Without the members
+    # intent nor chunking no member is cached, which on big bots is most of
+    # the memory; display names are fetched on demand by member_cache.py.
+    # Nor does on_member_update fire, so a renamed member keeps their old
+    # name in tag embeds for up to MEMBER_NAME_TTL seconds.
+    intents = disnake.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    cache_options = {
+        "member_cache_flags": disnake.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+    }
+else:
+    intents = disnake.Intents.all()
+    intents.presences = False
+    cache_options = {}
+
+bot = TagsyBot(
     intents=intents,
     command_prefix="!!!",
     help_command=None,
-    command_sync_flags=commands.CommandSyncFlags.all(),
+    # Registered by sync_commands() instead, only when they changed.
+    command_sync_flags=commands.CommandSyncFlags.none(),
+    max_messages=config.MESSAGE_CACHE_SIZE,
+    **cache_options,
+    **shard_options(),
 )
 
 
@@ -37,11 +168,11 @@ bot = commands.Bot(
 async def on_ready():
     """
     Event handler that is called when the bot is ready to start receiving events from
-    Discord.
+    Discord, after connecting and after every reconnect.
 
-    This function prints a message to indicate that the bot has connected to Discord and then
-    initializes the database.
-    It also loads all the command extensions from the "./commands" directory.
+    This function prints a message to indicate that the bot has connected to Discord and
+    splits the in-memory structures between the shards. The first time, it also prints
+    how long each phase of the startup took.
 
     Args:
         None
@@ -50,24 +181,12 @@ async def on_ready():
         None
     """
     print(f"{bot.user} has connected to Discord!")
-    await db_setup()  # Setup the database
-
-    for filename in os.listdir("./commands"):
-        if filename.endswith(".py") and not filename.startswith("_"):
-            extension = filename[:-3]
-            try:
-                bot.load_extension(f"commands.{extension}")
-                print(f"Loaded extension: {extension}")
-            except commands.errors.ExtensionNotFound as e:
-                sentry_capture(
-                    commands.errors.ExtensionNotFound(
-                        f"Extension not found: {extension}"
-                    ),
-                    0,
-                    0,
-                )
-                print(f"Failed to load extension {extension}.", e)
-    bot.add_cog(ContextMenuCommands(bot))
+    # Automatic sharding only knows the shard count once connected.
+    shard_ids = getattr(bot, "shard_ids", None)
+    partition_state(bot.shard_count or 1, shard_ids)
+    display_names.repartition(bot.shard_count or 1, shard_ids)
+    if startup_timings.end("gateway"):
+        print(f"Started in {startup_timings.summary()}")
 
 
 bot.run(config.TOKEN)
@@ -0,0 +1,535 @@
+# -*- coding: utf-8 -*-
+"""
+This is the cluster launcher of Tagsy, run instead of bot.py to use several
+CPU cores.
+
+It starts CLUSTER_WORKERS processes running bot.py, each owning a contiguous
+range of the shards, and supervises them: crashed workers are restarted with
+an exponential backoff, and every worker reports its health over a pipe so
+the supervisor can aggregate it. All workers share the same SQLite database,
+which WAL journaling and the pool's immediate write transactions make safe.
+
+Functions:
+- split_shards(shard_count, workers):
+Splits the shard IDs into contiguous ranges, one per worker.
+
+- report_health(bot):
+Starts sending the health of a worker to its supervisor.
+
+- request_restart(shard_ids=None):
+Asks the supervisor to restart other workers.
+
+- request_forget_guild(server_id, shard_ids):
+Asks the workers owning some shards to drop the in-memory state of a server.
+
+- listen_supervisor(forget_guild):
+Starts handling the messages the supervisor forwards to this worker.
+
+- metrics_options():
+Returns where the metrics server of this process should listen.
+
+Classes:
+- Supervisor:
+Starts, restarts and aggregates the health of the worker processes.
+"""
+
+import asyncio
+import json
+import os
+import resource
+import signal
+import sys
+import time
+
+import aiohttp
+
+import config
+import metrics
+from sharding import shard_stats
+
+# Environment variables passed to the workers.
+WORKER_ID_VARIABLE = "CLUSTER_WORKER_ID"
+HEALTH_FD_VARIABLE = "CLUSTER_HEALTH_FD"
+
+# The script run by every worker.
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+# A worker running this long is considered stable, resetting its backoff.
+STABLE_AFTER = 60.0
+MAX_BACKOFF = 60.0
+
+
+def split_shards(shard_count, workers):
+    """
+    Splits the shard IDs into contiguous ranges, one per worker.
+
+    Args:
+    - shard_count (int): The total number of shards.
+    - workers (int): The number of worker processes.
+
+    Returns:
+    - list: A list of shard ID lists, without empty ones.
+    """
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for worker in range(workers):
+        end = start + size + (1 if worker < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+async def recommended_shard_count(token):
+    """Returns the number of shards Discord recommends for the bot."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v10/gateway/bot",
+            headers={"Authorization": f"Bot {token}"},
+        ) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+
+def _send(message):
+    """Sends a message to the supervisor, if running as a worker."""
+    fd = os.getenv(HEALTH_FD_VARIABLE)
+    if fd is None:
+        return
+    line = (json.dumps(message) + "\n").encode("utf-8")
+    try:
+        # Lines shorter than PIPE_BUF are written atomically. The pipe is
+        # non-blocking, so a stuck supervisor can never block the worker.
+        os.write(int(fd), line)
+    except (BlockingIOError, BrokenPipeError):
+        pass
+
+
+def _health(bot):
+    """Returns the health report of this worker."""
+    return {
+        "type": "health",
+        "worker_id": int(os.environ[WORKER_ID_VARIABLE]),
+        "pid": os.getpid(),
+        "ready": bot.is_ready(),
+        "shards": shard_stats.sample(bot),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+_reporter = None  # pylint: disable=invalid-name
+
+
+def report_health(bot, interval=None):
+    """
+    Starts sending the health of a worker to its supervisor every `interval`
+    seconds. Does nothing if the bot is not running as a cluster worker, or if
+    the reports are already being sent.
+
+    Args:
+    - bot (disnake.Client): The bot of this worker.
+    - interval (float): The number of seconds between two reports,
+      CLUSTER_HEALTH_INTERVAL by default.
+    """
+    global _reporter  # pylint: disable=global-statement
+    fd = os.getenv(HEALTH_FD_VARIABLE)
+    if fd is None or (_reporter is not None and not _reporter.done()):
+        return
+    os.set_blocking(int(fd), False)
+
+    async def run():
+        while True:
+            _send(_health(bot))
+            await asyncio.sleep(interval or config.CLUSTER_HEALTH_INTERVAL)
+
+    _reporter = asyncio.get_running_loop().create_task(run())
+
+
+def request_restart(shard_ids=None):
+    """
+    Asks the supervisor to restart other workers, for instance once the
+    database file was replaced under them. Does nothing outside a cluster.
+
+    Args:
+    - shard_ids (list): Only restart the workers owning these shards; every
+      other worker if None.
+    """
+    _send({"type": "restart", "shards": shard_ids})
+
+
+def request_forget_guild(server_id, shard_ids):
+    """
+    Asks the workers owning some shards to drop the in-memory state of a
+    server, for instance once its tags were purged. Unlike a restart, their
+    gateway connections are kept. Does nothing outside a cluster.
+
+    Args:
+    - server_id (str): The ID of the server.
+    - shard_ids (list): The shards of the workers to notify.
+    """
+    _send({"type": "forget_guild", "server_id": str(server_id), "shards": shard_ids})
+
+
+_listener = None  # pylint: disable=invalid-name
+
+
+def listen_supervisor(forget_guild):
+    """
+    Starts handling the messages the supervisor forwards to this worker over
+    its standard input. Does nothing if the bot is not running as a cluster
+    worker, or if the messages are already being handled.
+
+    Args:
+    - forget_guild (callable): Called with the ID of every server whose
+      in-memory state must be dropped.
+    """
+    global _listener  # pylint: disable=global-statement
+    if os.getenv(HEALTH_FD_VARIABLE) is None or (
+        _listener is not None and not _listener.done()
+    ):
+        return
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+        )
+        while line := await reader.readline():
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if message.get("type") == "forget_guild":
+                forget_guild(message["server_id"])
+
+    _listener = asyncio.get_running_loop().create_task(run())
+
+
+def _worker_metrics_port(worker_id):
+    """Returns the local port the metrics server of a worker listens on."""
+    return config.METRICS_PORT + 1 + worker_id
+
+
+def metrics_options():
+    """
+    Returns where the metrics server of this process should listen.
+
+    Workers listen on a local port of their own, scraped by the supervisor,
+    which serves the aggregated metrics on METRICS_PORT.
+
+    Returns:
+    - dict: The keyword arguments to pass to `metrics.start()`.
+    """
+    worker_id = os.getenv(WORKER_ID_VARIABLE)
+    if worker_id is None:
+        return {}
+    if not config.METRICS_PORT:
+        return {"port": 0}
+    return {"port": _worker_metrics_port(int(worker_id)), "host": "127.0.0.1"}
+
+
+def _merge_metrics(expositions):
+    """
+    Merges the metrics of several workers, adding a `worker` label to every
+    sample and keeping the samples of a metric together.
+
+    Args:
+    - expositions (list): (worker_id, text) pairs in the Prometheus text format.
+
+    Returns:
+    - str: The merged metrics.
+    """
+    families = {}
+    for worker_id, text in expositions:
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("#"):
+                family = families.setdefault(line.split(" ", 3)[2], ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif family is not None:
+                label = f'worker="{worker_id}"'
+                if "{" in line.split(" ", 1)[0]:
+                    line = line.replace("{", "{" + label + ",", 1)
+                else:
+                    name, value = line.split(" ", 1)
+                    line = f"{name}{{{label}}} {value}"
+                family[1].append(line)
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+# pylint: disable=too-few-public-methods,too-many-instance-attributes
+class _Worker:
+    """The state of a worker process, as seen by the supervisor."""
+
+    def __init__(self, worker_id, shard_ids):
+        self.worker_id = worker_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = 1.0
+        self.health = None
+        self.reported_at = None
+
+    @property
+    def running(self):
+        """bool: True if the process is alive."""
+        return self.process is not None and self.process.returncode is None
+
+
+class Supervisor:
+    """
+    Starts, restarts and aggregates the health of the worker processes.
+
+    Attributes:
+    - shard_count (int): The total number of shards.
+    - workers (list): The state of every worker.
+    - script (str): The path of the script run by every worker.
+    """
+
+    def __init__(self, shard_count, workers, script=BOT_SCRIPT):
+        self.shard_count = shard_count
+        self.script = script
+        self.workers = [
+            _Worker(worker_id, shard_ids)
+            for worker_id, shard_ids in enumerate(split_shards(shard_count, workers))
+        ]
+        self._stopping = asyncio.Event()
+        self._restarting = set()
+        metrics.Gauge(
+            "tagsy_cluster_worker_up",
+            "Whether each worker process is running.",
+            lambda: [
+                ({"worker": worker.worker_id}, int(worker.running))
+                for worker in self.workers
+            ],
+            labels=("worker",),
+        )
+        metrics.Gauge(
+            "tagsy_cluster_worker_restarts",
+            "Number of times each worker was restarted after a crash.",
+            lambda: [
+                ({"worker": worker.worker_id}, worker.restarts)
+                for worker in self.workers
+            ],
+            labels=("worker",),
+        )
+
+    async def _spawn(self, worker):
+        """Starts the process of a worker and reads its reports until it exits."""
+        read_fd, write_fd = os.pipe()
+        env = dict(
+            os.environ,
+            SHARD_COUNT=str(self.shard_count),
+            SHARD_IDS=",".join(map(str, worker.shard_ids)),
+            **{
+                WORKER_ID_VARIABLE: str(worker.worker_id),
+                HEALTH_FD_VARIABLE: str(write_fd),
+            },
+        )
+        try:
+            worker.process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                self.script,
+                env=env,
+                pass_fds=(write_fd,),
+                # Carries the messages forwarded by the supervisor.
+                stdin=asyncio.subprocess.PIPE,
+            )
+        finally:
+            os.close(write_fd)
+        worker.started_at = time.monotonic()
+        worker.health = None
+        print(
+            f"Worker {worker.worker_id} started (pid {worker.process.pid}, "
+            + f"shards {worker.shard_ids[0]}-{worker.shard_ids[-1]})"
+        )
+
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb")
+        )
+        try:
+            while line := await reader.readline():
+                self._handle(worker, line)
+        finally:
+            transport.close()
+        return await worker.process.wait()
+
+    def _handle(self, worker, line):
+        """Handles a message sent by a worker."""
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return
+        if message.get("type") == "health":
+            worker.health = message
+            worker.reported_at = time.monotonic()
+        elif message.get("type") == "restart":
+            shard_ids = message.get("shards")
+            for other in self.workers:
+                if other is worker or not other.running:
+                    continue
+                if shard_ids is None or set(shard_ids) & set(other.shard_ids):
+                    self._restarting.add(other.worker_id)
+                    other.process.terminate()
+        elif message.get("type") == "forget_guild":
+            for other in self.workers:
+                if other is worker or not other.running:
+                    continue
+                if set(message.get("shards") or ()) & set(other.shard_ids):
+                    other.process.stdin.write(line)
+
+    async def _supervise(self, worker):
+        """Keeps a worker running until the supervisor stops."""
+        while not self._stopping.is_set():
+            code = await self._spawn(worker)
+            if self._stopping.is_set():
+                break
+
+            if worker.worker_id in self._restarting:
+                self._restarting.discard(worker.worker_id)
+                print(f"Worker {worker.worker_id} restarted on request")
+                continue
+
+            if time.monotonic() - worker.started_at > STABLE_AFTER:
+                worker.backoff = 1.0
+            worker.restarts += 1
+            print(
+                f"Worker {worker.worker_id} exited with code {code}, "
+                + f"restarting in {worker.backoff:.0f}s"
+            )
+            try:
+                await asyncio.wait_for(self._stopping.wait(), worker.backoff)
+            except asyncio.TimeoutError:
+                pass
+            worker.backoff = min(worker.backoff * 2, MAX_BACKOFF)
+
+    def health(self):
+        """
+        Aggregates the health reports of every worker.
+
+        A worker is healthy if it is running, connected and reported within
+        the last three report intervals.
+
+        Returns:
+        - dict: The overall state, totals across shards and per-worker details.
+        """
+        now = time.monotonic()
+        workers = []
+        shards = []
+        for worker in self.workers:
+            report = worker.health or {}
+            healthy = (
+                worker.running
+                and report.get("ready", False)
+                and worker.reported_at is not None
+                and now - worker.reported_at < 3 * config.CLUSTER_HEALTH_INTERVAL
+            )
+            shards.extend(report.get("shards", []))
+            workers.append(
+                {
+                    "worker_id": worker.worker_id,
+                    "shard_ids": worker.shard_ids,
+                    "pid": worker.process.pid if worker.running else None,
+                    "healthy": healthy,
+                    "restarts": worker.restarts,
+                    "max_rss_kb": report.get("max_rss_kb"),
+                }
+            )
+        return {
+            "healthy": all(worker["healthy"] for worker in workers),
+            "shard_count": self.shard_count,
+            "guilds": sum(shard["guilds"] for shard in shards),
+            "events_per_second": sum(shard["events_per_second"] for shard in shards),
+            "max_latency": max((shard["latency"] for shard in shards), default=None),
+            "workers": workers,
+        }
+
+    async def _log_health(self):
+        """Prints the aggregated health every report interval."""
+        while True:
+            await asyncio.sleep(config.CLUSTER_HEALTH_INTERVAL)
+            health = self.health()
+            healthy = sum(worker["healthy"] for worker in health["workers"])
+            print(
+                f"Cluster: {healthy}/{len(health['workers'])} workers healthy, "
+                + f"{health['guilds']} guilds, "
+                + f"{health['events_per_second']:.1f} events/s"
+            )
+
+    async def _scrape(self, session, worker):
+        """Returns the metrics of a worker, or an empty string if unavailable."""
+        url = f"http://127.0.0.1:{_worker_metrics_port(worker.worker_id)}/metrics"
+        try:
+            async with session.get(url) as response:
+                return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return ""
+
+    async def _metrics(self):
+        """Answers /metrics with the metrics of every running worker."""
+        running = [worker for worker in self.workers if worker.running]
+        timeout = aiohttp.ClientTimeout(total=2)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            texts = await asyncio.gather(
+                *(self._scrape(session, worker) for worker in running)
+            )
+        body = metrics.render() + _merge_metrics(
+            [(worker.worker_id, text) for worker, text in zip(running, texts)]
+        )
+        return 200, "text/plain; version=0.0.4; charset=utf-8", body
+
+    async def _health(self):
+        """Answers /health with the aggregated health of the workers."""
+        health = self.health()
+        return 200 if health["healthy"] else 503, "application/json", json.dumps(health)
+
+    def stop(self):
+        """Stops every worker; they are not restarted anymore."""
+        self._stopping.set()
+        for worker in self.workers:
+            if worker.running:
+                worker.process.terminate()
+
+    async def run(self):
+        """Runs the workers until `stop()` is called."""
+        logger = asyncio.create_task(self._log_health())
+        server = None
+        if config.METRICS_PORT:
+            server = await metrics.serve(
+                config.METRICS_PORT,
+                {"/metrics": self._metrics, "/health": self._health},
+                config.METRICS_HOST,
+            )
+        try:
+            await asyncio.gather(*(self._supervise(worker) for worker in self.workers))
+        finally:
+            logger.cancel()
+            if server is not None:
+                server.close()
+
+
+async def main():
+    """Starts the cluster and supervises it until SIGINT or SIGTERM."""
+    shard_count = config.SHARD_COUNT or await recommended_shard_count(config.TOKEN)
+    supervisor = Supervisor(shard_count, config.CLUSTER_WORKERS)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, supervisor.stop)
+    print(f"Starting {len(supervisor.workers)} workers for {shard_count} shards")
+    await supervisor.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
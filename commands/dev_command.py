@@ -7,13 +7,20 @@ This module provides functionality to download the database dump.
 
 import csv
 import os
+import sqlite3
 from io import StringIO
 
+import aiohttp
 import disnake
 from disnake.ext import commands
 
-from db.sqlite_handler import DB_PATH, get_all_tags_for_all_servers, purge_tags
+from cluster import request_forget_guild, request_restart
+from db.backup import snapshot_database, stage_database
+from db.export import export_tags_csv
+from db.sqlite_handler import purge_tags, replace_database, tag_cache
 from helper import sentry_capture
+from metrics import memory_per_guild, resident_memory
+from sharding import shard_for_guild, shard_stats
 
 
 class DevCommands(commands.Cog):
@@ -39,7 +46,12 @@ class DevCommands(commands.Cog):
     @commands.is_owner()
     async def send_database(self, ctx: commands.Context):
         """
-        Sends the database file to the bot owner via direct message.
+        Sends a compressed snapshot of the database to the bot owner via direct
+        message.
+
+        The snapshot is taken with SQLite's online backup API, so it is
+        consistent even while other commands keep writing, and its SHA-256
+        checksum is sent along with it.
 
         This command is only available to the bot owner.
 
@@ -48,6 +60,7 @@ class DevCommands(commands.Cog):
 
         Raises:
         - FileNotFoundError: If the database file is not found.
+        - sqlite3.Error: If the snapshot of the database fails.
         - disnake.Forbidden: If the bot doesn't have permission to send direct messages to the user.
         - disnake.HTTPException: If an error occurs while sending the file.
 
@@ -55,11 +68,16 @@ class DevCommands(commands.Cog):
         - None
         """
         try:
-            with open(DB_PATH, "rb") as db_file:
+            output, size, checksum = await snapshot_database()
+            with output:
                 await ctx.author.send(
-                    "Here is the database file:",
-                    file=disnake.File(db_file, "database.db"),
+                    f"Here is the database file ({size} bytes compressed, "
+                    + f"SHA-256 of the database: `{checksum}`):",
+                    file=disnake.File(output, "database.db.gz"),
                 )
+        except sqlite3.Error as e:
+            sentry_capture(e, ctx.guild.id if ctx.guild else 0, ctx.author.id)
+            await ctx.send(f"Failed to snapshot the database: {e}", ephemeral=True)
         except FileNotFoundError:
             sentry_capture(
                 # pylint: disable=E1120
@@ -123,22 +141,35 @@ class DevCommands(commands.Cog):
         """
         Imports the database file from the bot owner via direct message.
 
+        The attachment (a .db file, or a .db.gz file as sent by `senddb`) is
+        staged next to the live database and validated first. The live file is
+        then swapped atomically once in-flight operations are drained, and the
+        in-memory caches are rebuilt, without restarting the bot.
+
         This command is only available to the bot owner.
 
         Parameters:
         - ctx (disnake.Context): The context object representing the invocation of the command.
 
         Raises:
-        - disnake.HTTPException: If there is an error while downloading the attachment.
+        - aiohttp.ClientError: If there is an error while downloading the attachment.
         - IOError: If there is an error while saving the file.
+        - ValueError: If the file is not a valid database.
+        - sqlite3.DatabaseError: If the file is not a SQLite database.
 
         Returns:
         - None
         """
         try:
             attachment = ctx.message.attachments[0]
-            if attachment.filename.endswith(".db"):
-                await attachment.save(DB_PATH)
+            if attachment.filename.endswith((".db", ".db.gz")):
+                path = await stage_database(
+                    attachment.url,
+                    compressed=attachment.filename.endswith(".gz"),
+                )
+                await replace_database(path)
+                # Other cluster workers still have the old file open.
+                request_restart()
                 await ctx.send("Database file imported.")
             else:
                 sentry_capture(
@@ -146,8 +177,13 @@ class DevCommands(commands.Cog):
                     ctx.guild.id if ctx.guild else 0,
                     ctx.author.id,
                 )
-                await ctx.send("Invalid file format. Please upload a .db file.")
-        except disnake.HTTPException as e:
+                await ctx.send(
+                    "Invalid file format. Please upload a .db or .db.gz file."
+                )
+        except (ValueError, sqlite3.DatabaseError) as e:
+            sentry_capture(e, ctx.guild.id if ctx.guild else 0, ctx.author.id)
+            await ctx.send(f"Invalid database file, nothing was imported: {e}")
+        except aiohttp.ClientError as e:
             await ctx.send(f"Failed to download the attachment: {e}")
         except IOError as e:
             await ctx.send(f"Failed to save the file: {e}")
@@ -163,12 +199,15 @@ class DevCommands(commands.Cog):
     @commands.is_owner()
     async def dump_csv(self, ctx: commands.Context):
         """
-        Dumps all tags from all servers into a CSV file, including server ID, tag,
-        content,.
+        Dumps all tags from all servers into a gzip-compressed CSV file, including
+        server ID, tag, content,.
 
         created by, creation date, and usage count, then sends this file to the bot
         owner.
 
+        The rows are streamed from the database and compressed chunk by chunk into
+        a temporary file, so the dump never holds every tag in memory.
+
         Parameters:
         - ctx (commands.Context): The context of the command.
 
@@ -178,39 +217,13 @@ class DevCommands(commands.Cog):
         - disnake.HTTPException: If there is an error sending the file via DM.
         """
         try:
-            tags_data = await get_all_tags_for_all_servers()
-            with StringIO() as output:
-                writer = csv.writer(output)
-                # Write the header of the CSV file
-                writer.writerow(
-                    [
-                        "Server ID",
-                        "Tag",
-                        "Content",
-                        "Created By",
-                        "Created At",
-                        "Usage Count",
-                    ]
-                )
-
-                # Write each row from the tags_data dictionary
-                for tag in tags_data:
-                    writer.writerow(
-                        [
-                            tag["server_id"],
-                            tag["tag"],
-                            tag["content"],
-                            tag["created_by"],
-                            tag["created_at"],
-                            tag["usage_count"],
-                        ]
-                    )
-
-                output.seek(0)  # Go back to the start of the StringIO object
+            output, row_count, size = await export_tags_csv()
+            with output:
                 # Send the generated CSV file
                 await ctx.author.send(
-                    "Here is the CSV dump of all tags:",
-                    file=disnake.File(fp=output, filename="tags_dump.csv"),
+                    f"Here is the CSV dump of all tags ({row_count} tags, "
+                    + f"{size} bytes compressed):",
+                    file=disnake.File(fp=output, filename="tags_dump.csv.gz"),
                 )
 
             await ctx.send("CSV dump of tags has been sent via DM.")
@@ -301,9 +314,48 @@ class DevCommands(commands.Cog):
         - None
         """
         await ctx.send(f"Purging all tags for the server {server_id}...")
-        purge_tags(server_id)
+        await purge_tags(str(server_id))
+        # The worker owning the server may have its tags cached.
+        request_forget_guild(
+            server_id, [shard_for_guild(server_id, self.bot.shard_count or 1)]
+        )
         await ctx.send(f"All tags have been purged for the server {server_id}.")
 
+    @commands.command(name="shards", hidden=True)
+    @commands.is_owner()
+    async def shards(self, ctx: commands.Context):
+        """
+        Reports the latency, event rate, guild count and cached tag count of
+        every shard, and the memory used by the process.
+
+        The event rate is averaged since the previous use of the command.
+
+        This command is only available to the bot owner.
+
+        Parameters:
+        - ctx (commands.Context): The context object representing the invocation context.
+
+        Returns:
+        - None
+        """
+        cached = tag_cache.shard_sizes()
+        lines = []
+        for sample in shard_stats.sample(self.bot):
+            line = (
+                f"Shard {sample['shard_id']}: {sample['latency'] * 1000:.0f} ms, "
+                + f"{sample['events_per_second']:.1f} events/s, "
+                + f"{sample['guilds']} guilds"
+            )
+            if sample["shard_id"] < len(cached):
+                line += f", {cached[sample['shard_id']]} cached tags"
+            lines.append(line)
+        per_guild = memory_per_guild(self.bot)
+        lines.append(
+            f"Memory: {resident_memory() / 2**20:.0f} MB"
+            + (f", {per_guild / 2**10:.1f} KB per guild" if per_guild else "")
+        )
+        await ctx.send("\n".join(lines))
+
 
 def setup(bot):
     """
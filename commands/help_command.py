@@ -62,7 +62,7 @@ class HelpCommands(commands.Cog):
         if commands.is_owner():
             embed.add_field(
                 name="Development Commands",
-                value="`senddb`, `reload`, `importdb`, `dumpcsv`, `dumpconfig`",
+                value="`senddb`, `reload`, `importdb`, `dumpcsv`, `dumpconfig`, `shards`",
                 inline=False,
             )
         embed.set_footer(
@@ -95,13 +95,17 @@ class HelpCommands(commands.Cog):
             + " Usage: `reload <extension>`",
             "importdb": "Imports a database file. "
             + " Only available to the bot owner. "
-            + " Usage: `importdb` with a .db file attachment",
+            + " Usage: `importdb` with a .db or .db.gz file attachment",
             "dumpcsv": "Dumps all tags from all servers into a CSV file."
             + " Only available to the bot owner. "
             + " Usage: `dumpcsv`",
             "dumpconfig": "Dumps all config variables into a CSV file. "
             + " Only available to the bot owner. "
             + " Usage: `dumpconfig`",
+            "shards": "Reports the latency and event rate of every shard,"
+            + " and the memory used per guild."
+            + " Only available to the bot owner. "
+            + " Usage: `shards`",
         }
 
         description = commands_descriptions.get(command, "Command not found.")
@@ -13,21 +13,27 @@ A Cog for handling commands related to tagging messages within Discord servers.
 import disnake
 from disnake.ext import commands
 
+from config import MAX_TAGS_PER_MESSAGE
+
 # Import functions from the database module to interact with tagged messages.
 from db.sqlite_handler import (
+    complete_tags,
     delete_message,
-    get_all_messages,
     get_message,
+    get_messages,
     get_similar_tags,
     increment_usage_count,
+    increment_usage_counts,
     reset_usage_count,
 )
-from helper import (
-    build_embed,
-    find_tag_in_string,
-    tag_exists,
-)
+from dispatcher import Notice, dispatcher
+from helper import build_embed, find_tag_in_string, tag_exists
+from member_cache import display_names
+from metrics import TAG_HITS, TAG_MISSES, TAG_SUGGESTIONS, TAG_TRIGGERS
 from modals import AddTagModal, UpdateTagModal
+from sampling import transaction
+from throttle import throttle
+from views import TagPagesView
 
 
 class TagCommands(commands.Cog):
@@ -75,26 +81,21 @@ class TagCommands(commands.Cog):
         - None
 
         Raises:
-        - disnake.NotFound: If the user who created the tagged message is not found.
+        - None
         """
         server_id = str(inter.guild.id)
         tag_info = await get_message(server_id, tag)
 
         if tag_info:
-            try:
-                member = await inter.guild.fetch_member(int(tag_info["created_by"]))
-                username = member.display_name
-            except disnake.NotFound:
-                username = "Unknown user"
-
-            embed = build_embed(tag_info, username)
+            username = await display_names.get(inter.guild, int(tag_info["created_by"]))
+            embed = build_embed(tag_info, username, server_id)
             await increment_usage_count(server_id, tag)
             await inter.response.send_message(embed=embed)
         else:
             # Suggest similar tags if the requested tag is not found.
             echo = await get_similar_tags(server_id, tag)
             if echo:
-                suggestions = ", ".join([str(e[0]) for e in echo])
+                suggestions = ", ".join(echo)
                 await inter.response.send_message(
                     f'No message found for tag "{tag}". Suggestions: {suggestions}',
                     ephemeral=True,
@@ -110,7 +111,8 @@ class TagCommands(commands.Cog):
 
         who posted it, when it was posted, and the number of uses.
 
-        Each tagged message is displayed in its own embed.
+        Each tagged message is displayed in its own embed, up to ten embeds per
+        message, with buttons to move between pages.
 
         Parameters:
         - inter (disnake.ApplicationCommandInteraction):
@@ -120,30 +122,15 @@ class TagCommands(commands.Cog):
         None
         """
         server_id = str(inter.guild.id)
-        tags_details = await get_all_messages(
-            server_id
-        )  # Assure this returns detailed info for each tag
-
-        if tags_details:
-            for detail in tags_details:
-                # Fetch the username from the user ID
-                try:
-                    member = await inter.guild.fetch_member(int(detail["created_by"]))
-                    username = member.display_name
-                except disnake.NotFound:
-                    username = "Unknown user"
-
-                embed = build_embed(detail, username)
-                # Check if it's the initial response or a follow-up
-                if inter.response.is_done():
-                    await inter.followup.send(embed=embed, ephemeral=True)
-                else:
-                    await inter.response.send_message(embed=embed, ephemeral=True)
+        view = TagPagesView(inter.guild, server_id)
+        embeds = await view.load_page()
+
+        if embeds:
+            await inter.response.send_message(
+                f"Page {view.page_number}", embeds=embeds, view=view, ephemeral=True
+            )
         else:
-            if not inter.response.is_done():
-                await inter.response.send_message("No tags found.", ephemeral=True)
-            else:
-                await inter.followup.send("No tags found.", ephemeral=True)
+            await inter.response.send_message("No tags found.", ephemeral=True)
 
     @commands.slash_command(name="remove", description="Deletes a tagged message.")
     async def remove(self, inter: disnake.ApplicationCommandInteraction, tag: str):
@@ -165,8 +152,9 @@ class TagCommands(commands.Cog):
         server_id = str(inter.guild.id)
 
         if await tag_exists(server_id, tag):
-            member = inter.guild.get_member(inter.author.id)
-            if member.guild_permissions.manage_messages:
+            # The author of a guild interaction is always a full Member, even
+            # when the member cache is disabled.
+            if inter.author.guild_permissions.manage_messages:
                 await delete_message(server_id, tag)
                 await inter.response.send_message(f'Tag "{tag}" deleted successfully.')
             else:
@@ -176,9 +164,8 @@ class TagCommands(commands.Cog):
         else:
             echo = await get_similar_tags(server_id, tag)
             if echo:
-                suggestions = [str(e[0]) for e in echo]
                 await inter.response.send_message(
-                    f"No message found for tag \"{tag}\". Suggestions: {', '.join(suggestions)}",
+                    f"No message found for tag \"{tag}\". Suggestions: {', '.join(echo)}",
                     ephemeral=True,
                 )
             else:
@@ -233,11 +220,38 @@ class TagCommands(commands.Cog):
                 f'No message found for tag "{tag}".', ephemeral=True
             )
 
+    @get.autocomplete("tag")
+    @remove.autocomplete("tag")
+    @reset.autocomplete("tag")
+    async def tag_autocomplete(
+        self, inter: disnake.ApplicationCommandInteraction, string: str
+    ):
+        """
+        Suggests the tags of the server starting with the text typed so far.
+
+        Called on every keystroke, so it is answered from the in-memory prefix
+        index without querying the database.
+
+        Parameters:
+        - inter: The interaction object representing the autocomplete request.
+        - string: The text typed so far.
+
+        Returns:
+        - list: Up to 25 tag names.
+        """
+        return await complete_tags(str(inter.guild_id), string)
+
     @commands.Cog.listener(name="on_message")
     async def on_message(self, message: disnake.Message):
         """
-        Listens for messages starting with '%' and attempts to retrieve
-        and display the corresponding tagged message.
+        Listens for messages containing '§tag' references and replies with
+        the corresponding tagged messages.
+
+        Every tag of the message, up to MAX_TAGS_PER_MESSAGE, is looked up with
+        a single query and answered in a single reply, queued by the send
+        dispatcher of the channel so bursts are merged and rate limited.
+        Triggers over the limits of their user, channel or guild are dropped
+        without a reply.
 
         Parameters:
         - message (disnake.Message): The message object that triggered the event.
@@ -251,28 +265,59 @@ class TagCommands(commands.Cog):
         if message.author == self.bot.user or not message.content:
             return
 
-        if find_tag_in_string(message.content):
-            tag = find_tag_in_string(message.content)[0]
-            # Check if the tag is within the allowed length
-            if len(tag) < 3 or len(tag) > 25:
-                return
+        # Unique tags of an allowed length, in order of appearance.
+        tags = [
+            tag
+            for tag in dict.fromkeys(find_tag_in_string(message.content))
+            if 3 <= len(tag) <= 25
+        ][:MAX_TAGS_PER_MESSAGE]
+        if not tags:
+            return
+        TAG_TRIGGERS.inc()
+        if not throttle.allow(message.author.id, message.channel.id, message.guild.id):
+            return
+        with transaction("on_message", "tag trigger"):
             server_id = str(message.guild.id)
 
-            tag_info = await get_message(server_id, tag)
-
-            if tag_info:
-                await increment_usage_count(server_id, tag)
-                await message.channel.send(tag_info["content"])
-            else:
+            found = await get_messages(server_id, tags)
+            TAG_HITS.inc(len(found))
+            TAG_MISSES.inc(len(tags) - len(found))
+            if found:
+                await increment_usage_counts(server_id, list(found))
+
+            replies = []
+            for tag in tags:
+                if tag in found:
+                    content = found[tag]["content"]
+                    replies.append(
+                        f"**§{tag}**\n{content}" if len(tags) > 1 else content
+                    )
+                    continue
                 echo = await get_similar_tags(server_id, tag)
                 if echo:
-                    suggestions = [str(e[0]) for e in echo]
-                    await message.channel.send(
-                        f'No message found for tag "{tag}".'
-                        + f"Suggestions: {', '.join(suggestions)}"
+                    TAG_SUGGESTIONS.inc()
+                    replies.append(
+                        Notice(
+                            f'No message found for tag "{tag}". '
+                            + f"Suggestions: {', '.join(echo)}",
+                            tag,
+                        )
                     )
                 else:
-                    await message.channel.send(f'No message found for tag "{tag}".')
+                    replies.append(Notice(f'No message found for tag "{tag}".', tag))
+            dispatcher.enqueue(message.channel, replies)
+
+    @commands.Cog.listener(name="on_member_update")
+    async def on_member_update(self, before: disnake.Member, after: disnake.Member):
+        """
+        Drops the cached display name of a member whose name may have changed.
+
+        Parameters:
+        - before (disnake.Member): The member before the update.
+        - after (disnake.Member): The member after the update.
+        """
+        if before.display_name != after.display_name:
+            display_names.invalidate(after.guild.id, after.id)
 
 
 def setup(bot):
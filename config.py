@@ -20,3 +20,46 @@ TOKEN = os.getenv("DISCORD_TOKEN")
 DATABASE_FILE = os.getenv("DB_PATH")
 BUILD_VERSION = os.getenv("BUILD_VERSION", "default-value")
 SENTRY_DSN = os.getenv("SENTRY_DSN", None)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+TAG_CACHE_SIZE = int(os.getenv("TAG_CACHE_SIZE", "4096"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+USAGE_FLUSH_THRESHOLD = int(os.getenv("USAGE_FLUSH_THRESHOLD", "500"))
+SUGGESTION_LIMIT = int(os.getenv("SUGGESTION_LIMIT", "5"))
+SUGGESTION_INDEX_GUILDS = int(os.getenv("SUGGESTION_INDEX_GUILDS", "1000"))
+PREFIX_INDEX_GUILDS = int(os.getenv("PREFIX_INDEX_GUILDS", "1000"))
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+CONTENT_CACHE_SIZE = int(os.getenv("CONTENT_CACHE_SIZE", "1024"))
+CONTENT_COMPRESS_THRESHOLD = int(os.getenv("CONTENT_COMPRESS_THRESHOLD", "256"))
+TAG_FILTER_EXACT_LIMIT = int(os.getenv("TAG_FILTER_EXACT_LIMIT", "64"))
+MEMBER_NAME_TTL = float(os.getenv("MEMBER_NAME_TTL", "600"))
+MEMBER_NAME_NEGATIVE_TTL = float(os.getenv("MEMBER_NAME_NEGATIVE_TTL", "300"))
+MEMBER_NAME_CACHE_SIZE = int(os.getenv("MEMBER_NAME_CACHE_SIZE", "10000"))
+MAX_TAGS_PER_MESSAGE = int(os.getenv("MAX_TAGS_PER_MESSAGE", "5"))
+SEND_QUEUE_LIMIT = int(os.getenv("SEND_QUEUE_LIMIT", "50"))
+SEND_PRESSURE_DEPTH = int(os.getenv("SEND_PRESSURE_DEPTH", "3"))
+SEND_MAX_MISSING_TAGS = int(os.getenv("SEND_MAX_MISSING_TAGS", "20"))
+THROTTLE_LIMITS = os.getenv("THROTTLE_LIMITS", "user=5/10,channel=15/10,guild=60/10")
+THROTTLE_MAX_KEYS = int(os.getenv("THROTTLE_MAX_KEYS", "100000"))
+AUTO_SHARD = os.getenv("AUTO_SHARD", "false").lower() in ("1", "true", "yes")
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+LEAN_GATEWAY = os.getenv("LEAN_GATEWAY", "false").lower() in ("1", "true", "yes")
+MESSAGE_CACHE_SIZE = (
+    int(os.getenv("MESSAGE_CACHE_SIZE", "0" if LEAN_GATEWAY else "1000")) or None
+)
+SHARD_IDS = [
+    int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id
+] or None
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", str(os.cpu_count() or 1)))
+CLUSTER_HEALTH_INTERVAL = float(os.getenv("CLUSTER_HEALTH_INTERVAL", "15"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8080"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+SENTRY_TRACES_SAMPLE_RATE = float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", "0.1"))
+SENTRY_TRACES_RATES = os.getenv(
+    "SENTRY_TRACES_RATES",
+    "on_message=0.01,application_command=0.1,owner_command=1.0",
+)
+SENTRY_PROFILES_SAMPLE_RATE = float(os.getenv("SENTRY_PROFILES_SAMPLE_RATE", "0.1"))
+SENTRY_SLOW_TRANSACTION = float(os.getenv("SENTRY_SLOW_TRANSACTION", "1.0"))
+SENTRY_MAX_TRANSACTIONS_PER_SECOND = float(
+    os.getenv("SENTRY_MAX_TRANSACTIONS_PER_SECOND", "50")
+)
@@ -31,7 +31,7 @@ class ContextMenuCommands(commands.Cog):
         - None
         """
         modal = AddTagModal(
-            server_id=inter.guild_id,
+            server_id=str(inter.guild_id),
             prefill_message=create_selected_message_content(inter),
         )
         await inter.response.send_modal(modal)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides consistent online snapshots of the database.
+
+Functions:
+- snapshot_database(pages=256):
+Copies the live database with SQLite's online backup API, then compresses it.
+
+- stage_database(url, compressed=False):
+Downloads an uploaded database next to the live one and validates it.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import aiohttp
+
+from db.export import CompressedSpool
+from db.sqlite_handler import DB_PATH, pool
+
+# The columns an imported database must have in its messages table, besides
+# either the content column of older databases or a reference to the
+# contents table, see db/contents.py.
+REQUIRED_COLUMNS = {
+    "id",
+    "server_id",
+    "tag",
+    "created_at",
+    "created_by",
+    "usage_count",
+}
+
+# Writes made by other connections restart an incremental backup; past this
+# many steps the copy is redone in a single step instead.
+MAX_BACKUP_STEPS = 10000
+
+# Uploads are downloaded and decompressed this many bytes at a time.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class _TooManySteps(Exception):
+    """Raised from the backup progress callback to abort a backup."""
+
+
+async def _backup_to(path, pages):
+    """Copies the database into the file at `path`."""
+    # The target is used from the thread of the source connection.
+    target = sqlite3.connect(path, check_same_thread=False)
+    steps = 0
+
+    def progress(status, remaining, total):  # pylint: disable=unused-argument
+        nonlocal steps
+        steps += 1
+        if steps > MAX_BACKUP_STEPS:
+            raise _TooManySteps()
+
+    try:
+        async with pool.reader() as source:
+            try:
+                await source.backup(target, pages=pages, progress=progress, sleep=0.01)
+            except _TooManySteps:
+                # A single step holds one read snapshot until the copy is done,
+                # which in WAL mode does not block the writer.
+                await source.backup(target, pages=-1)
+    finally:
+        await asyncio.to_thread(target.close)
+
+
+def _compress(path):
+    """Compresses a file into a spooled temporary file and hashes its content."""
+    digest = hashlib.sha256()
+    spool = CompressedSpool()
+    with spool as compressed, open(path, "rb") as source:
+        while chunk := source.read(1024 * 1024):
+            digest.update(chunk)
+            compressed.write(chunk)
+    return spool.file, spool.size, digest.hexdigest()
+
+
+async def snapshot_database(pages=256):
+    """
+    Copies the live database with SQLite's online backup API, then compresses it.
+
+    The copy is made `pages` pages at a time from a read connection of the
+    pool, in that connection's thread, pausing between steps so the writer is
+    never held up. Every other command keeps working while the snapshot is
+    taken, and the result is a consistent database even if writes happened
+    during the copy.
+
+    Args:
+      pages (int): The number of pages copied per step.
+
+    Returns:
+      A tuple (file, size, checksum) where file is a binary file positioned at
+      its start, holding the gzip-compressed snapshot, size is its length in
+      bytes and checksum is the SHA-256 of the uncompressed snapshot.
+      The caller is responsible for closing the file.
+    """
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        await _backup_to(path, pages)
+        return await asyncio.to_thread(_compress, path)
+    finally:
+        os.remove(path)
+
+
+def _staging_file():
+    """Creates an empty file next to DB_PATH, returning its descriptor and path."""
+    return tempfile.mkstemp(
+        suffix=".import", dir=os.path.dirname(os.path.abspath(DB_PATH))
+    )
+
+
+async def _download(url, output):
+    """Writes the file at `url` into `output`, one chunk at a time."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(UPLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(output.write, chunk)
+
+
+def _decompress(upload):
+    """Decompresses a gzip file into a new staging file, returning its path."""
+    fd, path = _staging_file()
+    try:
+        with os.fdopen(fd, "wb") as staged, gzip.open(upload, "rb") as source:
+            shutil.copyfileobj(source, staged, UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def _validate(path):
+    """Checks the integrity and the schema of a database file."""
+    conn = sqlite3.connect(path)
+    try:
+        (result,) = conn.execute("PRAGMA integrity_check").fetchone()
+        if result != "ok":
+            raise ValueError(f"Integrity check failed: {result}")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        missing = REQUIRED_COLUMNS - columns
+        if "content_id" in columns:
+            if not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'contents'"
+            ).fetchone():
+                raise ValueError("Missing contents table")
+        elif "content" not in columns:
+            missing.add("content")
+        if missing:
+            raise ValueError(
+                f"Missing columns in messages table: {', '.join(sorted(missing))}"
+            )
+    finally:
+        conn.close()
+
+
+def _decompress_and_validate(upload, compressed):
+    """Turns a downloaded upload into a checked database file, returning its path."""
+    path = upload
+    try:
+        if compressed:
+            path = _decompress(upload)
+            os.remove(upload)
+        _validate(path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+async def stage_database(url, compressed=False):
+    """
+    Downloads an uploaded database next to the live one and validates it.
+
+    The file is streamed to disk as it is downloaded, then decompressed if
+    needed and checked with `PRAGMA integrity_check` and against the expected
+    schema, all in a worker thread, so large files are never held in memory
+    nor block the event loop. The staged file sits in the same directory as
+    DB_PATH, so it can be moved over it atomically.
+
+    Args:
+      url (str): The URL of the uploaded file.
+      compressed (bool): True if the file is gzip-compressed.
+
+    Returns:
+      The path of the staged database file.
+
+    Raises:
+      ValueError: If the file is not a valid Tagsy database.
+      sqlite3.DatabaseError: If the file is not a SQLite database.
+      aiohttp.ClientError: If the file could not be downloaded.
+      OSError: If the file could not be written or decompressed.
+    """
+    fd, upload = _staging_file()
+    try:
+        with os.fdopen(fd, "wb") as output:
+            await _download(url, output)
+    except BaseException:
+        os.remove(upload)
+        raise
+    return await asyncio.to_thread(_decompress_and_validate, upload, compressed)
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the in-process cache placed in front of tag lookups.
+
+Classes:
+- TagEntries:
+A bounded LRU of per-tag entries keyed by (server_id, tag), indexed by server.
+
+- TagCache:
+A bounded LRU cache of tag details keyed by (server_id, tag).
+
+- ServerIndexes:
+A bounded LRU of per-server indexes of tag names, kept in sync with writes.
+"""
+
+import contextlib
+
+from sharding import ShardedLRU
+
+
+class TagEntries:
+    """
+    A bounded LRU of per-tag entries keyed by (server_id, tag), indexed by server.
+
+    The index of the cached tags of every server lets `pop_guild()` drop all
+    of them without scanning the whole LRU. Entries leave the index when they
+    are popped or evicted. Servers are keyed by the str form of their ID, so
+    a write given an int ID still reaches the entries read with a str one.
+    """
+
+    def __init__(self, capacity, shard_count=1, shard_ids=None):
+        self._entries = ShardedLRU(
+            capacity,
+            shard_count,
+            guild_of=lambda key: key[0],
+            on_evict=lambda key, _: self._forget(*key),
+            shard_ids=shard_ids,
+        )
+        self._guilds = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, server_id, tag):
+        """Returns the entry of a tag, or None, without marking it as used."""
+        return self._entries.get((str(server_id), tag))
+
+    def touch(self, server_id, tag):
+        """Returns the entry of a tag, or None, marking it as recently used."""
+        return self._entries.touch((str(server_id), tag))
+
+    def put(self, server_id, tag, entry):
+        """Stores the entry of a tag."""
+        server_id = str(server_id)
+        self._entries[(server_id, tag)] = entry
+        self._guilds.setdefault(server_id, set()).add(tag)
+
+    def pop(self, server_id, tag):
+        """Removes the entry of a tag, returning it, or None."""
+        server_id = str(server_id)
+        entry = self._entries.pop((server_id, tag), None)
+        if entry is not None:
+            self._forget(server_id, tag)
+        return entry
+
+    def pop_guild(self, server_id):
+        """Removes the entries of every tag of a server."""
+        server_id = str(server_id)
+        for tag in self._guilds.pop(server_id, ()):
+            self._entries.pop((server_id, tag), None)
+
+    def clear(self):
+        """Removes every entry."""
+        self._entries.clear()
+        self._guilds.clear()
+
+    def repartition(self, shard_count, shard_ids=None):
+        """Splits the entries between a new set of shards."""
+        self._entries.repartition(shard_count, shard_ids)
+
+    def shard_sizes(self):
+        """Returns the number of entries of each shard."""
+        return self._entries.shard_sizes()
+
+    def _forget(self, server_id, tag):
+        """Removes a tag from the per-server index."""
+        tags = self._guilds.get(server_id)
+        if tags is not None:
+            tags.discard(tag)
+            if not tags:
+                del self._guilds[server_id]
+
+
+class TagCache:
+    """
+    A bounded LRU cache of tag details keyed by (server_id, tag).
+
+    The cache is written through by the handler functions: every write to a
+    tag invalidates or updates its entry, so a cached entry is always what the
+    database would return.
+
+    Writers run inside `writing()`. Reads that miss the cache take a token
+    before querying the database and hand it back to `put()`, which refuses
+    the result if any write overlapped the read. A slow read can therefore
+    never put an outdated row back into the cache.
+
+    Attributes:
+    - capacity (int): The maximum number of cached tags, split evenly between
+      shards.
+    - hits (int): The number of lookups answered from the cache.
+    - misses (int): The number of lookups that had to reach the database.
+    """
+
+    def __init__(self, capacity=4096, shard_count=1, shard_ids=None):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = TagEntries(capacity, shard_count, shard_ids)
+        self._generation = 0
+        self._writers = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, server_id, tag):
+        """
+        Returns a copy of the cached details of a tag.
+
+        Args:
+        - server_id (str): The ID of the server the tag belongs to.
+        - tag (str): The name of the tag.
+
+        Returns:
+        - dict: The cached details, or None if the tag is not cached.
+        """
+        entry = self._entries.touch(server_id, tag)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return dict(entry)
+
+    @contextlib.contextmanager
+    def writing(self):
+        """
+        Marks a write to the database as in flight.
+
+        The database write and the matching cache updates must both happen
+        inside this block.
+        """
+        self._generation += 1
+        self._writers += 1
+        try:
+            yield
+        finally:
+            self._writers -= 1
+            self._generation += 1
+
+    def token(self):
+        """Returns the token to pass to `put()` after reading from the database."""
+        return self._generation
+
+    def put(self, server_id, tag, details, token):
+        """
+        Caches the details of a tag read from the database.
+
+        Args:
+        - server_id (str): The ID of the server the tag belongs to.
+        - tag (str): The name of the tag.
+        - details (dict): The details returned by the database.
+        - token (int): The value of `token()` taken before the database read.
+        """
+        if token != self._generation or self._writers or self.capacity <= 0:
+            return
+
+        self._entries.put(server_id, tag, dict(details))
+
+    def update(self, server_id, tag, **fields):
+        """Updates fields of a cached tag in place, if it is cached."""
+        entry = self._entries.get(server_id, tag)
+        if entry is not None:
+            entry.update(fields)
+
+    def add_usage(self, server_id, tag, amount=1):
+        """Adds to the usage count of a cached tag, if it is cached."""
+        entry = self._entries.get(server_id, tag)
+        if entry is not None:
+            entry["usage_count"] += amount
+
+    def invalidate(self, server_id, tag):
+        """Drops a tag from the cache."""
+        self._generation += 1
+        self._entries.pop(server_id, tag)
+
+    def invalidate_guild(self, server_id):
+        """Drops every cached tag of a server."""
+        self._generation += 1
+        self._entries.pop_guild(server_id)
+
+    def clear(self):
+        """Drops every cached tag."""
+        self._generation += 1
+        self._entries.clear()
+
+    def repartition(self, shard_count, shard_ids=None):
+        """Splits the cached tags between a new set of shards."""
+        self._entries.repartition(shard_count, shard_ids)
+
+    def shard_sizes(self):
+        """Returns the number of cached tags of each shard."""
+        return self._entries.shard_sizes()
+
+
+class ServerIndexes:
+    """
+    A bounded LRU of per-server indexes of tag names, kept in sync with writes.
+
+    An index is any object with `add(tag, ...)` and `remove(tag)` methods,
+    built by subclasses from a database read and kept with `_keep()`. The
+    write functions then update the indexes of the loaded servers, so only
+    servers that left the LRU are read again. Every write invalidates the
+    tokens taken before it, so an index read before a write is never kept.
+    Servers are keyed by the str form of their ID, whichever form they are
+    given in.
+
+    Attributes:
+    - capacity (int): The maximum number of indexed servers, split evenly
+      between shards.
+    - limit (int): The default maximum number of results of a lookup.
+    """
+
+    def __init__(self, capacity=1000, limit=25, shard_count=1, shard_ids=None):
+        self.capacity = capacity
+        self.limit = limit
+        self._guilds = ShardedLRU(capacity, shard_count, shard_ids=shard_ids)
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._guilds)
+
+    def get(self, server_id):
+        """Returns the index of a server, or None if it is not loaded."""
+        return self._guilds.touch(str(server_id))
+
+    def token(self):
+        """Returns the token to pass to `put()` after reading from the database."""
+        return self._generation
+
+    def _keep(self, server_id, index, token):
+        """Keeps the index of a server, unless a write happened since `token`."""
+        if token == self._generation and self.capacity > 0:
+            self._guilds[str(server_id)] = index
+
+    def add(self, server_id, tag, *args):
+        """
+        Adds a tag to the index of its server, if the server is loaded.
+
+        Extra arguments are passed on to the `add()` method of the index.
+        """
+        self._generation += 1
+        index = self._guilds.get(str(server_id))
+        if index is not None:
+            index.add(tag, *args)
+
+    def remove(self, server_id, tag):
+        """Removes a tag from the index of its server, if the server is loaded."""
+        self._generation += 1
+        index = self._guilds.get(str(server_id))
+        if index is not None:
+            index.remove(tag)
+
+    def drop(self, server_id):
+        """Forgets the index of a server."""
+        self._generation += 1
+        self._guilds.pop(str(server_id), None)
+
+    def clear(self):
+        """Forgets every index."""
+        self._generation += 1
+        self._guilds.clear()
+
+    def repartition(self, shard_count, shard_ids=None):
+        """Splits the indexed servers between a new set of shards."""
+        self._guilds.repartition(shard_count, shard_ids)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides a pool of long-lived aiosqlite connections.
+
+Opening an aiosqlite connection starts a new thread and reopens the database
+file, so the handler functions share the connections managed here instead of
+connecting on every call.
+
+Classes:
+- ConnectionPool:
+A small set of read-only connections plus a single writer connection.
+"""
+
+import asyncio
+import contextlib
+import os
+
+import aiosqlite
+
+# Applied to every connection of the pool when it is opened.
+PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA mmap_size = 67108864",
+)
+
+
+class ConnectionPool:
+    """
+    A pool of aiosqlite connections sharing a single database file.
+
+    The database is switched to WAL journaling so readers never block the
+    writer and the writer never blocks readers. Reads are spread over a few
+    read-only connections, while every write goes through one writer
+    connection guarded by a lock, which is all SQLite allows anyway.
+
+    The pool opens itself on first use, so handler functions called before
+    `db_setup()` has run still work.
+
+    Attributes:
+    - path (str): The path of the SQLite database file.
+    - size (int): The number of read connections.
+    """
+
+    def __init__(self, path, size=4):
+        self.path = path
+        self.size = max(1, size)
+        self._writer = None
+        # Kept across reopens, so readers waiting on it get the new connections.
+        self._readers = asyncio.Queue()
+        self._connections = []
+        self._open_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def is_open(self):
+        """bool: True if the connections of the pool are open."""
+        return self._writer is not None
+
+    async def _connect(self, read_only=False):
+        """Opens a new connection and applies the pool pragmas to it."""
+        # Writes take the lock up front, so a transaction waits for writers
+        # of other processes instead of failing half way through.
+        conn = await aiosqlite.connect(
+            self.path, isolation_level=None if read_only else "IMMEDIATE"
+        )
+        try:
+            pragmas = PRAGMAS + (("PRAGMA query_only = ON",) if read_only else ())
+            for pragma in pragmas:
+                # Exhaust the statement so it does not keep a lock on the file.
+                await conn.execute_fetchall(pragma)
+        except BaseException:
+            await conn.close()
+            raise
+        return conn
+
+    async def _open_connections(self):
+        """Opens the writer and the read connections."""
+        writer = await self._connect()
+        connections = [writer]
+        try:
+            # WAL is persistent, but it must be set before readers attach.
+            await writer.execute_fetchall("PRAGMA journal_mode = WAL")
+            for _ in range(self.size):
+                connections.append(await self._connect(read_only=True))
+        except BaseException:
+            for conn in connections:
+                await conn.close()
+            raise
+
+        for reader in connections[1:]:
+            self._readers.put_nowait(reader)
+        self._connections = connections
+        self._writer = writer
+
+    async def _close_connections(self):
+        """
+        Closes every connection, once the writer and all the read connections
+        are back in the pool. The caller must hold the write lock.
+        """
+        for _ in range(self.size):
+            await self._readers.get()
+        for conn in self._connections:
+            await conn.close()
+        self._writer = None
+        self._connections = []
+
+    async def open(self):
+        """Opens the writer and the read connections, if not already open."""
+        async with self._open_lock:
+            if not self.is_open:
+                await self._open_connections()
+
+    async def close(self):
+        """
+        Closes every connection of the pool.
+
+        Waits for the writer to finish its current transaction and for all the
+        read connections to be returned to the pool before closing them.
+        """
+        async with self._open_lock:
+            if not self.is_open:
+                return
+
+            async with self._write_lock:
+                await self._close_connections()
+
+    async def replace(self, source):
+        """
+        Atomically replaces the database file with another one.
+
+        Waits for in-flight operations to finish, closes every connection,
+        moves `source` over the database file and reopens the pool. Operations
+        started in the meantime wait for the new connections.
+
+        Args:
+        - source (str): The path of the new database file, which must be on
+          the same filesystem as the current one.
+        """
+        async with self._open_lock:
+            async with self._write_lock:
+                if self.is_open:
+                    await self._writer.execute_fetchall(
+                        "PRAGMA wal_checkpoint(TRUNCATE)"
+                    )
+                    await self._close_connections()
+
+                await asyncio.to_thread(os.replace, source, self.path)
+                # A leftover WAL of the old file would be replayed into the new one.
+                for suffix in ("-wal", "-shm"):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(self.path + suffix)
+
+                await self._open_connections()
+
+    @contextlib.asynccontextmanager
+    async def reader(self):
+        """
+        Borrows a read-only connection from the pool.
+
+        Yields:
+        - aiosqlite.Connection: A connection that may only be used for reads.
+        """
+        if not self.is_open:
+            await self.open()
+
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @contextlib.asynccontextmanager
+    async def writer(self):
+        """
+        Acquires the writer connection for a single transaction.
+
+        The transaction is committed when the block exits normally and rolled
+        back if it raises.
+
+        Yields:
+        - aiosqlite.Connection: The writer connection.
+        """
+        if not self.is_open:
+            await self.open()
+
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            await self._writer.commit()
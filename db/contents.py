@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the content-addressed storage of tag contents.
+
+Every distinct content is stored once in the contents table, keyed by its
+SHA-256 digest, and shared by every tag with that content. Contents past a
+size threshold are compressed with zlib when that makes them smaller. The
+reference count of every content is kept by triggers on the messages table,
+see db/migrations.py, which also delete contents no tag uses anymore.
+
+Functions:
+- encode(content):
+Returns the digest and stored form of a tag content.
+
+- decode(body, compressed):
+Returns a tag content from its stored form.
+
+- store(db, encoded):
+Stores an encoded tag content if it is not stored yet, returning its ID.
+
+Classes:
+- ContentCache:
+A bounded LRU of decompressed contents keyed by digest.
+"""
+
+import hashlib
+import zlib
+
+from config import CONTENT_COMPRESS_THRESHOLD
+from sharding import ShardedLRU
+
+# Compression level of the stored contents, see zlib.compress().
+COMPRESS_LEVEL = 6
+
+
+def encode(content):
+    """
+    Returns the digest and stored form of a tag content.
+
+    Args:
+    - content (str): The content of a tag.
+
+    Returns:
+    - tuple: (digest, body, compressed) where digest is the SHA-256 digest of
+      the content, and body is either the zlib-compressed content, as bytes,
+      with compressed set to True, or the content itself.
+    """
+    data = content.encode("utf-8")
+    digest = hashlib.sha256(data).digest()
+    if len(data) >= CONTENT_COMPRESS_THRESHOLD:
+        packed = zlib.compress(data, COMPRESS_LEVEL)
+        if len(packed) < len(data):
+            return digest, packed, True
+    return digest, content, False
+
+
+def decode(body, compressed):
+    """Returns a tag content from its stored form."""
+    if compressed:
+        return zlib.decompress(body).decode("utf-8")
+    return body
+
+
+async def store(db, encoded):
+    """
+    Stores an encoded tag content if it is not stored yet, returning its ID.
+
+    Must run inside the write transaction that references the content, so a
+    content stored for a write that fails is rolled back with it. Encoding is
+    left to the caller, so it does not hold the writer while compressing.
+
+    Args:
+    - db (aiosqlite.Connection): The writer connection.
+    - encoded (tuple): The content of a tag, as returned by encode().
+
+    Returns:
+    - int: The ID of the content in the contents table.
+    """
+    digest, body, compressed = encoded
+    await db.execute(
+        "INSERT OR IGNORE INTO contents (hash, body, compressed) VALUES (?, ?, ?)",
+        (digest, body, compressed),
+    )
+    (row,) = await db.execute_fetchall(
+        "SELECT id FROM contents WHERE hash = ?", (digest,)
+    )
+    return row[0]
+
+
+class ContentCache:
+    """
+    A bounded LRU of decompressed contents keyed by digest.
+
+    Only compressed contents go through the cache, the others are read as
+    they are stored. A digest always names the same content, so entries never
+    need to be invalidated, not even when the database is replaced.
+
+    Attributes:
+    - capacity (int): The maximum number of cached contents.
+    - hits (int): The number of contents read from the cache.
+    - misses (int): The number of contents that had to be decompressed.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        # Contents are shared between servers, so the cache is not sharded.
+        self._entries = ShardedLRU(capacity)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def read(self, digest, body, compressed):
+        """
+        Returns a tag content from its stored form, decompressed at most once.
+
+        Args:
+        - digest (bytes): The SHA-256 digest of the content.
+        - body (str or bytes): The stored form of the content.
+        - compressed (bool): True if the body is compressed.
+
+        Returns:
+        - str: The content.
+        """
+        if not compressed:
+            return body
+        content = self._entries.touch(digest)
+        if content is not None:
+            self.hits += 1
+            return content
+        self.misses += 1
+        content = decode(body, compressed)
+        if self.capacity > 0:
+            self._entries[digest] = content
+        return content
+
+    def clear(self):
+        """Drops every cached content."""
+        self._entries.clear()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the cache of rendered tag embeds.
+
+Classes:
+- EmbedCache:
+A bounded LRU of rendered embed payloads keyed by (server_id, tag).
+"""
+
+from db.cache import TagEntries
+
+
+class EmbedCache:
+    """
+    A bounded LRU of rendered embed payloads keyed by (server_id, tag).
+
+    A payload is the dictionary form of a tag embed without its usage count,
+    which changes on every use and is added when the embed is built. Every
+    payload is stored with the fingerprint of what it was rendered from, its
+    content, creation date and author name, and is only returned for the
+    same fingerprint. A payload rendered from a row read before a concurrent
+    write, or before its author was renamed, is therefore never served. The
+    write functions still invalidate the tags they change, so outdated
+    payloads do not take up room.
+
+    Attributes:
+    - capacity (int): The maximum number of cached payloads, split evenly
+      between shards.
+    - hits (int): The number of embeds built from a cached payload.
+    - misses (int): The number of embeds that had to be rendered.
+    """
+
+    def __init__(self, capacity=2048, shard_count=1, shard_ids=None):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = TagEntries(capacity, shard_count, shard_ids)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, server_id, tag, fingerprint):
+        """
+        Returns the payload of a tag rendered from the same fingerprint.
+
+        Args:
+        - server_id (str): The ID of the server the tag belongs to.
+        - tag (str): The name of the tag.
+        - fingerprint (tuple): What the payload is rendered from.
+
+        Returns:
+        - dict: The payload, shared between callers so not to be modified, or
+          None if it must be rendered.
+        """
+        entry = self._entries.touch(server_id, tag)
+        if entry is None or entry[0] != fingerprint:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, server_id, tag, fingerprint, payload):
+        """Caches the payload of a tag rendered from a fingerprint."""
+        if self.capacity <= 0:
+            return
+        self._entries.put(server_id, tag, (fingerprint, payload))
+
+    def invalidate(self, server_id, tag):
+        """Drops the payload of a tag."""
+        self._entries.pop(server_id, tag)
+
+    def invalidate_guild(self, server_id):
+        """Drops the payloads of every tag of a server."""
+        self._entries.pop_guild(server_id)
+
+    def clear(self):
+        """Drops every payload."""
+        self._entries.clear()
+
+    def repartition(self, shard_count, shard_ids=None):
+        """Splits the cached payloads between a new set of shards."""
+        self._entries.repartition(shard_count, shard_ids)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the streaming CSV export of every tag.
+
+Functions:
+- export_tags_csv(chunk_size=1000):
+Writes every tag into a gzip-compressed CSV file, one chunk at a time.
+
+Classes:
+- CompressedSpool:
+A gzip-compressed temporary file, kept in memory while small.
+"""
+
+import asyncio
+import csv
+import gzip
+import io
+import tempfile
+
+from db.sqlite_handler import iter_all_tags_for_all_servers
+
+CSV_HEADER = [
+    "Server ID",
+    "Tag",
+    "Content",
+    "Created By",
+    "Created At",
+    "Usage Count",
+]
+
+# Exports smaller than this stay in memory, larger ones spill to disk.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+class CompressedSpool:  # pylint: disable=too-few-public-methods
+    """
+    A gzip-compressed temporary file, kept in memory while small.
+
+    Entering it returns the gzip stream to write to. Once the block exits,
+    `file` is positioned at its start, ready to be sent. It is closed if the
+    block raises; otherwise closing it is up to the caller.
+
+    Attributes:
+    - file (file): The spooled temporary file holding the compressed data.
+    - size (int): The length of the compressed data, once written.
+    """
+
+    def __init__(self):
+        self.file = (
+            tempfile.SpooledTemporaryFile(  # pylint: disable=consider-using-with
+                max_size=SPOOL_MAX_SIZE, mode="w+b"
+            )
+        )
+        self.size = 0
+        self._compressed = None
+
+    def __enter__(self):
+        self._compressed = gzip.GzipFile(fileobj=self.file, mode="wb")
+        return self._compressed
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._compressed.close()
+            self.size = self.file.tell()
+            self.file.seek(0)
+        except BaseException:
+            self.file.close()
+            raise
+        if exc_type is not None:
+            self.file.close()
+
+
+async def export_tags_csv(chunk_size=1000):
+    """
+    Writes every tag into a gzip-compressed CSV file, one chunk at a time.
+
+    Rows are read from the database `chunk_size` at a time and compressed in
+    a worker thread, so neither the whole dataset nor the whole CSV is ever
+    held in memory and the event loop keeps running during the export.
+
+    Args:
+      chunk_size (int): The number of tags read from the database at once.
+
+    Returns:
+      A tuple (file, row_count, size) where file is a binary file positioned
+      at its start, holding the compressed CSV, and size is its length in bytes.
+      The caller is responsible for closing the file.
+    """
+    spool = CompressedSpool()
+    row_count = 0
+    with spool as compressed:
+        with io.TextIOWrapper(compressed, encoding="utf-8", newline="") as text:
+            writer = csv.writer(text)
+            writer.writerow(CSV_HEADER)
+            async for tags in iter_all_tags_for_all_servers(chunk_size):
+                await asyncio.to_thread(
+                    writer.writerows,
+                    [
+                        [
+                            tag["server_id"],
+                            tag["tag"],
+                            tag["content"],
+                            tag["created_by"],
+                            tag["created_at"],
+                            tag["usage_count"],
+                        ]
+                        for tag in tags
+                    ],
+                )
+                row_count += len(tags)
+    return spool.file, row_count, spool.size
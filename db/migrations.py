@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the versioned schema migrations of the database.
+
+The schema version is stored in `PRAGMA user_version`, which SQLite keeps in
+the database header, so it travels with the file through backups and imports.
+
+Functions:
+- schema_version(db):
+Returns the schema version of a database.
+
+- migrate(pool):
+Applies the migrations a database has not seen yet.
+"""
+
+from db.contents import encode
+
+# Rows of the messages table moved to the contents table at a time.
+BACKFILL_CHUNK_SIZE = 5000
+
+
+async def _create_messages(db):
+    """Creates the messages table, on new databases."""
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS messages (
+                        id INTEGER PRIMARY KEY,
+                        server_id TEXT NOT NULL,
+                        tag TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        created_by TEXT NOT NULL,
+                        usage_count INTEGER DEFAULT 1,
+                        UNIQUE(server_id, tag)
+                    )"""
+    )
+
+
+async def _has_unique_index(db, table, columns):
+    """Checks if a table has a unique index on exactly the given columns."""
+    for index in await db.execute_fetchall(f"PRAGMA index_list({table})"):
+        # (seq, name, unique, origin, partial)
+        if not index[2]:
+            continue
+        info = await db.execute_fetchall(f"PRAGMA index_info({index[1]})")
+        if [row[2] for row in sorted(info)] == list(columns):
+            return True
+    return False
+
+
+async def _create_hot_path_indexes(db):
+    """Creates the indexes of the lookup, popularity and per-user queries."""
+    # The UNIQUE(server_id, tag) constraint already comes with an index, which
+    # is only recreated for databases imported without it.
+    if not await _has_unique_index(db, "messages", ("server_id", "tag")):
+        await db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_server_tag"
+            " ON messages (server_id, tag)"
+        )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_server_usage"
+        " ON messages (server_id, usage_count DESC)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_created_by ON messages (created_by)"
+    )
+    await db.execute("ANALYZE messages")
+
+
+async def _create_bot_state(db):
+    """Creates the key-value table of the state the bot keeps across restarts."""
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS bot_state (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL
+                    )"""
+    )
+
+
+async def _deduplicate_contents(db):
+    """
+    Moves the tag contents to the content-addressed contents table.
+
+    Every distinct content is stored once, compressed if large, and tags
+    reference it by ID. Triggers keep the reference count of every content
+    and delete the contents no tag uses anymore. The space freed in the
+    messages table is reused by new rows; only a VACUUM gives it back to the
+    filesystem.
+
+    Tags are moved BACKFILL_CHUNK_SIZE at a time, one transaction each, so
+    other processes get the write lock between chunks instead of timing out.
+    A NULL content_id marks the tags left to move, which lets an interrupted
+    migration resume where it stopped. The content of a moved tag is blanked,
+    which keeps the table rewrite of the final DROP COLUMN short.
+
+    Returns:
+      False while tags are left to move, True once the migration is done.
+    """
+    columns = [
+        row[1] for row in await db.execute_fetchall("PRAGMA table_info(messages)")
+    ]
+    if "content_id" not in columns:
+        await db.execute(
+            """CREATE TABLE IF NOT EXISTS contents (
+                            id INTEGER PRIMARY KEY,
+                            hash BLOB NOT NULL UNIQUE,
+                            body BLOB NOT NULL,
+                            compressed INTEGER NOT NULL DEFAULT 0,
+                            refcount INTEGER NOT NULL DEFAULT 0
+                        )"""
+        )
+        await db.execute("ALTER TABLE messages ADD COLUMN content_id INTEGER")
+        # Finds the next chunk without scanning the tags already moved.
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_content_backfill"
+            " ON messages (id) WHERE content_id IS NULL"
+        )
+        return False
+
+    rows = await db.execute_fetchall(
+        "SELECT id, content FROM messages WHERE content_id IS NULL ORDER BY id LIMIT ?",
+        (BACKFILL_CHUNK_SIZE,),
+    )
+    if rows:
+        encoded = [(row[0], *encode(row[1])) for row in rows]
+        await db.executemany(
+            "INSERT OR IGNORE INTO contents (hash, body, compressed) VALUES (?, ?, ?)",
+            [(digest, body, compressed) for _, digest, body, compressed in encoded],
+        )
+        await db.executemany(
+            "UPDATE messages SET content = '',"
+            " content_id = (SELECT id FROM contents WHERE hash = ?) WHERE id = ?",
+            [(digest, message_id) for message_id, digest, _, _ in encoded],
+        )
+        return False
+
+    await db.execute("DROP INDEX IF EXISTS idx_messages_content_backfill")
+    await db.execute(
+        """UPDATE contents SET refcount = used.count
+           FROM (SELECT content_id, COUNT(*) AS count FROM messages GROUP BY content_id)
+             AS used
+           WHERE contents.id = used.content_id"""
+    )
+    await db.execute("ALTER TABLE messages DROP COLUMN content")
+
+    await db.execute(
+        """CREATE TRIGGER IF NOT EXISTS messages_content_insert
+           AFTER INSERT ON messages
+           BEGIN
+               UPDATE contents SET refcount = refcount + 1 WHERE id = NEW.content_id;
+           END"""
+    )
+    await db.execute(
+        """CREATE TRIGGER IF NOT EXISTS messages_content_delete
+           AFTER DELETE ON messages
+           BEGIN
+               UPDATE contents SET refcount = refcount - 1 WHERE id = OLD.content_id;
+               DELETE FROM contents WHERE id = OLD.content_id AND refcount <= 0;
+           END"""
+    )
+    await db.execute(
+        """CREATE TRIGGER IF NOT EXISTS messages_content_update
+           AFTER UPDATE OF content_id ON messages
+           WHEN NEW.content_id IS NOT OLD.content_id
+           BEGIN
+               UPDATE contents SET refcount = refcount + 1 WHERE id = NEW.content_id;
+               UPDATE contents SET refcount = refcount - 1 WHERE id = OLD.content_id;
+               DELETE FROM contents WHERE id = OLD.content_id AND refcount <= 0;
+           END"""
+    )
+    return True
+
+
+# Every migration ever shipped, in order. The version of a database is the
+# number of migrations applied to it: never edit or reorder existing entries,
+# only append new ones.
+MIGRATIONS = (
+    _create_messages,
+    _create_hot_path_indexes,
+    _create_bot_state,
+    _deduplicate_contents,
+)
+
+
+async def schema_version(db):
+    """
+    Returns the schema version of a database.
+
+    Args:
+      db (aiosqlite.Connection): A connection to the database.
+
+    Returns:
+      The number of migrations applied to the database.
+    """
+    (row,) = await db.execute_fetchall("PRAGMA user_version")
+    return row[0]
+
+
+async def migrate(pool):
+    """
+    Applies the migrations a database has not seen yet.
+
+    Each migration runs in its own `BEGIN IMMEDIATE` transaction together with
+    the version bump, so a crash leaves the database at the last completed
+    version, and another process migrating the same file at the same time
+    waits, then skips what was already applied. In WAL mode readers keep
+    working while a migration runs; only writes wait for it.
+
+    A long migration may run in steps instead: it returns False after each
+    step but the last, and every step is committed in a transaction of its
+    own before the version bump, so the write lock is never held for longer
+    than the busy timeout of the other processes. Steps must pick up the
+    work left from the database itself, as any process may run the next one.
+
+    Databases created before versioning report version 0 and go through every
+    migration, which is why they all tolerate existing objects.
+
+    Args:
+      pool (ConnectionPool): The pool of the database to migrate.
+
+    Returns:
+      The schema version of the database after migrating.
+
+    Raises:
+      RuntimeError: If the database is newer than this version of the bot.
+    """
+    async with pool.reader() as db:
+        version = await schema_version(db)
+    if version > len(MIGRATIONS):
+        raise RuntimeError(
+            f"Database schema version {version} is newer than the latest known"
+            f" version {len(MIGRATIONS)}"
+        )
+
+    while version < len(MIGRATIONS):
+        async with pool.writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            version = await schema_version(db)
+            if version < len(MIGRATIONS):
+                if await MIGRATIONS[version](db) is False:
+                    continue
+                version += 1
+                # PRAGMA does not accept parameters; version is an int.
+                await db.execute(f"PRAGMA user_version = {version}")
+    return version
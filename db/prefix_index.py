@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the per-server prefix indexes used by autocomplete.
+
+Classes:
+- GuildPrefixes:
+The tag names of a single server, sorted for prefix lookups.
+
+- PrefixIndex:
+A bounded LRU of per-server prefix indexes, kept in sync with writes.
+"""
+
+from bisect import bisect_left, insort
+
+from db.cache import ServerIndexes
+
+
+class GuildPrefixes:
+    """
+    The tag names of a single server, sorted for prefix lookups.
+
+    Names are kept as (casefolded name, name) pairs in a sorted list, so the
+    tags starting with a prefix are a contiguous slice found with `bisect`.
+    """
+
+    __slots__ = ("_entries",)
+
+    def __init__(self, tags=()):
+        self._entries = sorted((tag.casefold(), tag) for tag in tags)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, tag):
+        """Adds a tag name, if it is not already there."""
+        entry = (tag.casefold(), tag)
+        position = bisect_left(self._entries, entry)
+        if position == len(self._entries) or self._entries[position] != entry:
+            insort(self._entries, entry, lo=position)
+
+    def remove(self, tag):
+        """Removes a tag name, if it is there."""
+        entry = (tag.casefold(), tag)
+        position = bisect_left(self._entries, entry)
+        if position < len(self._entries) and self._entries[position] == entry:
+            del self._entries[position]
+
+    def complete(self, prefix, limit):
+        """
+        Returns the tag names starting with a prefix, ignoring case.
+
+        Args:
+        - prefix (str): The text typed so far.
+        - limit (int): The maximum number of names to return.
+
+        Returns:
+        - list: The matching names, in alphabetical order.
+        """
+        prefix = prefix.casefold()
+        position = bisect_left(self._entries, (prefix,))
+        names = []
+        for folded, tag in self._entries[position : position + limit]:
+            if not folded.startswith(prefix):
+                break
+            names.append(tag)
+        return names
+
+
+class PrefixIndex(ServerIndexes):
+    """
+    A bounded LRU of per-server prefix indexes, kept in sync with writes.
+
+    A server's index is built from the database once, in the background, and
+    then updated by the write functions, so lookups only ever read memory.
+    Only the `capacity` most recently used servers are kept.
+
+    Attributes:
+    - capacity (int): The maximum number of indexed servers, split evenly
+      between shards.
+    - limit (int): The default maximum number of completions.
+    """
+
+    def put(self, server_id, tags, token):
+        """
+        Builds the index of a server from its tag names.
+
+        The index is only kept if no write happened since `token` was taken.
+        """
+        if token == self._generation and self.capacity > 0:
+            self._keep(server_id, GuildPrefixes(tags), token)
+
+    def complete(self, index, prefix, limit=None):
+        """Returns the completions of a server index for a prefix."""
+        return index.complete(prefix, limit or self.limit)
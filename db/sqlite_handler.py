@@ -6,153 +6,572 @@ database using the aiosqlite library.
 It includes functions for setting up the database, adding, retrieving,
 deleting, updating, and resetting messages.
 
+Server IDs may be given as int or str: every function converts them to str,
+the form they are stored in and the key of every in-memory structure.
+
 Functions:
 - db_setup():
-Sets up the database by creating the necessary tables.
+Opens the connection pool, migrates the schema and loads the tag filter.
+
+- db_teardown():
+Writes the pending usage counts, then closes the connections of the pool.
+
+- replace_database(path):
+Atomically replaces the database file and resets every in-memory structure.
+
+- partition_state(shard_count, shard_ids=None):
+Splits the per-server in-memory structures between a number of shards.
+
+- forget_guild(server_id):
+Drops the in-memory state of a server whose tags another process changed.
 
 - add_message(server_id, tag, content, created_by):
 Adds a new message to the database.
 
-- get_similar_tags(server_id, tag):
-Retrieves tags similar to the given one from the database.
+- get_similar_tags(server_id, tag, limit=None):
+Retrieves the tags closest to the given one from the suggestion index.
+
+- complete_tags(server_id, prefix, limit=None):
+Retrieves the tags starting with a prefix from the prefix index.
 
 - get_message(server_id, tag):
 Retrieves a specific message by tag from the database.
 
+- get_messages(server_id, tags):
+Retrieves several messages by tag with a single query.
+
 - delete_message(server_id, tag):
 Deletes a message associated with a tag from the database.
 
 - update_message(server_id, tag, content):
 Updates the content of a message associated with a tag in the database.
 
-- get_all_messages(server_id):
-Retrieve all messages and their details from the database for a specific server.
+- get_all_messages(server_id, after_tag=None, limit=None):
+Retrieve messages and their details from the database for a specific server, by page.
+
+- iter_all_tags_for_all_servers(chunk_size=1000):
+Iterate over all tags and their details from the database for all servers, in chunks.
 
 - increment_usage_count(server_id, tag):
-Increments the usage count for a specific tag.
+Records a use of a specific tag, written to the database in batches.
+
+- increment_usage_counts(server_id, tags):
+Records a use of each of several tags at once.
 
 - reset_usage_count(server_id, tag):
 Resets the usage count for a specific tag to zero.
-"""
 
-import aiosqlite
+- get_state(key):
+Retrieves a value the bot keeps across restarts.
 
-from config import DATABASE_FILE
+- set_state(key, value):
+Stores a value the bot keeps across restarts.
+"""
 
-DB_PATH = DATABASE_FILE
+import asyncio
+
+from config import (
+    CONTENT_CACHE_SIZE,
+    DATABASE_FILE,
+    DB_POOL_SIZE,
+    EMBED_CACHE_SIZE,
+    PREFIX_INDEX_GUILDS,
+    SHARD_COUNT,
+    SHARD_IDS,
+    SUGGESTION_INDEX_GUILDS,
+    SUGGESTION_LIMIT,
+    TAG_CACHE_SIZE,
+    TAG_FILTER_EXACT_LIMIT,
+    USAGE_FLUSH_INTERVAL,
+    USAGE_FLUSH_THRESHOLD,
+)
+from db.cache import TagCache
+from db.connection import ConnectionPool
+from db.contents import ContentCache, decode, encode, store
+from db.embed_cache import EmbedCache
+from db.migrations import migrate
+from db.prefix_index import PrefixIndex
+from db.suggestions import SuggestionIndex
+from db.tag_filter import TagFilter
+from db.usage_buffer import UsageBuffer
+from metrics import Gauge, Histogram, ratio, timed
 
+DB_PATH = DATABASE_FILE
 
+# Shared by every function of this module, see db/connection.py.
+pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+
+# Kept in sync by the write functions below, see db/cache.py.
+tag_cache = TagCache(TAG_CACHE_SIZE, SHARD_COUNT or 1, SHARD_IDS)
+
+# Per-server trigram indexes used for suggestions, see db/suggestions.py.
+suggestion_index = SuggestionIndex(
+    SUGGESTION_INDEX_GUILDS,
+    SUGGESTION_LIMIT,
+    shard_count=SHARD_COUNT or 1,
+    shard_ids=SHARD_IDS,
+)
+
+# Per-server sorted tag names used for autocomplete, see db/prefix_index.py.
+prefix_index = PrefixIndex(
+    PREFIX_INDEX_GUILDS, shard_count=SHARD_COUNT or 1, shard_ids=SHARD_IDS
+)
+
+# Background loads of the prefix index of a server.
+_prefix_loads = {}
+
+# Rendered tag embeds, built by helper.build_embed, see db/embed_cache.py.
+embed_cache = EmbedCache(EMBED_CACHE_SIZE, SHARD_COUNT or 1, SHARD_IDS)
+
+# Decompressed tag contents shared by every server, see db/contents.py.
+content_cache = ContentCache(CONTENT_CACHE_SIZE)
+
+# Per-server names of existing tags, see db/tag_filter.py.
+tag_filter = TagFilter(
+    TAG_FILTER_EXACT_LIMIT, shard_count=SHARD_COUNT or 1, shard_ids=SHARD_IDS
+)
+
+# Background rebuilds of the tag filter of a server.
+_filter_rebuilds = {}
+
+# Usage counts not yet written to the database, see db/usage_buffer.py.
+usage_buffer = UsageBuffer(pool, tag_cache, USAGE_FLUSH_INTERVAL, USAGE_FLUSH_THRESHOLD)
+
+DB_CALL_SECONDS = Histogram(
+    "tagsy_db_call_seconds",
+    "Duration of the sqlite_handler functions.",
+    labels=("function",),
+)
+Gauge(
+    "tagsy_tag_cache_hit_ratio",
+    "Share of tag lookups answered by the tag cache.",
+    lambda: ratio(tag_cache.hits, tag_cache.misses),
+)
+Gauge(
+    "tagsy_tag_cache_entries",
+    "Number of tags held by the tag cache.",
+    lambda: len(tag_cache),
+)
+Gauge(
+    "tagsy_embed_cache_hit_ratio",
+    "Share of tag embeds built from a cached rendering.",
+    lambda: ratio(embed_cache.hits, embed_cache.misses),
+)
+Gauge(
+    "tagsy_content_cache_hit_ratio",
+    "Share of compressed tag contents read without decompressing them.",
+    lambda: ratio(content_cache.hits, content_cache.misses),
+)
+Gauge(
+    "tagsy_tag_filter_skipped",
+    "Lookups of missing tags answered by the tag filter without a query.",
+    lambda: tag_filter.skipped,
+)
+Gauge(
+    "tagsy_usage_buffer_pending",
+    "Number of tags with usage counts not yet written to the database.",
+    lambda: len(usage_buffer),
+)
+
+
+@timed(DB_CALL_SECONDS)
 async def db_setup():
-    """Sets up the database by creating the necessary tables."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """CREATE TABLE IF NOT EXISTS messages (
-                            id INTEGER PRIMARY KEY,
-                            server_id TEXT NOT NULL,
-                            tag TEXT NOT NULL,
-                            content TEXT NOT NULL,
-                            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                            created_by TEXT NOT NULL,
-                            usage_count INTEGER DEFAULT 1,
-                            UNIQUE(server_id, tag)
-                        )"""
-        )
-        await db.commit()
+    """Opens the connection pool, migrates the schema and loads the tag filter."""
+    await pool.open()
+    await migrate(pool)
+    if not tag_filter.loaded:
+        await _load_tag_filter()
+    usage_buffer.start()
+
+
+async def _load_tag_filter():
+    """Builds the tag filter of every server on the shards of this process."""
+    tag_filter.start_loading()
+    guilds = {}
+    server_id, tags, covered = None, [], False
+    async with pool.reader() as db:
+        # The UNIQUE(server_id, tag) index returns the rows grouped by server.
+        async with db.execute(
+            "SELECT server_id, tag FROM messages ORDER BY server_id"
+        ) as cursor:
+            while rows := await cursor.fetchmany(1000):
+                for row in rows:
+                    if row[0] != server_id:
+                        if tags:
+                            guilds[server_id] = tag_filter.build(tags)
+                        server_id, tags = row[0], []
+                        covered = tag_filter.covers(server_id)
+                    if covered:
+                        tags.append(row[1])
+    if tags:
+        guilds[server_id] = tag_filter.build(tags)
+    tag_filter.install(guilds)
+
+
+def _schedule_filter_rebuild(server_id):
+    """Rebuilds the tag filter of a server in the background, once at a time."""
+    if server_id not in _filter_rebuilds:
+        task = asyncio.create_task(_rebuild_tag_filter(server_id))
+        _filter_rebuilds[server_id] = task
+        task.add_done_callback(lambda _: _filter_rebuilds.pop(server_id, None))
+
+
+async def _rebuild_tag_filter(server_id):
+    """Rebuilds the tag filter of a server that went stale."""
+    token = tag_filter.token()
+    async with pool.reader() as db:
+        async with db.execute(
+            "SELECT tag FROM messages WHERE server_id = ?", (server_id,)
+        ) as cursor:
+            tags = [row[0] for row in await cursor.fetchall()]
+    tag_filter.rebuild(server_id, tags, token)
+
+
+async def db_teardown():
+    """Writes the pending usage counts, then closes the connections of the pool."""
+    await usage_buffer.stop()
+    await pool.close()
+
+
+@timed(DB_CALL_SECONDS)
+async def replace_database(path):
+    """
+    Atomically replaces the database file with a validated one.
+
+    In-flight operations are drained and new ones wait while the file is
+    swapped. Pending usage counts of the old database are dropped, and the tag
+    and embed caches, suggestion indexes and tag filter are rebuilt from the
+    new file.
+
+    Args:
+      path (str): The path of the new database file, on the same filesystem as
+        DB_PATH.
+    """
+    async with usage_buffer.suspended():
+        with tag_cache.writing():
+            await pool.replace(path)
+            tag_cache.clear()
+            embed_cache.clear()
+            suggestion_index.clear()
+            prefix_index.clear()
+            tag_filter.clear()
+    await db_setup()
+
+
+def partition_state(shard_count, shard_ids=None):
+    """
+    Splits the per-server in-memory structures between a number of shards.
+
+    Each shard run by this process then gets an equal share of the capacity
+    of the tag and embed caches and of the suggestion and prefix indexes.
+    Called once the bot knows how many shards it runs, which with automatic
+    sharding is only after connecting.
+
+    Args:
+      shard_count (int): The total number of shards of the bot.
+      shard_ids (list): The shards run by this process, None for all of them.
+    """
+    tag_cache.repartition(shard_count, shard_ids)
+    embed_cache.repartition(shard_count, shard_ids)
+    suggestion_index.repartition(shard_count, shard_ids)
+    prefix_index.repartition(shard_count, shard_ids)
+
+
+def forget_guild(server_id):
+    """
+    Drops the in-memory state of a server whose tags another process changed.
 
+    The cached tags and embeds and the suggestion and prefix indexes of the
+    server are dropped, to be read again on their next use, and its tag
+    filter is rebuilt in the background. Must run in the event loop.
 
+    Args:
+      server_id (str): The ID of the server.
+    """
+    server_id = str(server_id)
+    tag_cache.invalidate_guild(server_id)
+    embed_cache.invalidate_guild(server_id)
+    tag_filter.invalidate(server_id)
+    suggestion_index.drop(server_id)
+    prefix_index.drop(server_id)
+    if tag_filter.needs_rebuild(server_id):
+        _schedule_filter_rebuild(server_id)
+
+
+@timed(DB_CALL_SECONDS)
 async def add_message(server_id, tag, content, created_by):
     """Adds a new message to the database."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO messages (server_id, tag, content, created_by) VALUES (?, ?, ?, ?)",
-            (server_id, tag, content, created_by),
-        )
-        await db.commit()
+    server_id = str(server_id)
+    # Added first: a name the filter knows about but the database lacks is
+    # harmless, the other way round would hide a committed tag.
+    tag_filter.add(server_id, tag)
+    encoded = encode(content)
+    with tag_cache.writing():
+        async with pool.writer() as db:
+            content_id = await store(db, encoded)
+            await db.execute(
+                "INSERT INTO messages (server_id, tag, content_id, created_by) VALUES (?, ?, ?, ?)",
+                (server_id, tag, content_id, created_by),
+            )
+        tag_cache.invalidate(server_id, tag)
+        embed_cache.invalidate(server_id, tag)
+        suggestion_index.add(server_id, tag)
+        prefix_index.add(server_id, tag)
+
+
+@timed(DB_CALL_SECONDS)
+async def get_similar_tags(server_id, tag, limit=None):
+    """
+    Retrieves the tags closest to the given one, ranked by edit distance and
+    popularity.
 
+    The tags of a server are read from the database once, on its first lookup;
+    the suggestion index answers every later lookup from memory. Servers the
+    tag filter knows have no tag are answered without reading anything.
 
-async def get_similar_tags(server_id, tag):
-    """Retrieves tags similar to the given one from the database."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT tag FROM messages WHERE server_id = ? AND tag LIKE ?",
-            (server_id, "%" + tag + "%"),
-        )
-        return await cursor.fetchall()
+    Args:
+      server_id (str): The ID of the server to search.
+      tag (str): The tag that was not found.
+      limit (int): The maximum number of tags to return, SUGGESTION_LIMIT by default.
 
+    Returns:
+      A list of tag names, best match first.
+    """
+    server_id = str(server_id)
+    if not tag_filter.has_tags(server_id):
+        return []
+    index = suggestion_index.get(server_id)
+    if index is None:
+        token = suggestion_index.token()
+        async with pool.reader() as db:
+            async with db.execute(
+                "SELECT tag, usage_count FROM messages WHERE server_id = ?",
+                (server_id,),
+            ) as cursor:
+                rows = [
+                    (row[0], row[1] + usage_buffer.pending_for(server_id, row[0]))
+                    for row in await cursor.fetchall()
+                ]
+        index = suggestion_index.put(server_id, rows, token)
+    return suggestion_index.suggest(index, tag, limit)
+
+
+async def _load_prefix_index(server_id):
+    """Builds the prefix index of a server from the database."""
+    token = prefix_index.token()
+    async with pool.reader() as db:
+        async with db.execute(
+            "SELECT tag FROM messages WHERE server_id = ?", (server_id,)
+        ) as cursor:
+            tags = [row[0] for row in await cursor.fetchall()]
+    prefix_index.put(server_id, tags, token)
+
+
+@timed(DB_CALL_SECONDS)
+async def complete_tags(server_id, prefix, limit=None):
+    """
+    Retrieves the tags of a server starting with a prefix, ignoring case.
+
+    Lookups never wait for the database: the first lookup of a server that
+    is not indexed yet starts loading its tags in the background and returns
+    no tag, and every later one is answered from memory.
 
+    Args:
+      server_id (str): The ID of the server to search.
+      prefix (str): The text typed so far.
+      limit (int): The maximum number of tags to return, 25 by default.
+
+    Returns:
+      A list of tag names, in alphabetical order.
+    """
+    server_id = str(server_id)
+    index = prefix_index.get(server_id)
+    if index is not None:
+        return prefix_index.complete(index, prefix, limit)
+
+    if server_id not in _prefix_loads:
+        task = asyncio.create_task(_load_prefix_index(server_id))
+        _prefix_loads[server_id] = task
+        task.add_done_callback(lambda _: _prefix_loads.pop(server_id, None))
+    return []
+
+
+@timed(DB_CALL_SECONDS)
 async def get_message(server_id, tag):
-    """Retrieves a specific message by tag from the database."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
+    """
+    Retrieves a specific message by tag, from the cache or the database.
+
+    Tags the tag filter knows do not exist are answered without a query.
+    """
+    server_id = str(server_id)
+    cached = tag_cache.get(server_id, tag)
+    if cached is not None:
+        cached["usage_count"] += usage_buffer.pending_for(server_id, tag)
+        return cached
+
+    if not tag_filter.might_contain(server_id, tag):
+        return None
+
+    if tag_filter.needs_rebuild(server_id):
+        _schedule_filter_rebuild(server_id)
+
+    token = tag_cache.token()
+    async with pool.reader() as db:
+        async with db.execute(
             """
             SELECT
-                tag, content, created_by, created_at, usage_count
-            FROM messages
+                tag, hash, body, compressed, created_by, created_at, usage_count
+            FROM messages JOIN contents ON contents.id = messages.content_id
             WHERE server_id = ? AND tag = ?""",
             (server_id, tag),
-        )
-        row = await cursor.fetchone()
+        ) as cursor:
+            row = await cursor.fetchone()
         if row:
-            return {
+            tag_info = {
                 "tag": row[0],
-                "content": row[1],
-                "created_by": row[2],
-                "created_at": row[3],
-                "usage_count": row[4],
+                "content": content_cache.read(row[1], row[2], row[3]),
+                "created_by": row[4],
+                "created_at": row[5],
+                "usage_count": row[6],
             }
+            tag_cache.put(server_id, tag, tag_info, token)
+            tag_info["usage_count"] += usage_buffer.pending_for(server_id, tag)
+            return tag_info
 
 
-async def delete_message(server_id, tag):
-    """Deletes a message associated with a tag from the database."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "DELETE FROM messages WHERE server_id = ? AND tag = ?", (server_id, tag)
-        )
-        await db.commit()
+@timed(DB_CALL_SECONDS)
+async def get_messages(server_id, tags):
+    """
+    Retrieves several messages by tag, from the cache or with a single query.
+
+    Tags found in the cache or known not to exist by the tag filter are
+    answered from memory; the others are read with one `WHERE tag IN (...)`
+    query.
 
+    Args:
+      server_id (str): The ID of the server the tags belong to.
+      tags (list): The names of the tags.
 
+    Returns:
+      A dictionary mapping the name of every tag found to its details.
+    """
+    server_id = str(server_id)
+    found = {}
+    missing = []
+    for tag in dict.fromkeys(tags):
+        cached = tag_cache.get(server_id, tag)
+        if cached is not None:
+            cached["usage_count"] += usage_buffer.pending_for(server_id, tag)
+            found[tag] = cached
+        elif tag_filter.might_contain(server_id, tag):
+            missing.append(tag)
+    if not missing:
+        return found
+
+    token = tag_cache.token()
+    async with pool.reader() as db:
+        async with db.execute(
+            f"""
+            SELECT
+                tag, hash, body, compressed, created_by, created_at, usage_count
+            FROM messages JOIN contents ON contents.id = messages.content_id
+            WHERE server_id = ? AND tag IN ({", ".join("?" * len(missing))})""",
+            (server_id, *missing),
+        ) as cursor:
+            rows = await cursor.fetchall()
+    for row in rows:
+        tag_info = {
+            "tag": row[0],
+            "content": content_cache.read(row[1], row[2], row[3]),
+            "created_by": row[4],
+            "created_at": row[5],
+            "usage_count": row[6],
+        }
+        tag_cache.put(server_id, row[0], tag_info, token)
+        tag_info["usage_count"] += usage_buffer.pending_for(server_id, row[0])
+        found[row[0]] = tag_info
+    return found
+
+
+@timed(DB_CALL_SECONDS)
+async def delete_message(server_id, tag):
+    """Deletes a message associated with a tag from the database."""
+    server_id = str(server_id)
+    with tag_cache.writing():
+        async with pool.writer() as db:
+            await db.execute(
+                "DELETE FROM messages WHERE server_id = ? AND tag = ?", (server_id, tag)
+            )
+        usage_buffer.discard(server_id, tag)
+        tag_cache.invalidate(server_id, tag)
+        embed_cache.invalidate(server_id, tag)
+        tag_filter.remove(server_id, tag)
+        suggestion_index.remove(server_id, tag)
+        prefix_index.remove(server_id, tag)
+
+
+@timed(DB_CALL_SECONDS)
 async def update_message(server_id, tag, content):
     """Updates the content of a message associated with a tag in the database."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE messages SET content = ? WHERE server_id = ? AND tag = ?",
-            (content, server_id, tag),
-        )
-        await db.commit()
-
-
-async def get_all_messages(server_id):
+    server_id = str(server_id)
+    encoded = encode(content)
+    with tag_cache.writing():
+        async with pool.writer() as db:
+            content_id = await store(db, encoded)
+            cursor = await db.execute(
+                "UPDATE messages SET content_id = ? WHERE server_id = ? AND tag = ?",
+                (content_id, server_id, tag),
+            )
+            if cursor.rowcount == 0:
+                # No trigger collects a content stored for a missing tag.
+                await db.execute(
+                    "DELETE FROM contents WHERE id = ? AND refcount <= 0",
+                    (content_id,),
+                )
+        tag_cache.update(server_id, tag, content=content)
+        embed_cache.invalidate(server_id, tag)
+
+
+@timed(DB_CALL_SECONDS)
+async def get_all_messages(server_id, after_tag=None, limit=None):
     """
-    Retrieve all messages and their details (tag, content, created_by, created_at,
-    usage_count).
+    Retrieve messages and their details (tag, content, created_by, created_at,
+    usage_count) from the database for a specific server, ordered by tag.
 
-    from the database for a specific server.
+    Pages are read with keyset pagination: pass the last tag of a page as
+    `after_tag` to get the next one, which the (server_id, tag) index answers
+    without skipping over the previous pages.
 
     Args:
-      server_id (str): The ID of the server from which to retrieve all messages.
+      server_id (str): The ID of the server from which to retrieve the messages.
+      after_tag (str): Only return tags sorted after this one, if given.
+      limit (int): The maximum number of messages to return, all of them if None.
 
     Returns:
       A list of dictionaries, each containing details about a message.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
+    server_id = str(server_id)
+    async with pool.reader() as db:
+        async with db.execute(
             """
-            SELECT tag, content, created_by, created_at, usage_count
-            FROM messages
-            WHERE server_id = ?
+            SELECT tag, hash, body, compressed, created_by, created_at, usage_count
+            FROM messages JOIN contents ON contents.id = messages.content_id
+            WHERE server_id = ? AND tag > ?
+            ORDER BY tag
+            LIMIT ?
             """,
-            (server_id,),
-        )
-        rows = await cursor.fetchall()
+            (server_id, after_tag or "", -1 if limit is None else limit),
+        ) as cursor:
+            rows = await cursor.fetchall()
 
         # Convert rows to a list of dictionaries for easier access in the calling function
         messages = [
             {
                 "tag": row[0],
-                "content": row[1],
-                "created_by": row[2],
-                "created_at": row[3],
-                "usage_count": row[4],
+                "content": content_cache.read(row[1], row[2], row[3]),
+                "created_by": row[4],
+                "created_at": row[5],
+                "usage_count": row[6] + usage_buffer.pending_for(server_id, row[0]),
             }
             for row in rows
         ]
@@ -160,63 +579,134 @@ async def get_all_messages(server_id):
         return messages
 
 
-async def get_all_tags_for_all_servers():
+async def iter_all_tags_for_all_servers(chunk_size=1000):
     """
-    Retrieve all tags and their details (tag, content, created_by, created_at,
-    usage_count).
+    Iterate over all tags and their details (server_id, tag, content, created_by,
+    created_at, usage_count) from the database for all servers, in chunks.
 
-    from the database for all servers.
+    Only one chunk is held in memory at a time, and every chunk comes from the
+    same read snapshot of the database. Contents are decompressed without
+    going through the content cache, so an export does not evict hot tags.
 
-    Returns:
+    Args:
+      chunk_size (int): The number of tags per chunk.
+
+    Yields:
       A list of dictionaries, each containing details about a tag.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
+    async with pool.reader() as db:
+        async with db.execute(
             """
-            SELECT server_id, tag, content, created_by, created_at, usage_count
-            FROM messages
+            SELECT server_id, tag, body, compressed, created_by, created_at, usage_count
+            FROM messages JOIN contents ON contents.id = messages.content_id
             """
-        )
-        rows = await cursor.fetchall()
+        ) as cursor:
+            while rows := await cursor.fetchmany(chunk_size):
+                yield [
+                    {
+                        "server_id": row[0],
+                        "tag": row[1],
+                        "content": decode(row[2], row[3]),
+                        "created_by": row[4],
+                        "created_at": row[5],
+                        "usage_count": row[6]
+                        + usage_buffer.pending_for(row[0], row[1]),
+                    }
+                    for row in rows
+                ]
+
+
+@timed(DB_CALL_SECONDS)
+async def increment_usage_count(server_id, tag):
+    """
+    Increments the usage count for a specific tag.
 
-        # Convert rows to a list of dictionaries for easier access in the calling function
-        tags = [
-            {
-                "server_id": row[0],
-                "tag": row[1],
-                "content": row[2],
-                "created_by": row[3],
-                "created_at": row[4],
-                "usage_count": row[5],
-            }
-            for row in rows
-        ]
+    The increment is buffered in memory and written to the database with
+    other ones by the usage buffer.
+    """
+    server_id = str(server_id)
+    await usage_buffer.record(server_id, tag)
+    suggestion_index.add_usage(server_id, tag)
 
-        return tags
 
+@timed(DB_CALL_SECONDS)
+async def increment_usage_counts(server_id, tags):
+    """
+    Increments the usage count of several tags of a server at once.
 
-async def increment_usage_count(server_id, tag):
-    """Increments the usage count for a specific tag."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE messages SET usage_count = usage_count + 1 WHERE server_id = ? AND tag = ?",
-            (server_id, tag),
-        )
-        await db.commit()
+    The increments are buffered together, so they cost at most one flush.
+    """
+    server_id = str(server_id)
+    await usage_buffer.record_many((server_id, tag) for tag in tags)
+    for tag in tags:
+        suggestion_index.add_usage(server_id, tag)
 
 
+@timed(DB_CALL_SECONDS)
 async def reset_usage_count(server_id, tag):
     """Resets the usage count for a specific tag to zero."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE messages SET usage_count = 1 WHERE server_id = ? AND tag = ?",
-            (server_id, tag),
+    server_id = str(server_id)
+    await usage_buffer.flush()
+    with tag_cache.writing():
+        async with pool.writer() as db:
+            await db.execute(
+                "UPDATE messages SET usage_count = 1 WHERE server_id = ? AND tag = ?",
+                (server_id, tag),
+            )
+        usage_buffer.discard(server_id, tag)
+        tag_cache.update(server_id, tag, usage_count=1)
+
+
+@timed(DB_CALL_SECONDS)
+async def purge_tags(server_id):
+    """
+    Deletes all tags associated with a specific server.
+
+    The contents no other tag uses are deleted with them by the triggers
+    of the messages table, see db/migrations.py.
+    """
+    server_id = str(server_id)
+    with tag_cache.writing():
+        async with pool.writer() as db:
+            await db.execute("DELETE FROM messages WHERE server_id = ?", (server_id,))
+        usage_buffer.discard_guild(server_id)
+        tag_cache.invalidate_guild(server_id)
+        embed_cache.invalidate_guild(server_id)
+        tag_filter.drop(server_id)
+        suggestion_index.drop(server_id)
+        prefix_index.drop(server_id)
+
+
+@timed(DB_CALL_SECONDS)
+async def get_state(key):
+    """
+    Retrieves a value the bot keeps across restarts.
+
+    Args:
+      key (str): The name of the value.
+
+    Returns:
+      The value, or None if it was never stored.
+    """
+    async with pool.reader() as db:
+        rows = await db.execute_fetchall(
+            "SELECT value FROM bot_state WHERE key = ?", (key,)
         )
-        await db.commit()
+    return rows[0][0] if rows else None
 
 
-async def purge_tags(server_id):
-    """Deletes all tags associated with a specific server."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM messages WHERE server_id = ?", (server_id,))
-        await db.commit()
+@timed(DB_CALL_SECONDS)
+async def set_state(key, value):
+    """
+    Stores a value the bot keeps across restarts, replacing the previous one.
+
+    Args:
+      key (str): The name of the value.
+      value (str): The value.
+    """
+    async with pool.writer() as db:
+        await db.execute(
+            "INSERT INTO bot_state (key, value) VALUES (?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
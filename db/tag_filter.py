@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the per-server filter of existing tag names.
+
+It answers "does this tag possibly exist?" from memory, so lookups of tags
+that definitely do not exist never reach the database.
+
+Classes:
+- BloomFilter:
+A fixed-size Bloom filter of strings.
+
+- TagFilter:
+The per-server filters of tag names, kept in sync with writes.
+"""
+
+import hashlib
+import math
+
+from sharding import shard_for_guild
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of strings.
+
+    Attributes:
+    - capacity (int): The number of items the filter is sized for.
+    - count (int): The number of items added so far.
+    """
+
+    __slots__ = ("capacity", "count", "_bits", "_size", "_hashes")
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(1, capacity)
+        self.count = 0
+        self._size = max(
+            8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        self._hashes = max(1, round(self._size / self.capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def _positions(self, item):
+        """Yields the bit positions of an item, using double hashing."""
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self._hashes):
+            yield (first + i * second) % self._size
+
+    def add(self, item):
+        """Adds an item to the filter."""
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+# pylint: disable=too-many-instance-attributes
+class TagFilter:
+    """
+    The per-server filters of tag names, kept in sync with writes.
+
+    Servers with few tags get an exact set of names, larger ones a Bloom
+    filter. A Bloom filter cannot forget a name, so deleted tags are only
+    counted; once too many deletions or additions have made it inaccurate the
+    server is marked for a rebuild and treated as unknown until then.
+
+    Servers are keyed by the str form of their ID, whichever form they are
+    given in. Until `install()` has run, every tag possibly exists. Only the
+    servers on the shards run by this process get a filter; every tag of
+    another server possibly exists.
+
+    Attributes:
+    - exact_limit (int): The number of tags above which a Bloom filter is used.
+    - error_rate (float): The false positive rate Bloom filters are sized for.
+    - shard_count (int): The total number of shards of the bot.
+    - shard_ids (list): The shards run by this process, None for all of them.
+    - loaded (bool): True once the filters have been built.
+    - skipped (int): The number of lookups answered without the database.
+    """
+
+    def __init__(self, exact_limit=64, error_rate=0.01, shard_count=1, shard_ids=None):
+        self.exact_limit = exact_limit
+        self.error_rate = error_rate
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        self.loaded = False
+        self.skipped = 0
+        self._guilds = {}
+        self._removed = {}
+        self._stale = set()
+        self._journal = None
+        self._generation = 0
+
+    def covers(self, server_id):
+        """Checks if a server is on a shard run by this process."""
+        return (
+            self.shard_ids is None
+            or shard_for_guild(server_id, self.shard_count) in self.shard_ids
+        )
+
+    def build(self, tags):
+        """Returns the filter to use for a server with the given tag names."""
+        tags = set(tags)
+        if len(tags) <= self.exact_limit:
+            return tags
+
+        bloom = BloomFilter(len(tags) * 2, self.error_rate)
+        for tag in tags:
+            bloom.add(tag)
+        return bloom
+
+    def start_loading(self):
+        """Starts recording the writes that happen while the filters are built."""
+        self._journal = []
+
+    def install(self, guilds):
+        """
+        Installs the filters built since `start_loading()` and replays the
+        writes that happened in the meantime.
+
+        Args:
+        - guilds (dict): The filter of each server that has tags.
+        """
+        journal, self._journal = self._journal or [], None
+        self._guilds = guilds
+        self._removed = {}
+        self._stale = set()
+        self.loaded = True
+        for operation, server_id, tag in journal:
+            getattr(self, operation)(server_id, tag)
+
+    def might_contain(self, server_id, tag):
+        """
+        Checks if a tag possibly exists.
+
+        Args:
+        - server_id (str or int): The ID of the server to check.
+        - tag (str): The name of the tag.
+
+        Returns:
+        - bool: False if the tag definitely does not exist, True otherwise.
+        """
+        server_id = str(server_id)
+        if not self.loaded or server_id in self._stale or not self.covers(server_id):
+            return True
+
+        names = self._guilds.get(server_id)
+        if names is not None and tag in names:
+            return True
+
+        self.skipped += 1
+        return False
+
+    def has_tags(self, server_id):
+        """
+        Checks if a server possibly has tags.
+
+        Returns:
+        - bool: False if the server definitely has no tag, True otherwise.
+        """
+        server_id = str(server_id)
+        if not self.loaded or server_id in self._stale or not self.covers(server_id):
+            return True
+        return server_id in self._guilds
+
+    def needs_rebuild(self, server_id):
+        """Checks if the filter of a server must be rebuilt from the database."""
+        return str(server_id) in self._stale
+
+    def token(self):
+        """Returns the token to pass to `rebuild()` after reading from the database."""
+        return self._generation
+
+    def rebuild(self, server_id, tags, token):
+        """Replaces the filter of a server, unless a write happened since `token`."""
+        server_id = str(server_id)
+        if token != self._generation:
+            return
+        self._guilds[server_id] = self.build(tags)
+        self._removed.pop(server_id, None)
+        self._stale.discard(server_id)
+
+    def add(self, server_id, tag):
+        """Adds a tag name to the filter of its server."""
+        server_id = str(server_id)
+        self._generation += 1
+        if self._journal is not None:
+            self._journal.append(("add", server_id, tag))
+        if not self.loaded or server_id in self._stale or not self.covers(server_id):
+            return
+
+        names = self._guilds.get(server_id)
+        if names is None:
+            self._guilds[server_id] = {tag}
+        elif isinstance(names, set):
+            names.add(tag)
+            if len(names) > self.exact_limit:
+                self._guilds[server_id] = self.build(names)
+        else:
+            names.add(tag)
+            if names.count > names.capacity:
+                self._stale.add(server_id)
+
+    def remove(self, server_id, tag):
+        """Removes a tag name from the filter of its server."""
+        server_id = str(server_id)
+        self._generation += 1
+        if self._journal is not None:
+            self._journal.append(("remove", server_id, tag))
+        if not self.loaded or server_id in self._stale or not self.covers(server_id):
+            return
+
+        names = self._guilds.get(server_id)
+        if isinstance(names, set):
+            names.discard(tag)
+            if not names:
+                del self._guilds[server_id]
+        elif names is not None:
+            removed = self._removed.get(server_id, 0) + 1
+            self._removed[server_id] = removed
+            if removed > names.capacity // 4:
+                self._stale.add(server_id)
+
+    def drop(self, server_id, tag=None):
+        """Removes every tag name of a server."""
+        server_id = str(server_id)
+        self._generation += 1
+        if self._journal is not None:
+            self._journal.append(("drop", server_id, tag))
+        self._guilds.pop(server_id, None)
+        self._removed.pop(server_id, None)
+        self._stale.discard(server_id)
+
+    def invalidate(self, server_id, tag=None):
+        """
+        Marks the filter of a server for a rebuild, once its tags were changed
+        by another process.
+        """
+        server_id = str(server_id)
+        self._generation += 1
+        if self._journal is not None:
+            self._journal.append(("invalidate", server_id, tag))
+        if self.loaded and self.covers(server_id):
+            self._stale.add(server_id)
+
+    def clear(self):
+        """Forgets every filter, so every tag possibly exists until reloaded."""
+        self._generation += 1
+        self.loaded = False
+        self._guilds = {}
+        self._removed = {}
+        self._stale = set()
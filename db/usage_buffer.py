@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the write-behind buffer for tag usage counters.
+
+Classes:
+- UsageBuffer:
+Gathers usage increments in memory and writes them in batches.
+"""
+
+import asyncio
+import contextlib
+
+import sentry_sdk
+
+
+# pylint: disable=too-many-instance-attributes
+class UsageBuffer:
+    """
+    Gathers usage increments in memory and writes them in batches.
+
+    Each tag hit only bumps an in-memory counter. Pending counters are written
+    in a single transaction with `executemany` every `interval` seconds, or as
+    soon as `threshold` distinct tags are pending, so a burst of hits costs one
+    commit instead of one per hit. Readers add `pending_for()` to the usage
+    count stored in the database to show an exact number.
+
+    Attributes:
+    - pool (ConnectionPool): The pool used to write the counters.
+    - cache (TagCache): The tag cache, updated once a batch is committed.
+    - interval (float): The number of seconds between two flushes.
+    - threshold (int): The number of pending tags that triggers a flush.
+    """
+
+    def __init__(self, pool, cache, interval=10.0, threshold=500):
+        self.pool = pool
+        self.cache = cache
+        self.interval = interval
+        self.threshold = threshold
+        self._pending = {}
+        self._flushing = {}
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        """Starts the periodic flush task, if it is not already running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stops the periodic flush task, then writes every pending counter."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def record(self, server_id, tag, amount=1):
+        """
+        Records uses of a tag.
+
+        Args:
+        - server_id (str): The ID of the server the tag belongs to.
+        - tag (str): The name of the tag.
+        - amount (int): The number of uses to add.
+        """
+        key = (server_id, tag)
+        self._pending[key] = self._pending.get(key, 0) + amount
+        if len(self._pending) >= self.threshold:
+            await self.flush()
+
+    async def record_many(self, keys):
+        """
+        Records one use of each of several tags, checking the threshold once.
+
+        Args:
+        - keys (iterable): The (server_id, tag) pairs of the tags used.
+        """
+        for key in keys:
+            self._pending[key] = self._pending.get(key, 0) + 1
+        if len(self._pending) >= self.threshold:
+            await self.flush()
+
+    def pending_for(self, server_id, tag):
+        """Returns the number of uses of a tag not yet written to the database."""
+        key = (server_id, tag)
+        return self._pending.get(key, 0) + self._flushing.get(key, 0)
+
+    def discard(self, server_id, tag):
+        """Forgets the pending uses of a tag."""
+        self._pending.pop((server_id, tag), None)
+
+    def discard_guild(self, server_id):
+        """Forgets the pending uses of every tag of a server."""
+        for key in [key for key in self._pending if key[0] == server_id]:
+            del self._pending[key]
+
+    @contextlib.asynccontextmanager
+    async def suspended(self):
+        """
+        Holds off flushes for the duration of the block, then forgets every
+        pending counter.
+
+        Used while the database is replaced, so counters of the old database
+        are never written into the new one.
+        """
+        async with self._flush_lock:
+            try:
+                yield
+            finally:
+                self._pending = {}
+
+    async def flush(self):
+        """Writes every pending counter in a single transaction."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            try:
+                with self.cache.writing():
+                    async with self.pool.writer() as db:
+                        await db.executemany(
+                            "UPDATE messages SET usage_count = usage_count + ?"
+                            + " WHERE server_id = ? AND tag = ?",
+                            [
+                                (amount, server_id, tag)
+                                for (server_id, tag), amount in batch.items()
+                            ],
+                        )
+                    for (server_id, tag), amount in batch.items():
+                        self.cache.add_usage(server_id, tag, amount)
+            except Exception:
+                # Keep the counts for the next flush rather than losing them.
+                for key, amount in batch.items():
+                    self._pending[key] = self._pending.get(key, 0) + amount
+                raise
+            finally:
+                self._flushing = {}
+
+    async def _run(self):
+        """Flushes the pending counters every `interval` seconds."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                sentry_sdk.capture_exception(e)
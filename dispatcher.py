@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the outbound queue of the replies to tag triggers.
+
+Classes:
+- Notice:
+A low-value reply, telling that a tag was not found.
+
+- SendDispatcher:
+Queues replies per channel and sends them one message at a time.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+import config
+from helper import MAX_MESSAGE_LENGTH, join_replies, sentry_capture
+from metrics import Counter, Gauge, Histogram
+
+SEND_WAIT_SECONDS = Histogram(
+    "tagsy_send_wait_seconds",
+    "Time replies waited in the send queue of their channel.",
+)
+SEND_REPLIES = Counter(
+    "tagsy_send_replies_total",
+    "Replies queued for sending, by what became of them.",
+    labels=("outcome",),
+)
+SEND_MESSAGES = Counter(
+    "tagsy_send_messages_total",
+    "Messages sent by the send queues, by status.",
+    labels=("status",),
+)
+
+
+class Notice(str):
+    """
+    A low-value reply, telling that a tag was not found.
+
+    Notices are sent like any other reply while their channel keeps up. Under
+    pressure they are folded into a single line naming every missing tag, or
+    dropped once that line is full.
+
+    Attributes:
+    - tag (str): The name of the tag that was not found.
+    """
+
+    def __new__(cls, text, tag):
+        notice = super().__new__(cls, text)
+        notice.tag = tag
+        return notice
+
+
+def _resolve(futures, message):
+    """Resolves the futures of the senders of a message."""
+    for future in futures:
+        if not future.done():
+            future.set_result(message)
+
+
+def _missing_notice(tags, room):
+    """
+    Returns the folded notice naming missing tags, in at most `room` characters.
+
+    Tags past the room are counted in a "+N more" tail instead.
+
+    Returns:
+    - str: The notice, or None if not even one tag fits.
+    """
+    for shown in range(len(tags), 0, -1):
+        notice = "No message found for tags: " + ", ".join(
+            f'"{tag}"' for tag in tags[:shown]
+        )
+        notice += f" (+{len(tags) - shown} more)." if shown < len(tags) else "."
+        if len(notice) <= room:
+            return notice
+    return None
+
+
+class _ChannelQueue:  # pylint: disable=too-few-public-methods
+    """The replies waiting to be sent to a channel, and the task sending them."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        # (content, time queued, futures of its senders) of every pending reply.
+        self.replies = deque()
+        # Names of the missing tags folded into a single notice, in order.
+        self.missing = {}
+        # Futures of the senders of the folded notice.
+        self.missing_waiters = []
+        self.task = None
+
+
+class SendDispatcher:
+    """
+    Queues replies per channel and sends them one message at a time.
+
+    Every channel gets its own queue, drained by a single task, so a flood in
+    one channel never delays the replies of another, and at most one send per
+    channel waits on Discord's rate limits. Replies queued while a send is in
+    flight are merged into as few messages as fit MAX_MESSAGE_LENGTH, and a
+    reply identical to one still queued is dropped. `enqueue()` returns a
+    future telling when, and in which message, the replies went out.
+
+    A channel is under pressure once `pressure_depth` replies are queued for
+    it. Notices queued then are folded into a single "No message found" line,
+    sent with the next message, and notices past `max_missing` missing tags
+    are dropped. Past `queue_limit` queued replies the oldest one is dropped.
+
+    Attributes:
+    - queue_limit (int): The maximum number of replies queued per channel.
+    - pressure_depth (int): The number of queued replies from which notices
+      are folded together.
+    - max_missing (int): The maximum number of missing tags named by the
+      folded notice of a channel.
+    """
+
+    def __init__(self, queue_limit=50, pressure_depth=3, max_missing=20):
+        self.queue_limit = queue_limit
+        self.pressure_depth = pressure_depth
+        self.max_missing = max_missing
+        self._queues = {}
+
+    def __len__(self):
+        return sum(len(queue.replies) for queue in self._queues.values())
+
+    def channel_count(self):
+        """Returns the number of channels with replies waiting to be sent."""
+        return len(self._queues)
+
+    def depth(self, channel_id):
+        """Returns the number of replies queued for a channel."""
+        queue = self._queues.get(channel_id)
+        return 0 if queue is None else len(queue.replies)
+
+    def enqueue(self, channel, parts):
+        """
+        Queues the replies to a message, to be sent as a single message.
+
+        Args:
+        - channel (disnake.abc.Messageable): The channel to send to.
+        - parts (list): The replies, strings or `Notice` instances, in order.
+
+        Returns:
+        - asyncio.Future: Resolved with the message the replies were sent in,
+          alone or merged with others, or with None if they were dropped or
+          could not be sent.
+        """
+        delivered = asyncio.get_running_loop().create_future()
+        if not parts:
+            delivered.set_result(None)
+            return delivered
+        queue = self._queues.get(channel.id)
+        if queue is None:
+            queue = self._queues[channel.id] = _ChannelQueue(channel)
+
+        if len(queue.replies) >= self.pressure_depth:
+            folded = [
+                self._fold(queue, part.tag)
+                for part in parts
+                if isinstance(part, Notice)
+            ]
+            parts = [part for part in parts if not isinstance(part, Notice)]
+            if not parts:
+                if any(folded):
+                    queue.missing_waiters.append(delivered)
+                else:
+                    delivered.set_result(None)
+
+        if parts:
+            content = join_replies(parts)
+            for queued, _, waiters in queue.replies:
+                if content == queued:
+                    SEND_REPLIES.inc(outcome="deduplicated")
+                    waiters.append(delivered)
+                    break
+            else:
+                if len(queue.replies) >= self.queue_limit:
+                    _, queued_at, waiters = queue.replies.popleft()
+                    SEND_WAIT_SECONDS.observe(time.monotonic() - queued_at)
+                    SEND_REPLIES.inc(outcome="dropped")
+                    _resolve(waiters, None)
+                queue.replies.append((content, time.monotonic(), [delivered]))
+
+        if queue.task is None:
+            queue.task = asyncio.create_task(self._drain(queue))
+        return delivered
+
+    def _fold(self, queue, tag):
+        """
+        Adds a missing tag to the folded notice of a channel.
+
+        Returns:
+        - bool: True if the folded notice names the tag, False if it is full.
+        """
+        if tag in queue.missing:
+            SEND_REPLIES.inc(outcome="deduplicated")
+            return True
+        if len(queue.missing) >= self.max_missing:
+            SEND_REPLIES.inc(outcome="dropped")
+            return False
+        queue.missing[tag] = None
+        SEND_REPLIES.inc(outcome="folded")
+        return True
+
+    def _next_message(self, queue):
+        """
+        Takes the replies of the next message off a queue.
+
+        Returns:
+        - tuple: The content of the message and the futures of its senders.
+        """
+        content = ""
+        delivered = []
+        now = time.monotonic()
+        while queue.replies:
+            reply, queued_at, waiters = queue.replies[0]
+            candidate = f"{content}\n\n{reply}" if content else reply
+            if content and len(candidate) > MAX_MESSAGE_LENGTH:
+                break
+            queue.replies.popleft()
+            SEND_WAIT_SECONDS.observe(now - queued_at)
+            SEND_REPLIES.inc(outcome="merged" if content else "sent")
+            content = candidate
+            delivered.extend(waiters)
+
+        if queue.missing:
+            room = (
+                MAX_MESSAGE_LENGTH - len(content) - 2 if content else MAX_MESSAGE_LENGTH
+            )
+            notice = _missing_notice(list(queue.missing), room)
+            # Otherwise sent with the next message, alone if need be.
+            if notice is not None:
+                queue.missing.clear()
+                content = f"{content}\n\n{notice}" if content else notice
+                delivered.extend(queue.missing_waiters)
+                queue.missing_waiters = []
+        return content, delivered
+
+    async def _drain(self, queue):
+        """Sends the replies queued for a channel until there are none left."""
+        try:
+            while queue.replies or queue.missing:
+                content, delivered = self._next_message(queue)
+                message = None
+                try:
+                    message = await queue.channel.send(content)
+                    SEND_MESSAGES.inc(status="ok")
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    # Reported, then the next replies of the channel are sent.
+                    SEND_MESSAGES.inc(status="error")
+                    guild = getattr(queue.channel, "guild", None)
+                    sentry_capture(e, guild.id if guild else 0)
+                finally:
+                    _resolve(delivered, message)
+        finally:
+            del self._queues[queue.channel.id]
+            for _, _, waiters in queue.replies:
+                _resolve(waiters, None)
+            _resolve(queue.missing_waiters, None)
+
+    async def close(self, timeout=5.0):
+        """
+        Waits up to `timeout` seconds for the queued replies to be sent, then
+        drops the rest.
+        """
+        tasks = [queue.task for queue in self._queues.values()]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+# Shared by every listener replying to tag triggers.
+dispatcher = SendDispatcher(
+    config.SEND_QUEUE_LIMIT,
+    config.SEND_PRESSURE_DEPTH,
+    config.SEND_MAX_MISSING_TAGS,
+)
+Gauge(
+    "tagsy_send_queue_depth",
+    "Replies waiting in the send queues.",
+    lambda: len(dispatcher),
+)
+Gauge(
+    "tagsy_send_queue_channels",
+    "Channels with replies waiting to be sent.",
+    dispatcher.channel_count,
+)
@@ -7,7 +7,10 @@ import re
 import disnake
 from sentry_sdk import capture_exception
 
-from db.sqlite_handler import get_message
+from db.sqlite_handler import embed_cache, get_message
+
+# Discord refuses message content longer than this.
+MAX_MESSAGE_LENGTH = 2000
 
 
 def generate_recommendations(tag):
@@ -77,10 +80,26 @@ def sentry_capture(exception, server_id=0, user_id=0):
     capture_exception(exception, extra={"server_id": server_id, "user_id": user_id})
 
 
-def build_embed(tag_info, username):
+def _render_embed(tag_info, username):
+    """Returns the payload of a tag embed, without its usage count."""
+    created_at = datetime.datetime.strptime(tag_info["created_at"], "%Y-%m-%d %H:%M:%S")
+    created_at_formatted = created_at.strftime("%d/%m/%Y at %H:%M")
+
+    embed = disnake.Embed(title=f"Tag: {tag_info['tag']}", color=disnake.Color.blue())
+    embed.add_field(name="Content", value=tag_info["content"], inline=False)
+    embed.add_field(name="Created by", value=username, inline=True)
+    embed.add_field(name="Added", value=created_at_formatted, inline=True)
+    return embed.to_dict()
+
+
+def build_embed(tag_info, username, server_id=None):
     """
     Builds an embed for a tagged message.
 
+    Everything but the usage count is rendered once per tag and cached, when
+    `server_id` is given, so popular tags are not formatted again on every
+    use.
+
     Args:
         tag_info (dict): A dictionary containing information about the tag.
             It should have the following keys:
@@ -95,23 +114,28 @@ def build_embed(tag_info, username):
             - 'usage_count': The number of times the tag has been used.
 
         username (str): The username of the user who created the tag.
+        server_id (str): The ID of the server the tag belongs to, to cache
+            the rendering.
 
     Returns:
         disnake.Embed: An embed object representing the tagged message.
     """
-    created_at = datetime.datetime.strptime(tag_info["created_at"], "%Y-%m-%d %H:%M:%S")
-    created_at_formatted = created_at.strftime("%d/%m/%Y at %H:%M")
-
-    embed = disnake.Embed(title=f"Tag: {tag_info['tag']}", color=disnake.Color.blue())
-    embed.add_field(name="Content", value=tag_info["content"], inline=False)
-    embed.add_field(name="Created by", value=username, inline=True)
-    embed.add_field(name="Added", value=created_at_formatted, inline=True)
-    embed.add_field(
-        name="Number of calls",
-        value=str(tag_info["usage_count"]),
-        inline=True,
-    )
-    return embed
+    fingerprint = (tag_info["content"], tag_info["created_at"], username)
+    payload = None
+    if server_id is not None:
+        payload = embed_cache.get(server_id, tag_info["tag"], fingerprint)
+    if payload is None:
+        payload = _render_embed(tag_info, username)
+        if server_id is not None:
+            embed_cache.put(server_id, tag_info["tag"], fingerprint, payload)
+
+    usage = {
+        "name": "Number of calls",
+        "value": str(tag_info["usage_count"]),
+        "inline": True,
+    }
+    # The cached payload is shared, so the embed gets its own list of fields.
+    return disnake.Embed.from_dict({**payload, "fields": [*payload["fields"], usage]})
 
 
 def find_tag_in_string(s):
@@ -126,3 +150,35 @@ def find_tag_in_string(s):
     """
     tags = re.findall(r"§(\w+[-\w]*)", s)
     return tags
+
+
+def join_replies(parts, limit=MAX_MESSAGE_LENGTH):
+    """
+    Joins replies into the content of a single message.
+
+    Replies are kept in order for as long as they fit in `limit` characters;
+    the ones that do not fit are replaced by a note saying how many were left
+    out. A first reply longer than the limit on its own is truncated.
+
+    Args:
+        parts (list): The replies to join.
+        limit (int): The maximum length of the message.
+
+    Returns:
+        str: The content of the message.
+    """
+    content = ""
+    for index, part in enumerate(parts):
+        left_out = len(parts) - index - 1
+        # Room is kept for the note in case the next reply does not fit.
+        room = (
+            limit - len(f"\n\n({left_out} more tags not shown)") if left_out else limit
+        )
+        candidate = f"{content}\n\n{part}" if content else part
+        if len(candidate) <= room:
+            content = candidate
+        elif not content:
+            content = part[: room - 1] + "…"
+        else:
+            return content + f"\n\n({left_out + 1} more tags not shown)"
+    return content
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the cache of member display names used in tag embeds.
+
+Classes:
+- DisplayNameCache:
+A bounded TTL cache of display names keyed by (guild ID, user ID).
+"""
+
+import asyncio
+import time
+
+import disnake
+
+import config
+from metrics import Gauge, ratio
+from sharding import ShardedLRU
+
+UNKNOWN_USER = "Unknown user"
+
+
+class DisplayNameCache:
+    """
+    A bounded TTL cache of display names keyed by (guild ID, user ID).
+
+    Names are taken from the gateway member cache when the member is in it,
+    and fetched over REST otherwise. Concurrent lookups of the same member
+    share a single request, and members that are not found (they left the
+    server) are remembered for `negative_ttl` seconds.
+
+    Attributes:
+    - ttl (float): The number of seconds a display name stays cached.
+    - negative_ttl (float): The number of seconds a missing member stays cached.
+    - capacity (int): The maximum number of cached names, split evenly
+      between shards.
+    - hits (int): The number of lookups answered without a REST request.
+    - fetches (int): The number of REST requests made.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        ttl=600.0,
+        negative_ttl=300.0,
+        capacity=10000,
+        shard_count=1,
+        shard_ids=None,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.capacity = capacity
+        self.hits = 0
+        self.fetches = 0
+        self._entries = ShardedLRU(
+            capacity, shard_count, guild_of=lambda key: key[0], shard_ids=shard_ids
+        )
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _store(self, key, name, ttl):
+        """Caches a display name for `ttl` seconds."""
+        self._entries[key] = (name, time.monotonic() + ttl)
+
+    async def get(self, guild, user_id):
+        """
+        Returns the display name of a member of a guild.
+
+        Args:
+        - guild (disnake.Guild): The guild the member belongs to.
+        - user_id (int): The ID of the member.
+
+        Returns:
+        - str: The display name, or "Unknown user" if the member was not found.
+
+        Raises:
+        - disnake.HTTPException: If fetching the member failed.
+        """
+        key = (guild.id, user_id)
+        entry = self._entries.touch(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(key)
+
+        member = guild.get_member(user_id)
+        if member is not None:
+            self.hits += 1
+            self._store(key, member.display_name, self.ttl)
+            return member.display_name
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(guild, user_id))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one caller giving up does not cancel the others.
+        return await asyncio.shield(task)
+
+    async def _fetch(self, guild, user_id):
+        """Fetches the display name of a member over REST and caches it."""
+        self.fetches += 1
+        key = (guild.id, user_id)
+        try:
+            member = await guild.fetch_member(user_id)
+        except disnake.NotFound:
+            self._store(key, UNKNOWN_USER, self.negative_ttl)
+            return UNKNOWN_USER
+
+        self._store(key, member.display_name, self.ttl)
+        return member.display_name
+
+    def repartition(self, shard_count, shard_ids=None):
+        """Splits the cached names between a new set of shards."""
+        self._entries.repartition(shard_count, shard_ids)
+
+    def invalidate(self, guild_id, user_id):
+        """Drops the cached display name of a member."""
+        self._entries.pop((guild_id, user_id), None)
+
+
+# Shared by every command displaying tag authors.
+display_names = DisplayNameCache(
+    config.MEMBER_NAME_TTL,
+    config.MEMBER_NAME_NEGATIVE_TTL,
+    config.MEMBER_NAME_CACHE_SIZE,
+    config.SHARD_COUNT or 1,
+    config.SHARD_IDS,
+)
+Gauge(
+    "tagsy_display_name_cache_hit_ratio",
+    "Share of display name lookups answered without a REST request.",
+    lambda: ratio(display_names.hits, display_names.fetches),
+)
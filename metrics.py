@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the metrics of Tagsy and the HTTP server exposing them.
+
+Metrics are rendered in the Prometheus text format. Everything is kept in
+memory and only formatted when the endpoint is scraped, so recording a value
+costs a dictionary update.
+
+Functions:
+- timed(histogram, label="function"):
+Decorates a coroutine function to observe the duration of its calls.
+
+- render():
+Renders every registered metric in the Prometheus text format.
+
+- resident_memory():
+Returns the memory used by this process, in bytes.
+
+- memory_per_guild(bot):
+Returns the memory used by this process per guild of a bot, in bytes.
+
+- serve(port, routes, host="0.0.0.0"):
+Starts a minimal HTTP server answering GET requests.
+
+- start(bot, port=None, host=None):
+Starts the metrics server, the event loop lag monitor and the slash command
+timings of a bot.
+
+Classes:
+- Counter:
+A monotonically increasing value per label set.
+
+- Histogram:
+Observations counted in cumulative buckets per label set.
+
+- Gauge:
+A value computed when the metrics are rendered.
+"""
+
+import asyncio
+import functools
+import json
+import math
+import os
+import resource
+import time
+from bisect import bisect_left
+
+import config
+from sharding import shard_stats
+
+# Every metric created, in the order they are rendered.
+REGISTRY = []
+
+# Seconds; tuned for in-memory lookups up to slow Discord API calls.
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+def _format_labels(names, values, extra=()):
+    """Formats a label set, e.g. `{function="get_message"}`."""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class _Metric:
+    """The name, help text and label names shared by every metric type."""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        """Returns the label values of a label set, in declaration order."""
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def header(self):
+        """Returns the HELP and TYPE lines of the metric."""
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def samples(self):
+        """Returns the sample lines of the metric."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        """Adds to the value of a label set."""
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """Observations counted in cumulative buckets per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value, **labels):
+        """Records an observation for a label set."""
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # One count per bucket plus +Inf, then the sum.
+            state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        # The first bucket whose bound is >= value, or +Inf past the last one.
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def samples(self):
+        lines = []
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state):
+                cumulative += count
+                labels = _format_labels(self.labels, key, (("le", bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {state[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    A value computed when the metrics are rendered.
+
+    The callback returns either a number, or (labels, value) pairs where
+    labels is a dictionary of label values.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labels=()):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def samples(self):
+        value = self.callback()
+        if value is None:
+            return []
+        if isinstance(value, (int, float)):
+            return [f"{self.name} {value}"]
+        return [
+            f"{self.name}{_format_labels(self.labels, self._key(labels))} {number}"
+            for labels, number in value
+        ]
+
+
+def ratio(hits, misses):
+    """Returns hits / (hits + misses), or None before the first lookup."""
+    total = hits + misses
+    return hits / total if total else None
+
+
+def timed(histogram, label="function"):
+    """
+    Decorates a coroutine function to observe the duration of its calls,
+    labelled with the name of the function.
+
+    Args:
+    - histogram (Histogram): The histogram to record the durations in.
+    - label (str): The name of the label holding the function name.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(
+                    time.perf_counter() - started, **{label: func.__name__}
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def render():
+    """Renders every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        samples = metric.samples()
+        if samples:
+            lines.extend(metric.header())
+            lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def resident_memory():
+    """
+    Returns the memory used by this process, in bytes.
+
+    This is the current resident set size where /proc is available, and the
+    peak one elsewhere.
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Kilobytes on Linux, which is the only one without /proc we run on.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_per_guild(bot):
+    """
+    Returns the memory used by this process per guild of a bot, in bytes.
+
+    The whole process is divided by the guild count, so this includes the
+    fixed overhead of the interpreter: compare it between runtime modes or
+    over time, with a similar number of guilds.
+
+    Args:
+    - bot (disnake.Client): The bot of this process.
+
+    Returns:
+    - float: The memory per guild, or None before the guilds are known.
+    """
+    guilds = len(bot.guilds)
+    return resident_memory() / guilds if guilds else None
+
+
+_REASONS = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 503: "Unavailable"}
+
+
+async def serve(port, routes, host="0.0.0.0"):
+    """
+    Starts a minimal HTTP server answering GET requests.
+
+    Args:
+    - port (int): The port to listen on.
+    - routes (dict): Maps a path to a coroutine function returning a tuple
+      (status, content_type, body).
+    - host (str): The address to listen on.
+
+    Returns:
+    - asyncio.Server: The running server.
+    """
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            method, target = request.split(b" ", 2)[:2]
+            route = routes.get(target.decode("latin-1").split("?", 1)[0])
+            if method != b"GET":
+                status, content_type, body = 405, "text/plain", "Method not allowed\n"
+            elif route is None:
+                status, content_type, body = 404, "text/plain", "Not found\n"
+            else:
+                status, content_type, body = await route()
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            pass
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+EVENT_LOOP_LAG = Histogram(
+    "tagsy_event_loop_lag_seconds",
+    "Delay of the event loop in waking up a sleeping task.",
+)
+
+
+async def monitor_event_loop(interval=0.5):
+    """Measures how late the event loop wakes up a task, every `interval` seconds."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - started - interval))
+
+
+def _latencies(bot):
+    """Returns the heartbeat latency of every shard of a bot, as gauge samples."""
+    latencies = getattr(bot, "latencies", None) or [(bot.shard_id or 0, bot.latency)]
+    return [
+        ({"shard": shard_id}, latency)
+        for shard_id, latency in latencies
+        if math.isfinite(latency)  # Not a number until the first heartbeat
+    ]
+
+
+# Recorded by the on_message listener of commands/tag_command.py, which is
+# defined here so reloading the extension does not register them twice.
+TAG_TRIGGERS = Counter(
+    "tagsy_tag_triggers_total", "Messages containing at least one tag reference."
+)
+TAG_HITS = Counter("tagsy_tag_hits_total", "Tag references that were found.")
+TAG_MISSES = Counter("tagsy_tag_misses_total", "Tag references that were not found.")
+TAG_SUGGESTIONS = Counter(
+    "tagsy_tag_suggestions_total", "Tag references answered with suggestions."
+)
+
+SLASH_COMMAND_SECONDS = Histogram(
+    "tagsy_slash_command_seconds",
+    "Duration of the slash commands, including their Discord API calls.",
+    labels=("command", "status"),
+)
+
+_started = {}
+
+
+async def start(bot, port=None, host=None):
+    """
+    Starts the metrics server, the event loop lag monitor and the slash
+    command timings of a bot.
+
+    Does nothing if they are already running, so it is safe to call from
+    `on_ready`. The server answers `/metrics` in the Prometheus text format
+    and `/health` with the state of every shard, as JSON.
+
+    Args:
+    - bot (disnake.ext.commands.InteractionBot): The bot to report on.
+    - port (int): The port to listen on, METRICS_PORT by default; 0 disables
+      the server.
+    - host (str): The address to listen on, METRICS_HOST by default.
+
+    Raises:
+    - OSError: If the server could not listen on the port.
+    """
+    if _started:
+        return
+    _started["monitor"] = asyncio.get_running_loop().create_task(monitor_event_loop())
+    invoked_at = {}
+
+    @bot.before_slash_command_invoke
+    async def before_slash_command(inter):
+        invoked_at[inter.id] = time.perf_counter()
+
+    @bot.after_slash_command_invoke
+    async def after_slash_command(inter):
+        start_time = invoked_at.pop(inter.id, None)
+        if start_time is not None:
+            SLASH_COMMAND_SECONDS.observe(
+                time.perf_counter() - start_time,
+                command=inter.application_command.qualified_name,
+                status="error" if inter.command_failed else "ok",
+            )
+
+    Gauge(
+        "tagsy_gateway_latency_seconds",
+        "Heartbeat latency of each gateway shard.",
+        lambda: _latencies(bot),
+        labels=("shard",),
+    )
+    Gauge(
+        "tagsy_resident_memory_bytes",
+        "Memory used by the process.",
+        resident_memory,
+    )
+    Gauge(
+        "tagsy_memory_per_guild_bytes",
+        "Memory used by the process divided by its number of guilds.",
+        lambda: memory_per_guild(bot),
+    )
+    Gauge(
+        "tagsy_cached_users",
+        "Number of users held by the gateway cache, mostly guild members.",
+        lambda: len(bot.users),
+    )
+
+    async def metrics():
+        return 200, "text/plain; version=0.0.4; charset=utf-8", render()
+
+    async def health():
+        ready = bot.is_ready()
+        body = {
+            "ready": ready,
+            "shards": shard_stats.sample(bot),
+            "memory_bytes": resident_memory(),
+            "memory_per_guild_bytes": memory_per_guild(bot),
+        }
+        return 200 if ready else 503, "application/json", json.dumps(body)
+
+    port = config.METRICS_PORT if port is None else port
+    if port:
+        _started["server"] = await serve(
+            port,
+            {"/metrics": metrics, "/health": health},
+            host or config.METRICS_HOST,
+        )
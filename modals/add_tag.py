@@ -17,7 +17,7 @@ class AddTagModal(disnake.ui.Modal):
         Initialize the AddTagModal.
 
         Args:
-            server_id (int): The ID of the server where the tag will be added.
+            server_id (str): The ID of the server where the tag will be added.
         """
         self.server_id = server_id
         components = [
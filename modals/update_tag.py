@@ -54,7 +54,7 @@ class UpdateTagModal(disnake.ui.Modal):
         if not exists:
             similar_tags = await get_similar_tags(self.server_id, tag)
             if similar_tags:
-                suggestions = ", ".join([tag[0] for tag in similar_tags])
+                suggestions = ", ".join(similar_tags)
                 await interaction.response.send_message(
                     f"The tag `{tag}` does not exist. "
                     + f"Did you mean: {suggestions}? Use /add to create a new tag.",
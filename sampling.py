@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the sampling policy of Sentry performance monitoring.
+
+Functions:
+- parse_rates(value):
+Parses per-operation sample rates such as "on_message=0.01,owner_command=1".
+
+- transaction(op, name):
+Runs a block in a Sentry transaction of its own.
+
+Classes:
+- AdaptiveSampler:
+Samples Sentry transactions and profiles per operation, keeping errors and
+slow transactions and backing off when the transaction rate spikes.
+"""
+
+import contextlib
+import datetime
+import random
+import time
+
+import sentry_sdk
+
+
+def _timestamp(value):
+    """
+    Returns a transaction timestamp as a datetime.
+
+    Events reach `before_send_transaction` already serialized, with their
+    timestamps as ISO 8601 strings such as "2024-01-01T12:00:00.123456Z".
+
+    Returns:
+    - datetime.datetime: The timestamp, or None if it could not be parsed.
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if not isinstance(value, str):
+        return None
+    try:
+        # fromisoformat() only accepts the "Z" suffix from Python 3.11.
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def parse_rates(value):
+    """
+    Parses per-operation sample rates.
+
+    Args:
+    - value (str): Comma-separated `operation=rate` pairs.
+
+    Returns:
+    - dict: The sample rate of each operation.
+
+    Raises:
+    - ValueError: If a rate is not a number.
+    """
+    rates = {}
+    for pair in value.split(","):
+        if "=" in pair:
+            operation, rate = pair.split("=", 1)
+            rates[operation.strip()] = float(rate)
+    return rates
+
+
+@contextlib.contextmanager
+def transaction(op, name):
+    """
+    Runs a block in a Sentry transaction of its own.
+
+    The transaction is bound to a copy of the current hub, which only the
+    running task sees, so concurrent handlers never attach their spans or
+    errors to each other's transactions.
+
+    Args:
+    - op (str): The operation, which selects the sample rate.
+    - name (str): The name of the transaction.
+    """
+    with sentry_sdk.Hub(sentry_sdk.Hub.current) as hub:
+        with hub.start_transaction(op=op, name=name):
+            yield
+
+
+# pylint: disable=too-many-instance-attributes
+class AdaptiveSampler:
+    """
+    Samples Sentry transactions and profiles per operation, keeping errors and
+    slow transactions and backing off when the transaction rate spikes.
+
+    Every transaction is recorded, which only costs a few objects, and the
+    decision to send it is taken once it is finished, in
+    `before_send_transaction`: failed transactions and ones slower than
+    `slow_threshold` are always sent, the others with the rate of their
+    operation. Profiling, which is what costs CPU, is decided up front with
+    the same rates scaled by `profiles_rate`.
+
+    When more than `max_per_second` transactions start per second, a share
+    of them is no longer recorded at all, so the overhead stays bounded
+    however busy the bot gets.
+
+    Attributes:
+    - rates (dict): The sample rate of each operation.
+    - default_rate (float): The sample rate of other operations.
+    - profiles_rate (float): The share of sampled transactions profiled.
+    - slow_threshold (float): The duration in seconds above which a
+      transaction is always sent.
+    - max_per_second (float): The transaction rate above which transactions
+      are downsampled.
+    - factor (float): The share of transactions currently recorded.
+    """
+
+    def __init__(
+        self,
+        rates=None,
+        default_rate=0.1,
+        profiles_rate=0.1,
+        slow_threshold=1.0,
+        max_per_second=50.0,
+        window=10.0,
+    ):  # pylint: disable=too-many-arguments
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.profiles_rate = profiles_rate
+        self.slow_threshold = slow_threshold
+        self.max_per_second = max_per_second
+        self.factor = 1.0
+        self._window = window
+        self._window_start = time.monotonic()
+        self._started = 0
+
+    def rate_for(self, operation):
+        """Returns the sample rate of an operation."""
+        return self.rates.get(operation, self.default_rate)
+
+    def _count_start(self):
+        """Counts a started transaction and updates the downsampling factor."""
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= self._window:
+            per_second = self._started / elapsed
+            self.factor = (
+                min(1.0, self.max_per_second / per_second) if per_second else 1.0
+            )
+            self._window_start = now
+            self._started = 0
+        self._started += 1
+
+    @staticmethod
+    def _operation(sampling_context):
+        """Returns the operation of the transaction being sampled."""
+        return (sampling_context.get("transaction_context") or {}).get("op")
+
+    def traces_sampler(self, sampling_context):
+        """Returns the probability of recording a transaction."""
+        if sampling_context.get("parent_sampled") is not None:
+            return sampling_context["parent_sampled"]
+        self._count_start()
+        return self.factor
+
+    def profiles_sampler(self, sampling_context):
+        """Returns the probability of profiling a recorded transaction."""
+        return self.rate_for(self._operation(sampling_context)) * self.profiles_rate
+
+    def before_send_transaction(self, event, hint):  # pylint: disable=unused-argument
+        """Returns the transaction if it should be sent, None to drop it."""
+        trace = event.get("contexts", {}).get("trace", {})
+        if trace.get("status") not in (None, "ok"):
+            return event
+
+        start = _timestamp(event.get("start_timestamp"))
+        end = _timestamp(event.get("timestamp"))
+        if start is None or end is None:
+            # Unknown duration, keep the head sampling decision.
+            return event
+        if (end - start).total_seconds() >= self.slow_threshold:
+            return event
+
+        if random.random() < self.rate_for(trace.get("op")):
+            return event
+        return None
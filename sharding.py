@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the helpers used to run the bot over several shards.
+
+Functions:
+- shard_for_guild(guild_id, shard_count):
+Returns the shard a guild is handled by.
+
+- shard_options():
+Returns the sharding keyword arguments of the bot, read from the config.
+
+Classes:
+- ShardedLRU:
+A bounded LRU mapping of per-guild entries, with the capacity split by shard.
+
+- ShardStats:
+Samples the latency and event rate of every shard of a bot.
+"""
+
+import time
+from collections import OrderedDict
+
+import config
+
+
+def shard_for_guild(guild_id, shard_count):
+    """
+    Returns the shard a guild is handled by, as computed by Discord.
+
+    Args:
+    - guild_id (int or str): The ID of the guild.
+    - shard_count (int): The total number of shards.
+
+    Returns:
+    - int: The ID of the shard.
+    """
+    return (int(guild_id) >> 22) % max(1, shard_count)
+
+
+def shard_options():
+    """
+    Returns the sharding keyword arguments of the bot, read from the config.
+
+    Returns:
+    - dict: The arguments to pass to the bot class, empty for a single shard.
+
+    Raises:
+    - ValueError: If SHARD_IDS is set without SHARD_COUNT.
+    """
+    if config.SHARD_IDS:
+        if not config.SHARD_COUNT:
+            raise ValueError("SHARD_IDS requires SHARD_COUNT to be set")
+        return {"shard_ids": config.SHARD_IDS, "shard_count": config.SHARD_COUNT}
+    if config.SHARD_COUNT:
+        return {"shard_count": config.SHARD_COUNT}
+    return {}
+
+
+class ShardedLRU:
+    """
+    A bounded LRU mapping of per-guild entries, with the capacity split by shard.
+
+    Every shard gets its own LRU order and an equal share of the capacity, so
+    the busy guilds of one shard cannot evict the entries of the others, and
+    everything a shard holds can be dropped or counted at once. A process
+    running only some of the shards, as the workers of cluster.py do, splits
+    the capacity between the shards it runs, since the others stay empty.
+
+    Attributes:
+    - capacity (int): The maximum number of entries across all shards.
+    - shard_count (int): The total number of shards.
+    - shard_ids (list): The shards of this process, None for all of them.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, capacity, shard_count=1, guild_of=None, on_evict=None, shard_ids=None
+    ):
+        """
+        Args:
+        - capacity (int): The maximum number of entries across all shards.
+        - shard_count (int): The total number of shards.
+        - guild_of (callable): Returns the guild ID of a key; keys are guild
+          IDs themselves by default.
+        - on_evict (callable): Called with the key and value of every entry
+          evicted to make room for another one.
+        - shard_ids (list): The shards of this process, None for all of them.
+        """
+        self.capacity = capacity
+        self.shard_count = max(1, shard_count)
+        self.shard_ids = list(shard_ids) if shard_ids else None
+        self._guild_of = guild_of or (lambda key: key)
+        self._on_evict = on_evict
+        self._shards = [OrderedDict() for _ in range(self.shard_count)]
+
+    @property
+    def shard_capacity(self):
+        """The maximum number of entries of each shard of this process."""
+        owned = len(self.shard_ids) if self.shard_ids else self.shard_count
+        return -(-self.capacity // max(1, owned))
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._shards)
+
+    def __contains__(self, key):
+        return key in self._shard(key)
+
+    def _shard(self, key):
+        """Returns the entries of the shard a key belongs to."""
+        if self.shard_count == 1:
+            return self._shards[0]
+        return self._shards[shard_for_guild(self._guild_of(key), self.shard_count)]
+
+    def get(self, key, default=None):
+        """Returns the value of a key, without changing its LRU position."""
+        return self._shard(key).get(key, default)
+
+    def touch(self, key):
+        """Returns the value of a key and marks it as most recently used."""
+        entries = self._shard(key)
+        value = entries.get(key)
+        if value is not None:
+            entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        entries = self._shard(key)
+        entries[key] = value
+        entries.move_to_end(key)
+        limit = self.shard_capacity
+        while len(entries) > limit:
+            old_key, old_value = entries.popitem(last=False)
+            if self._on_evict is not None:
+                self._on_evict(old_key, old_value)
+
+    def pop(self, key, default=None):
+        """Removes a key and returns its value."""
+        return self._shard(key).pop(key, default)
+
+    def clear(self):
+        """Removes every entry."""
+        for entries in self._shards:
+            entries.clear()
+
+    def shard_sizes(self):
+        """Returns the number of entries held for each shard."""
+        return [len(entries) for entries in self._shards]
+
+    def repartition(self, shard_count, shard_ids=None):
+        """
+        Splits the entries between a new number of shards.
+
+        Entries keep their relative LRU order; a shard over its new share of
+        the capacity evicts its least recently used entries.
+
+        Args:
+        - shard_count (int): The total number of shards.
+        - shard_ids (list): The shards of this process, None for all of them.
+        """
+        shard_count = max(1, shard_count)
+        shard_ids = list(shard_ids) if shard_ids else None
+        if shard_count == self.shard_count and shard_ids == self.shard_ids:
+            return
+        shards, self._shards = self._shards, [OrderedDict() for _ in range(shard_count)]
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        for entries in shards:
+            for key, value in entries.items():
+                self[key] = value
+
+
+class ShardStats:  # pylint: disable=too-few-public-methods
+    """
+    Samples the latency and event rate of every shard of a bot.
+
+    The event rate is derived from the sequence number of each gateway
+    connection, which Discord increments on every event it dispatches, so
+    measuring it costs nothing per event.
+    """
+
+    def __init__(self):
+        self._last = {}
+
+    @staticmethod
+    def _connections(bot):
+        """Yields (shard_id, latency, websocket) for every shard of a bot."""
+        shards = getattr(bot, "shards", None)
+        if shards is not None:
+            for shard_id, shard in shards.items():
+                # pylint: disable=protected-access
+                yield shard_id, shard.latency, shard._parent.ws
+        else:
+            yield bot.shard_id or 0, bot.latency, bot.ws
+
+    def sample(self, bot):
+        """
+        Samples the state of every shard of a bot.
+
+        The event rate is averaged over the time elapsed since the previous
+        call, so the first call always reports a rate of zero.
+
+        Args:
+        - bot (disnake.Client): The bot to sample.
+
+        Returns:
+        - list: A dictionary per shard with its "shard_id", "latency" in
+          seconds, "events_per_second" and number of "guilds".
+        """
+        now = time.monotonic()
+        guilds = {}
+        for guild in bot.guilds:
+            guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+
+        samples = []
+        for shard_id, latency, websocket in self._connections(bot):
+            sequence = (websocket.sequence or 0) if websocket is not None else 0
+            previous = self._last.get(shard_id)
+            rate = 0.0
+            if previous is not None and now > previous[1]:
+                # The sequence restarts from zero on a new gateway session.
+                events = sequence - previous[0] if sequence >= previous[0] else sequence
+                rate = events / (now - previous[1])
+            self._last[shard_id] = (sequence, now)
+            samples.append(
+                {
+                    "shard_id": shard_id,
+                    "latency": latency,
+                    "events_per_second": rate,
+                    "guilds": guilds.get(shard_id, 0),
+                }
+            )
+        return samples
+
+
+# Shared by every report of shard health.
+shard_stats = ShardStats()
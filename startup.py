@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the pieces of the startup pipeline of the bot.
+
+Functions:
+- command_payload_hash(commands):
+Returns a digest of the application commands as they are sent to Discord.
+
+- sync_commands(bot):
+Registers the application commands with Discord, if they changed since the
+last time they were.
+
+Classes:
+- StartupTimings:
+Records how long each phase of the startup took.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import time
+
+from db.sqlite_handler import get_state, set_state
+from metrics import Gauge
+
+
+def _process_age():
+    """Returns the seconds since this process started, or None without /proc."""
+    try:
+        with open("/proc/self/stat", encoding="ascii") as stat:
+            # Fields after the command name, which may contain spaces.
+            fields = stat.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", encoding="ascii") as uptime:
+            seconds = float(uptime.read().split()[0])
+        return seconds - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimings:
+    """
+    Records how long each phase of the startup took.
+
+    The time spent starting the interpreter and importing the bot, before
+    this module was imported, is recorded as the "imports" phase where /proc
+    tells when the process started.
+
+    Attributes:
+    - phases (dict): The duration in seconds of each finished phase, in the
+      order they finished.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self._begun = {}
+        imports = _process_age()
+        if imports is not None:
+            self.phases["imports"] = imports
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Records the duration of a block as the phase `name`."""
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def begin(self, name):
+        """Starts the phase `name`, for phases ending in another function."""
+        self._begun[name] = time.perf_counter()
+
+    def end(self, name):
+        """
+        Ends the phase `name`.
+
+        Returns:
+        - bool: True if the phase was running, False if it already ended.
+        """
+        begun = self._begun.pop(name, None)
+        if begun is None:
+            return False
+        self.phases[name] = time.perf_counter() - begun
+        return True
+
+    def summary(self):
+        """Returns the duration of every phase, on a single line."""
+        return ", ".join(
+            f"{name} {seconds:.2f}s" for name, seconds in self.phases.items()
+        )
+
+
+# Shared by bot.py and sync_commands().
+startup_timings = StartupTimings()
+Gauge(
+    "tagsy_startup_phase_seconds",
+    "Duration of each phase of the startup.",
+    lambda: [
+        ({"phase": name}, seconds) for name, seconds in startup_timings.phases.items()
+    ],
+    labels=("phase",),
+)
+
+
+def command_payload_hash(commands):
+    """
+    Returns a digest of the application commands as they are sent to Discord.
+
+    Args:
+    - commands (list): The `disnake.ApplicationCommand` bodies, localized.
+
+    Returns:
+    - str: The hexadecimal SHA-256 digest of their JSON payload, which does
+      not depend on the order of the commands.
+    """
+    payload = sorted(
+        (command.to_dict() for command in commands),
+        key=lambda data: (data.get("type", 1), data["name"]),
+    )
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+async def sync_commands(bot):
+    """
+    Registers the application commands with Discord, if they changed since the
+    last time they were.
+
+    The digest of the last registered payload is kept in the database, so a
+    restart with the same commands makes no API call at all, and the
+    commands are overwritten in one request when they changed. Waits for the
+    first gateway connection, which tells the application ID.
+
+    Args:
+    - bot (disnake.ext.commands.InteractionBot): The bot to register the
+      commands of.
+
+    Returns:
+    - bool: True if the commands were registered, False if they were unchanged.
+
+    Raises:
+    - disnake.HTTPException: If registering the commands failed; the digest
+      is then left as it was, so the next start tries again.
+    """
+    await bot.wait_until_first_connect()
+    with startup_timings.phase("command sync"):
+        commands = [command.body for command in bot.application_commands_iterator()]
+        for command in commands:
+            command.localize(bot.i18n)
+        digest = command_payload_hash(commands)
+        key = f"command_payload_hash:{bot.application_id}"
+        if await get_state(key) == digest:
+            return False
+        await bot.bulk_overwrite_global_commands(commands)
+        await set_state(key, digest)
+        return True
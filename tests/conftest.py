@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Shared setup of the tests, run from the repository root with `python -m pytest`."""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules of the bot are imported from the repository root, and the
+# database handler needs a path even when a test does not open it.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "tagsy.db"))
+
+
+@pytest.fixture
+def run_with_db():
+    """Returns a function running a coroutine function with the database open."""
+    # pylint: disable=import-outside-toplevel
+    from db import sqlite_handler
+
+    def run(scenario):
+        async def main():
+            await sqlite_handler.db_setup()
+            try:
+                return await scenario()
+            finally:
+                await sqlite_handler.db_teardown()
+
+        return asyncio.run(main())
+
+    return run
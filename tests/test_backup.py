@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Tests of the staging of uploaded databases of db/backup.py."""
+
+import asyncio
+import gzip
+import os
+
+import pytest
+from aiohttp import web
+
+from benchmarks.bench_storage import generate
+from db.backup import stage_database
+
+
+async def _stage(body, compressed):
+    """Serves `body` over HTTP and stages it as an uploaded database."""
+
+    async def upload(request):  # pylint: disable=unused-argument
+        return web.Response(body=body)
+
+    app = web.Application()
+    app.router.add_get("/upload", upload)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        port = runner.addresses[0][1]
+        return await stage_database(f"http://127.0.0.1:{port}/upload", compressed)
+    finally:
+        await runner.cleanup()
+
+
+def _staging_files(path):
+    """Returns the staging files left next to a database."""
+    directory = os.path.dirname(path)
+    return [name for name in os.listdir(directory) if name.endswith(".import")]
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_stage_database(tmp_path, compressed):
+    """An uploaded database is staged byte for byte, compressed or not."""
+    source = str(tmp_path / "upload.db")
+    generate(source, 5, 200, 42)
+    with open(source, "rb") as file:
+        data = file.read()
+
+    path = asyncio.run(_stage(gzip.compress(data) if compressed else data, compressed))
+    try:
+        with open(path, "rb") as file:
+            assert file.read() == data
+        assert _staging_files(path) == [os.path.basename(path)]
+    finally:
+        os.remove(path)
+
+
+def test_stage_invalid_database(tmp_path):
+    """A file that is not a Tagsy database is rejected and removed."""
+    source = str(tmp_path / "upload.db")
+    generate(source, 5, 200, 42)
+    with open(source, "rb") as file:
+        data = file.read().replace(b"created_by", b"created_xx")
+
+    with pytest.raises(ValueError):
+        asyncio.run(_stage(gzip.compress(data), True))
+    assert not _staging_files(os.environ["DB_PATH"])
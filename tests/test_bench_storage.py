@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Tests of the offline storage benchmark of benchmarks/bench_storage.py."""
+
+import argparse
+import asyncio
+import os
+
+from benchmarks.bench_storage import generate, run
+from db import sqlite_handler
+
+
+def test_small_layout_runs_without_errors():
+    """Warming up destructive workloads leaves enough guilds for the timed calls."""
+    path = sqlite_handler.DB_PATH
+    if os.path.exists(path):
+        os.remove(path)
+    layout = generate(path, 50, 2000, 42)
+    options = argparse.Namespace(
+        operations=200, warmup=100, concurrency=4, only=None, seed=42, db=path
+    )
+    results = asyncio.run(run(options, layout))
+    errors = {
+        name: result["errors"] for name, result in results.items() if "errors" in result
+    }
+    assert errors and not any(errors.values()), errors
+    assert results["purge_tags"]["operations"] == 2
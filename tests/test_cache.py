@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Tests of the in-process caches of db/cache.py."""
+
+from db.cache import TagCache
+
+
+def _details(content, usage_count=1):
+    """Returns the details of a tag as read from the database."""
+    return {"tag": "rules", "content": content, "usage_count": usage_count}
+
+
+def test_writes_with_int_ids_reach_str_entries():
+    """Writes given an int server ID update and drop the entries of its str form."""
+    cache = TagCache(16)
+    cache.put("111", "rules", _details("old"), cache.token())
+
+    cache.update(111, "rules", content="new")
+    cache.add_usage(111, "rules", 2)
+    assert cache.get("111", "rules") == _details("new", 3)
+
+    cache.invalidate(111, "rules")
+    assert cache.get("111", "rules") is None
+
+    cache.put("111", "rules", _details("old"), cache.token())
+    cache.invalidate_guild(111)
+    assert cache.get("111", "rules") is None and len(cache) == 0
+
+
+def test_reads_overlapping_a_write_are_not_cached():
+    """A row read before or during a write is refused by put()."""
+    cache = TagCache(16)
+    token = cache.token()
+    cache.invalidate("111", "rules")
+    cache.put("111", "rules", _details("stale"), token)
+    assert cache.get("111", "rules") is None
+
+    with cache.writing():
+        cache.put("111", "rules", _details("stale"), cache.token())
+    assert cache.get("111", "rules") is None
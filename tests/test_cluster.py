@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Tests of the cluster launcher of cluster.py."""
+
+import asyncio
+import json
+import types
+
+from cluster import Supervisor
+
+
+class _Stdin:  # pylint: disable=too-few-public-methods
+    """Records what the supervisor writes to a worker."""
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        """Records a write."""
+        self.lines.append(data)
+
+
+def test_forget_guild_reaches_only_the_owning_worker():
+    """A forget_guild message is forwarded to the owner of the shard, not restarted."""
+
+    async def scenario():
+        supervisor = Supervisor(4, 2)
+        for worker in supervisor.workers:
+            worker.process = types.SimpleNamespace(returncode=None, stdin=_Stdin())
+        sender, owner = supervisor.workers
+        line = (
+            json.dumps({"type": "forget_guild", "server_id": "111", "shards": [3]})
+            + "\n"
+        ).encode("utf-8")
+
+        supervisor._handle(sender, line)  # pylint: disable=protected-access
+        assert owner.process.stdin.lines == [line]
+        assert not sender.process.stdin.lines
+
+    asyncio.run(scenario())
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Tests of the connection pool of db/connection.py."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from db.connection import ConnectionPool
+
+
+async def _count(pool):
+    """Returns the number of rows of the test table, read from a reader."""
+    async with pool.reader() as db:
+        (count,) = (await db.execute_fetchall("SELECT COUNT(*) FROM items"))[0]
+    return count
+
+
+def _with_pool(tmp_path, scenario):
+    """Runs a coroutine function with an open pool on a fresh database."""
+
+    async def main():
+        pool = ConnectionPool(str(tmp_path / "pool.db"), 2)
+        async with pool.writer() as db:
+            await db.execute("CREATE TABLE items (id INTEGER PRIMARY KEY)")
+        try:
+            await scenario(pool)
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
+
+
+def test_readers_cannot_write(tmp_path):
+    """Writes through a read connection are refused."""
+
+    async def scenario(pool):
+        async with pool.reader() as db:
+            with pytest.raises(sqlite3.OperationalError):
+                await db.execute("INSERT INTO items DEFAULT VALUES")
+        assert await _count(pool) == 0
+
+    _with_pool(tmp_path, scenario)
+
+
+def test_readers_only_see_committed_writes(tmp_path):
+    """Readers are not blocked by a transaction and never see it half done."""
+
+    async def scenario(pool):
+        async with pool.writer() as db:
+            await db.execute("INSERT INTO items DEFAULT VALUES")
+            assert await asyncio.wait_for(_count(pool), 1) == 0
+        assert await _count(pool) == 1
+
+        with pytest.raises(RuntimeError):
+            async with pool.writer() as db:
+                await db.execute("INSERT INTO items DEFAULT VALUES")
+                raise RuntimeError
+        assert await _count(pool) == 1
+
+    _with_pool(tmp_path, scenario)
+
+
+def test_writers_take_turns(tmp_path):
+    """Concurrent transactions run one after the other on the writer."""
+
+    async def scenario(pool):
+        running = []
+
+        async def write():
+            async with pool.writer() as db:
+                running.append(1)
+                assert len(running) == 1
+                await db.execute("INSERT INTO items DEFAULT VALUES")
+                await asyncio.sleep(0.01)
+                running.pop()
+
+        await asyncio.gather(*(write() for _ in range(5)))
+        assert await _count(pool) == 5
+
+    _with_pool(tmp_path, scenario)
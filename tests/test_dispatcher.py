@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Tests of the per-channel send queues of dispatcher.py."""
+
+import asyncio
+
+from dispatcher import Notice, SendDispatcher
+from helper import MAX_MESSAGE_LENGTH
+
+
+class _Channel:  # pylint: disable=too-few-public-methods
+    """A channel recording what it sends, failing the first `failures` sends."""
+
+    id = 1
+    guild = None
+
+    def __init__(self, failures=0):
+        self.sent = []
+        self.calls = 0
+        self._failures = failures
+
+    async def send(self, content):
+        """Records a message, or fails."""
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.calls <= self._failures:
+            raise RuntimeError("unexpected failure")
+        if not content or len(content) > MAX_MESSAGE_LENGTH:
+            raise ValueError(f"invalid message of {len(content)} characters")
+        self.sent.append(content)
+        return content
+
+
+def test_folded_notice_longer_than_a_message_is_truncated():
+    """A folded notice too long for a message is cut with a "+N more" tail."""
+
+    async def scenario():
+        dispatcher = SendDispatcher(pressure_depth=1, max_missing=200)
+        channel = _Channel()
+        dispatcher.enqueue(channel, ["first"])
+        for index in range(200):
+            tag = f"missing-tag-{index:04d}-xxxxx"
+            dispatcher.enqueue(channel, [Notice(f'No message found for "{tag}".', tag)])
+        await asyncio.wait_for(dispatcher.close(), 1)
+        return channel
+
+    channel = asyncio.run(scenario())
+    assert len(channel.sent) == channel.calls == 1
+    assert channel.sent[0].startswith("first\n\nNo message found for tags: ")
+    assert channel.sent[0].endswith("more).")
+
+
+def test_unexpected_error_does_not_drop_the_queue():
+    """A send failing with any exception is reported and the next one is sent."""
+
+    async def scenario():
+        dispatcher = SendDispatcher()
+        channel = _Channel(failures=1)
+        failed = dispatcher.enqueue(channel, ["first"])
+        await asyncio.sleep(0)
+        sent = dispatcher.enqueue(channel, ["second"])
+        await asyncio.wait_for(dispatcher.close(), 1)
+        return channel, failed.result(), sent.result()
+
+    channel, failed, sent = asyncio.run(scenario())
+    assert channel.sent == ["second"]
+    assert failed is None
+    assert sent == "second"
+
+
+def test_merged_replies_resolve_every_sender():
+    """Replies merged into one message all resolve with that message."""
+
+    async def scenario():
+        dispatcher = SendDispatcher()
+        channel = _Channel()
+        dispatcher.enqueue(channel, ["first"])
+        await asyncio.sleep(0)
+        futures = [dispatcher.enqueue(channel, [text]) for text in ("a", "b", "a")]
+        await asyncio.wait_for(dispatcher.close(), 1)
+        return channel, [future.result() for future in futures]
+
+    channel, results = asyncio.run(scenario())
+    assert channel.sent == ["first", "a\n\nb"]
+    assert results == ["a\n\nb"] * 3
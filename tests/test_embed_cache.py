@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Tests of the cache of rendered tag embeds of db/embed_cache.py."""
+
+from db import sqlite_handler
+from db.embed_cache import EmbedCache
+from helper import build_embed
+
+
+def _content(embed):
+    """Returns the content field of a tag embed."""
+    return embed.fields[0].value
+
+
+def test_payloads_are_only_served_for_their_fingerprint():
+    """A payload rendered from another content or author is never returned."""
+    cache = EmbedCache(4)
+    cache.put(701, "tag", ("old", "2024-01-01 00:00:00", "author"), {"title": "old"})
+
+    assert cache.get("701", "tag", ("old", "2024-01-01 00:00:00", "author")) == {
+        "title": "old"
+    }
+    assert cache.get("701", "tag", ("new", "2024-01-01 00:00:00", "author")) is None
+    assert cache.get("701", "tag", ("old", "2024-01-01 00:00:00", "renamed")) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_edited_tags_are_rendered_again(run_with_db):
+    """An edit reaches the embed, whether or not the payload was invalidated."""
+
+    async def scenario():
+        await sqlite_handler.add_message("702", "edited", "before", "1")
+        row = await sqlite_handler.get_message("702", "edited")
+        assert _content(build_embed(row, "author", "702")) == "before"
+        assert _content(build_embed(row, "author", "702")) == "before"
+
+        # A row read after an edit never gets the payload of the old content.
+        stale = dict(row, content="after")
+        assert _content(build_embed(stale, "author", "702")) == "after"
+
+        await sqlite_handler.update_message("702", "edited", "after")
+        assert (
+            sqlite_handler.embed_cache.get(
+                "702", "edited", (stale["content"], stale["created_at"], "author")
+            )
+            is None
+        )
+        row = await sqlite_handler.get_message("702", "edited")
+        embed = build_embed(row, "author", "702")
+        assert _content(embed) == "after"
+        assert embed.fields[-1].value == str(row["usage_count"])
+
+    run_with_db(scenario)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Tests of the schema migrations of db/migrations.py."""
+
+import asyncio
+import sqlite3
+
+from benchmarks.bench_storage import generate
+from db import migrations
+from db.connection import ConnectionPool
+from db.contents import decode
+
+
+def _contents(path):
+    """Returns the content of every tag, keyed by (server_id, tag)."""
+    db = sqlite3.connect(path)
+    try:
+        if "content" in [row[1] for row in db.execute("PRAGMA table_info(messages)")]:
+            rows = db.execute("SELECT server_id, tag, content FROM messages")
+            return {(server_id, tag): content for server_id, tag, content in rows}
+        rows = db.execute(
+            "SELECT server_id, tag, body, compressed FROM messages"
+            " JOIN contents ON contents.id = messages.content_id"
+        )
+        return {
+            (server_id, tag): decode(body, compressed)
+            for server_id, tag, body, compressed in rows
+        }
+    finally:
+        db.close()
+
+
+def _check_contents(path, expected):
+    """Checks the migrated contents and their reference counts."""
+    assert _contents(path) == expected
+    db = sqlite3.connect(path)
+    try:
+        (version,) = db.execute("PRAGMA user_version").fetchone()
+        assert version == len(migrations.MIGRATIONS)
+        (stored,) = db.execute("SELECT COUNT(*) FROM contents").fetchone()
+        assert stored == len(set(expected.values()))
+        wrong = db.execute(
+            "SELECT id FROM contents WHERE refcount !="
+            " (SELECT COUNT(*) FROM messages WHERE content_id = contents.id)"
+        ).fetchall()
+        assert not wrong
+    finally:
+        db.close()
+
+
+async def _migrate(path):
+    """Migrates a database through a pool of its own, as another process would."""
+    pool = ConnectionPool(path, 1)
+    await pool.open()
+    try:
+        return await migrations.migrate(pool)
+    finally:
+        await pool.close()
+
+
+def test_backfill_resumes(tmp_path, monkeypatch):
+    """A backfill interrupted between chunks is finished by the next migration."""
+    monkeypatch.setattr(migrations, "BACKFILL_CHUNK_SIZE", 100)
+    path = str(tmp_path / "tagsy.db")
+    generate(path, 20, 1000, 42)
+    expected = _contents(path)
+
+    async def interrupted():
+        pool = ConnectionPool(path, 1)
+        await pool.open()
+        try:
+            # Up to the contents migration, then its setup and two chunks.
+            steps = 3
+            while steps:
+                async with pool.writer() as db:
+                    await db.execute("BEGIN IMMEDIATE")
+                    version = await migrations.schema_version(db)
+                    if version == len(migrations.MIGRATIONS) - 1:
+                        steps -= 1
+                    if await migrations.MIGRATIONS[version](db) is not False:
+                        await db.execute(f"PRAGMA user_version = {version + 1}")
+        finally:
+            await pool.close()
+
+    asyncio.run(interrupted())
+    db = sqlite3.connect(path)
+    try:
+        (left,) = db.execute(
+            "SELECT COUNT(*) FROM messages WHERE content_id IS NULL"
+        ).fetchone()
+    finally:
+        db.close()
+    assert left == 800
+
+    assert asyncio.run(_migrate(path)) == len(migrations.MIGRATIONS)
+    _check_contents(path, expected)
+
+
+def test_concurrent_migrations(tmp_path, monkeypatch):
+    """Processes migrating the same database share the backfill without failing."""
+    monkeypatch.setattr(migrations, "BACKFILL_CHUNK_SIZE", 100)
+    path = str(tmp_path / "tagsy.db")
+    generate(path, 20, 1000, 42)
+    expected = _contents(path)
+
+    async def both():
+        return await asyncio.gather(_migrate(path), _migrate(path))
+
+    assert asyncio.run(both()) == [len(migrations.MIGRATIONS)] * 2
+    _check_contents(path, expected)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Tests of the per-server prefix indexes of db/prefix_index.py."""
+
+from db.prefix_index import PrefixIndex
+
+
+def test_writes_with_int_ids_reach_str_indexes():
+    """Tags written with an int server ID reach the index loaded with its str form."""
+    prefixes = PrefixIndex(4)
+    prefixes.put("111", ["Rules", "roles"], prefixes.token())
+
+    prefixes.add(111, "reminder")
+    prefixes.remove(111, "roles")
+    index = prefixes.get(111)
+    assert index is prefixes.get("111")
+    assert prefixes.complete(index, "R") == ["reminder", "Rules"]
+
+    prefixes.drop(111)
+    assert prefixes.get("111") is None
+
+
+def test_index_read_before_a_write_is_not_kept():
+    """An index built from a read that overlapped a write is dropped."""
+    prefixes = PrefixIndex(4)
+    token = prefixes.token()
+    prefixes.add("111", "rules")
+    prefixes.put("111", [], token)
+    assert prefixes.get("111") is None
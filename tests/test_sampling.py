@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Tests of the Sentry sampling policy of sampling.py."""
+
+from sampling import AdaptiveSampler
+
+
+def _serialized_transaction(op, seconds):
+    """Returns a transaction event as sentry-sdk hands it to the hook."""
+    return {
+        "type": "transaction",
+        "contexts": {"trace": {"op": op, "status": "ok"}},
+        "start_timestamp": "2024-05-01T12:00:00.000000Z",
+        "timestamp": f"2024-05-01T12:00:{seconds:09.6f}Z",
+    }
+
+
+def test_serialized_transaction_dropped_at_rate_zero():
+    """A fast transaction of an operation sampled at 0 is never sent."""
+    sampler = AdaptiveSampler(rates={"on_message": 0.0}, slow_threshold=1.0)
+    event = _serialized_transaction("on_message", 0.05)
+    assert sampler.before_send_transaction(event, {}) is None
+
+
+def test_serialized_slow_transaction_kept():
+    """A transaction slower than the threshold is sent whatever its rate."""
+    sampler = AdaptiveSampler(rates={"on_message": 0.0}, slow_threshold=1.0)
+    event = _serialized_transaction("on_message", 2.5)
+    assert sampler.before_send_transaction(event, {}) is event
+
+
+def test_unparsable_timestamps_kept():
+    """A transaction of unknown duration keeps the head sampling decision."""
+    sampler = AdaptiveSampler(rates={"on_message": 0.0})
+    event = _serialized_transaction("on_message", 0.05)
+    event["timestamp"] = "not a timestamp"
+    assert sampler.before_send_transaction(event, {}) is event
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Tests of the per-shard capacity of the in-memory structures of sharding.py."""
+
+from db.cache import TagCache
+from sharding import ShardedLRU, shard_for_guild
+
+
+def _guilds_of(shard_ids, shard_count, count):
+    """Returns `count` guild IDs spread over the given shards."""
+    guilds = []
+    number = 0
+    while len(guilds) < count:
+        guild_id = number << 22
+        if shard_for_guild(guild_id, shard_count) in shard_ids:
+            guilds.append(guild_id)
+        number += 1
+    return guilds
+
+
+def test_subset_of_shards_gets_the_whole_capacity():
+    """A process running 4 of 16 shards can hold the configured capacity."""
+    entries = ShardedLRU(4096, 16, shard_ids=[4, 5, 6, 7])
+    for guild_id in _guilds_of({4, 5, 6, 7}, 16, 5000):
+        entries[guild_id] = True
+    assert len(entries) == 4096
+    assert sum(entries.shard_sizes()[4:8]) == 4096
+
+
+def test_tag_cache_repartitioned_to_a_subset():
+    """Repartitioning to a subset of shards raises the share of each of them."""
+    cache = TagCache(4096, 16)
+    cache.repartition(16, [0, 1, 2, 3])
+    for guild_id in _guilds_of({0, 1, 2, 3}, 16, 256):
+        for tag in range(20):
+            cache.put(str(guild_id), f"tag{tag}", {"usage_count": 1}, cache.token())
+    assert len(cache) == 4096
+
+
+def test_all_shards_by_default():
+    """Without shard IDs the capacity is split between every shard."""
+    entries = ShardedLRU(4096, 16)
+    assert entries.shard_capacity == 256
+    entries.repartition(16, [3])
+    assert entries.shard_capacity == 4096
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Tests of the database handler of db/sqlite_handler.py."""
+
+import asyncio
+
+from db import sqlite_handler
+
+
+def test_int_and_str_server_ids_are_the_same_server(run_with_db):
+    """A tag added with an int server ID is found with its str form, and back."""
+
+    async def scenario():
+        await sqlite_handler.add_message(501, "int-added", "hello", "1")
+        assert (await sqlite_handler.get_message("501", "int-added"))[
+            "content"
+        ] == "hello"
+        assert list(await sqlite_handler.get_messages("501", ["int-added"])) == [
+            "int-added"
+        ]
+
+        await sqlite_handler.add_message("502", "str-added", "hello", "1")
+        assert await sqlite_handler.get_message(502, "str-added") is not None
+        assert list(await sqlite_handler.get_messages(502, ["str-added"])) == [
+            "str-added"
+        ]
+
+    run_with_db(scenario)
+
+
+def test_forget_guild_drops_state_changed_elsewhere(run_with_db):
+    """Tags deleted by another process are no longer served once forgotten."""
+
+    async def scenario():
+        await sqlite_handler.add_message("503", "elsewhere", "hello", "1")
+        assert await sqlite_handler.get_message("503", "elsewhere") is not None
+        assert await sqlite_handler.get_similar_tags("503", "elsewher")
+
+        async with sqlite_handler.pool.writer() as db:
+            await db.execute("DELETE FROM messages WHERE server_id = '503'")
+        assert await sqlite_handler.get_message("503", "elsewhere") is not None
+
+        sqlite_handler.forget_guild(503)
+        assert await sqlite_handler.get_message("503", "elsewhere") is None
+        assert not await sqlite_handler.get_similar_tags("503", "elsewher")
+        await asyncio.sleep(0.1)
+        assert not sqlite_handler.tag_filter.might_contain("503", "elsewhere")
+
+    run_with_db(scenario)
+
+
+def test_suggestions_skip_servers_without_tags(run_with_db):
+    """Misses in a server without tags never build its suggestion index."""
+
+    async def scenario():
+        assert await sqlite_handler.get_similar_tags("504", "nothing") == []
+        assert sqlite_handler.suggestion_index.get("504") is None
+
+    run_with_db(scenario)
+
+
+def test_updating_a_missing_tag_stores_no_content(run_with_db):
+    """An update of a tag that does not exist leaves no orphan content behind."""
+
+    async def scenario():
+        await sqlite_handler.add_message("505", "shared", "kept", "1")
+        await sqlite_handler.update_message("505", "missing", "orphan")
+        await sqlite_handler.update_message("505", "missing", "kept")
+
+        async with sqlite_handler.pool.reader() as db:
+            rows = await db.execute_fetchall(
+                "SELECT refcount FROM contents WHERE refcount <= 0"
+            )
+        assert not rows
+        assert (await sqlite_handler.get_message("505", "shared"))["content"] == "kept"
+        assert await sqlite_handler.get_message("505", "missing") is None
+
+    run_with_db(scenario)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Tests of the startup pipeline of startup.py."""
+
+from types import SimpleNamespace
+
+import disnake
+
+from startup import command_payload_hash, sync_commands
+
+
+class _Bot:
+    """A bot that counts the times its commands are registered."""
+
+    def __init__(self, *descriptions):
+        self.application_id = 801
+        self.i18n = disnake.LocalizationStore(strict=False)
+        self.descriptions = descriptions
+        self.syncs = 0
+
+    async def wait_until_first_connect(self):
+        """Returns at once, as if the gateway were connected."""
+
+    def application_commands_iterator(self):
+        """Yields the commands, with bodies built anew as disnake does."""
+        for i, description in enumerate(self.descriptions):
+            body = disnake.SlashCommand(name=f"command-{i}", description=description)
+            yield SimpleNamespace(body=body)
+
+    async def bulk_overwrite_global_commands(self, commands):
+        """Counts the registration."""
+        assert len(commands) == len(self.descriptions)
+        self.syncs += 1
+
+
+def test_command_payload_hash_ignores_order():
+    """The digest depends on the commands, not on the order they are listed in."""
+    first = disnake.SlashCommand(name="first", description="First")
+    second = disnake.SlashCommand(name="second", description="Second")
+    assert command_payload_hash([first, second]) == command_payload_hash(
+        [second, first]
+    )
+    assert command_payload_hash([first]) != command_payload_hash([second])
+
+
+def test_unchanged_commands_are_not_synced(run_with_db):
+    """Commands are only registered again when their payload changed."""
+
+    async def scenario():
+        bot = _Bot("Shows a tag", "Adds a tag")
+        assert await sync_commands(bot)
+        assert not await sync_commands(bot)
+        assert bot.syncs == 1
+
+        bot.descriptions = ("Shows a tag", "Adds a new tag")
+        assert await sync_commands(bot)
+        assert not await sync_commands(bot)
+        assert bot.syncs == 2
+
+    run_with_db(scenario)
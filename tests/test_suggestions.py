@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Tests of the tag suggestion engine of db/suggestions.py."""
+
+from db.suggestions import GuildSuggestions, SuggestionIndex, substring_distance
+
+
+def test_writes_with_int_ids_reach_str_indexes():
+    """Tags and uses recorded with an int server ID reach the str-keyed index."""
+    suggestions = SuggestionIndex(4)
+    index = suggestions.put("111", [("rules", 1)], suggestions.token())
+
+    suggestions.add(111, "rulez", 1)
+    suggestions.add_usage(111, "rulez", 5)
+    assert suggestions.suggest(index, "rule") == ["rulez", "rules"]
+
+    suggestions.remove(111, "rulez")
+    assert suggestions.suggest(index, "rule") == ["rules"]
+
+
+def test_substring_distance():
+    """The distance is to the closest substring, capped at max_distance + 1."""
+    assert substring_distance("rules", "server-rules", 1) == 0
+    assert substring_distance("rulez", "server-rules", 1) == 1
+    assert substring_distance("rles", "rules-v2", 1) == 1
+    assert substring_distance("rules", "faq", 2) == 3
+    assert substring_distance("rules", "", 9) == 5
+
+
+def test_suggestions_rank_by_distance_then_usage():
+    """Closer tags come first, then the most used, then by name."""
+    index = GuildSuggestions(
+        [
+            ("welcome", 1),
+            ("welcome-old", 50),
+            ("welcome-new", 50),
+            ("welcom", 100),
+            ("unrelated", 1000),
+        ]
+    )
+    assert index.suggest("Welcome") == [
+        "welcome-new",
+        "welcome-old",
+        "welcome",
+        "welcom",
+    ]
+    assert index.suggest("welcome", limit=2) == ["welcome-new", "welcome-old"]
+    assert index.suggest("zzzzzz") == []
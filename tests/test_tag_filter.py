@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Tests of the per-server filters of tag names of db/tag_filter.py."""
+
+from db.tag_filter import TagFilter
+from sharding import shard_for_guild
+
+
+def test_servers_of_other_shards_are_not_filtered():
+    """Only the servers on the shards of the process are filtered."""
+    servers = [str((index << 22) + 1) for index in range(8)]
+    tag_filter = TagFilter(shard_count=4, shard_ids=[1, 2])
+    tag_filter.start_loading()
+    tag_filter.install(
+        {server: {"known"} for server in servers if tag_filter.covers(server)}
+    )
+    tag_filter.add(servers[0], "added")
+
+    for server in servers:
+        covered = shard_for_guild(server, 4) in (1, 2)
+        assert tag_filter.covers(server) == covered
+        assert tag_filter.might_contain(server, "known")
+        assert tag_filter.might_contain(server, "unknown") != covered
+    assert servers[0] not in tag_filter._guilds  # pylint: disable=protected-access
+
+
+def test_servers_without_tags():
+    """Only loaded, covered servers without any tag are known to have none."""
+    tag_filter = TagFilter()
+    assert tag_filter.has_tags("111")
+    tag_filter.start_loading()
+    tag_filter.install({"222": {"rules"}})
+    assert not tag_filter.has_tags(111)
+    assert tag_filter.has_tags(222)
+
+    tag_filter.add("111", "rules")
+    tag_filter.remove("222", "rules")
+    assert tag_filter.has_tags("111")
+    assert not tag_filter.has_tags("222")
+
+    tag_filter.invalidate("222")
+    assert tag_filter.has_tags("222")
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Tests of the keyset paging of views/tag_pages.py."""
+
+from types import SimpleNamespace
+
+from db import sqlite_handler
+from views.tag_pages import MAX_EMBEDS_LENGTH, TagPagesView
+
+
+class _Interaction:  # pylint: disable=too-few-public-methods
+    """An interaction that records the messages it is edited into."""
+
+    def __init__(self):
+        self.response = self
+        self.edits = []
+
+    async def edit_message(self, **kwargs):
+        """Records the edited message."""
+        self.edits.append(kwargs)
+
+
+def _guild(guild_id):
+    """Returns a guild whose members are all in the gateway cache."""
+    return SimpleNamespace(
+        id=guild_id, get_member=lambda _: SimpleNamespace(display_name="member")
+    )
+
+
+async def _walk(view, moves):
+    """Shows the first page, then follows the moves, returning the tags shown."""
+    interaction = _Interaction()
+    pages = [[embed.title[len("Tag: ") :] for embed in await view.load_page()]]
+    for move in moves:
+        button = view.next_page if move == "next" else view.previous_page
+        await button.callback(interaction)
+        pages.append(
+            [embed.title[len("Tag: ") :] for embed in interaction.edits[-1]["embeds"]]
+        )
+    return pages, interaction.edits
+
+
+def test_pages_stop_at_the_last_tag(run_with_db):
+    """Pages follow the tag order, and Next is disabled on the last page only."""
+
+    async def scenario():
+        tags = [f"tag-{i:02}" for i in range(23)]
+        for tag in tags:
+            await sqlite_handler.add_message("601", tag, "hello", "1")
+
+        view = TagPagesView(_guild(601), "601")
+        pages, edits = await _walk(view, ["next", "next", "next", "previous"])
+        assert [len(page) for page in pages] == [10, 10, 3, 3, 10]
+        assert sum(pages[:3], []) == tags
+        assert pages[4] == tags[10:20]
+        assert [edit["content"] for edit in edits] == [
+            "Page 2",
+            "Page 3",
+            "Page 3",
+            "Page 2",
+        ]
+        assert not view.next_page.disabled
+        assert not view.previous_page.disabled
+
+        view = TagPagesView(_guild(601), "601", page_size=23)
+        pages, _ = await _walk(view, [])
+        assert pages == [tags[:10]]
+
+        view = TagPagesView(_guild(602), "602")
+        assert not await view.load_page()
+        assert view.next_page.disabled and view.previous_page.disabled
+
+    run_with_db(scenario)
+
+
+def test_pages_resume_after_the_last_tag_shown(run_with_db):
+    """A page cut short by the length limit is followed by the tags it left out."""
+
+    async def scenario():
+        tags = [f"long-{i}" for i in range(5)]
+        for tag in tags:
+            await sqlite_handler.add_message("603", tag, "x" * 1900, "1")
+
+        view = TagPagesView(_guild(603), "603")
+        pages, _ = await _walk(view, ["next", "previous"])
+        assert pages == [tags[:3], tags[3:], tags[:3]]
+        assert view.previous_page.disabled and not view.next_page.disabled
+        assert sum(len(embed) for embed in await view.load_page()) <= (
+            MAX_EMBEDS_LENGTH
+        )
+
+    run_with_db(scenario)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Tests of the throttling of tag triggers of throttle.py."""
+
+import pytest
+
+import throttle
+from throttle import Throttle, TokenBuckets, parse_limits
+
+
+def test_parse_limits():
+    """Limits are parsed per scope, and unknown scopes are rejected."""
+    assert parse_limits("user=5/10, guild=60/2.5") == {
+        "user": (5, 10.0),
+        "guild": (60, 2.5),
+    }
+    with pytest.raises(ValueError):
+        parse_limits("room=1/1")
+
+
+def test_bucket_refills_over_time():
+    """A bucket holds `count` tokens and gains one every `seconds / count`."""
+    buckets = TokenBuckets(2, 10)
+    for now in (0, 0):
+        buckets.store("a", buckets.take("a", now))
+    assert buckets.take("a", 0) is None
+    assert buckets.take("a", 4.9) is None
+    buckets.store("a", buckets.take("a", 5))
+    assert buckets.take("a", 5) is None
+    # Full again once `seconds` passed without any trigger.
+    assert buckets.take("a", 30) == 35
+
+
+def test_triggers_over_any_limit_are_shed(monkeypatch):
+    """A trigger is dropped when one scope is empty, without taking tokens."""
+    now = [0.0]
+    monkeypatch.setattr(throttle.time, "monotonic", lambda: now[0])
+    limits = Throttle({"user": (2, 10), "channel": (3, 10), "guild": (0, 10)})
+    assert "guild" not in limits.buckets
+
+    assert limits.allow(1, 100, 1000)
+    assert limits.allow(1, 100, 1000)
+    assert not limits.allow(1, 100, 1000)
+    # The dropped trigger did not take a token from the channel.
+    assert limits.allow(2, 100, 1000)
+    assert not limits.allow(3, 100, 1000)
+    assert limits.throttled == 2
+
+    now[0] = 10.0
+    assert limits.allow(1, 100, 1000)
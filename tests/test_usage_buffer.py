@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Tests of the write-behind usage counters of db/usage_buffer.py."""
+
+import asyncio
+import contextlib
+
+import pytest
+
+from db.cache import TagCache
+from db.usage_buffer import UsageBuffer
+
+
+class _Pool:
+    """A pool whose writer records batches, or fails while `failing` is set."""
+
+    def __init__(self):
+        self.failing = False
+        self.batches = []
+        self.during_write = None
+
+    @contextlib.asynccontextmanager
+    async def writer(self):
+        """Yields a connection that only supports `executemany()`."""
+        yield self
+
+    async def executemany(self, _, rows):
+        """Records a batch, after running the `during_write` hook."""
+        if self.during_write is not None:
+            await self.during_write()
+        if self.failing:
+            raise RuntimeError("disk I/O error")
+        self.batches.append(sorted(rows))
+
+
+def test_failed_flush_keeps_pending_counts():
+    """A failed flush re-queues its counts, merged with those recorded meanwhile."""
+
+    async def scenario():
+        pool = _Pool()
+        cache = TagCache()
+        cache.put("1", "tag", {"usage_count": 5}, cache.token())
+        buffer = UsageBuffer(pool, cache)
+        await buffer.record("1", "tag", 2)
+        await buffer.record("1", "other")
+
+        async def during_write():
+            assert buffer.pending_for("1", "tag") == 2
+            await buffer.record("1", "tag")
+
+        pool.failing = True
+        pool.during_write = during_write
+        with pytest.raises(RuntimeError):
+            await buffer.flush()
+        assert buffer.pending_for("1", "tag") == 3
+        assert buffer.pending_for("1", "other") == 1
+        assert cache.get("1", "tag")["usage_count"] == 5
+
+        pool.failing = False
+        pool.during_write = None
+        await buffer.flush()
+        assert pool.batches == [[(1, "1", "other"), (3, "1", "tag")]]
+        assert buffer.pending_for("1", "tag") == 0
+        assert not buffer
+        assert cache.get("1", "tag")["usage_count"] == 8
+
+    asyncio.run(scenario())
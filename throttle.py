@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the throttling of tag triggers.
+
+Functions:
+- parse_limits(value):
+Parses the trigger limits of each scope.
+
+Classes:
+- TokenBuckets:
+Token buckets of one scope, keyed by ID.
+
+- Throttle:
+Limits the tag triggers of every user, channel and guild.
+"""
+
+import time
+
+import config
+from metrics import Counter, Gauge
+from sharding import ShardedLRU
+
+# The scopes a trigger is limited in, checked in this order.
+SCOPES = ("user", "channel", "guild")
+
+THROTTLED_TRIGGERS = Counter(
+    "tagsy_throttled_triggers_total",
+    "Tag triggers dropped by the throttle, by the scope over its limit.",
+    labels=("scope",),
+)
+
+
+def parse_limits(value):
+    """
+    Parses the trigger limits of each scope.
+
+    Args:
+    - value (str): Comma-separated `scope=count/seconds` pairs, e.g.
+      "user=5/10" for 5 triggers per user every 10 seconds.
+
+    Returns:
+    - dict: The (count, seconds) limit of each scope.
+
+    Raises:
+    - ValueError: If a scope is unknown or a limit is not two numbers.
+    """
+    limits = {}
+    for pair in value.split(","):
+        if "=" in pair:
+            scope, limit = pair.split("=", 1)
+            scope = scope.strip()
+            if scope not in SCOPES:
+                raise ValueError(f"Unknown throttle scope: {scope}")
+            count, seconds = limit.split("/", 1)
+            limits[scope] = (int(count), float(seconds))
+    return limits
+
+
+class TokenBuckets:
+    """
+    Token buckets of one scope, keyed by ID.
+
+    Every bucket holds up to `count` tokens and gains one every
+    `seconds / count` seconds. A bucket is stored as the single time at which
+    it will be full again, so it takes one float; a bucket past that time is
+    full, which is the same as not being stored, so expired buckets are
+    simply ignored when they are next read, and the least recently used ones
+    are evicted past `capacity` buckets.
+
+    Attributes:
+    - count (int): The number of tokens of a full bucket.
+    - seconds (float): The number of seconds a bucket takes to refill.
+    - capacity (int): The maximum number of buckets stored.
+    """
+
+    def __init__(self, count, seconds, capacity=100000):
+        self.count = count
+        self.seconds = seconds
+        self.capacity = capacity
+        self._full_at = ShardedLRU(capacity)
+
+    def __len__(self):
+        return len(self._full_at)
+
+    def take(self, key, now):
+        """
+        Returns the time the bucket of a key is full again once a token is
+        taken from it, or None if it is empty.
+        """
+        full_at = max(self._full_at.touch(key) or now, now)
+        full_at += self.seconds / self.count
+        if full_at - now > self.seconds:
+            return None
+        return full_at
+
+    def store(self, key, full_at):
+        """Stores the bucket of a key, as returned by `take()`."""
+        self._full_at[key] = full_at
+
+
+class Throttle:
+    """
+    Limits the tag triggers of every user, channel and guild.
+
+    A trigger takes a token from the bucket of its user, its channel and its
+    guild, and is dropped if any of them is empty. Tokens are only taken when
+    all three have one, so dropped triggers do not count against any limit.
+
+    Attributes:
+    - buckets (dict): The TokenBuckets of every limited scope.
+    - throttled (int): The number of triggers dropped.
+    """
+
+    def __init__(self, limits, capacity=100000):
+        """
+        Args:
+        - limits (dict): The (count, seconds) limit of each scope, as returned
+          by `parse_limits()`; scopes without a limit, or with a count of 0,
+          are not limited.
+        - capacity (int): The maximum number of buckets stored per scope.
+        """
+        self.buckets = {
+            scope: TokenBuckets(count, seconds, capacity)
+            for scope, (count, seconds) in limits.items()
+            if count > 0
+        }
+        self.throttled = 0
+
+    def __len__(self):
+        return sum(len(buckets) for buckets in self.buckets.values())
+
+    def allow(self, user_id, channel_id, guild_id):
+        """
+        Takes a token for a trigger from every bucket it falls in.
+
+        Args:
+        - user_id (int): The ID of the author of the trigger.
+        - channel_id (int): The ID of the channel of the trigger.
+        - guild_id (int): The ID of the guild of the trigger.
+
+        Returns:
+        - bool: True if the trigger is within every limit, False if it must
+          be dropped.
+        """
+        now = time.monotonic()
+        keys = {"user": user_id, "channel": channel_id, "guild": guild_id}
+        taken = []
+        for scope in SCOPES:
+            buckets = self.buckets.get(scope)
+            if buckets is None:
+                continue
+            full_at = buckets.take(keys[scope], now)
+            if full_at is None:
+                self.throttled += 1
+                THROTTLED_TRIGGERS.inc(scope=scope)
+                return False
+            taken.append((buckets, keys[scope], full_at))
+        for buckets, key, full_at in taken:
+            buckets.store(key, full_at)
+        return True
+
+
+# Shared by every listener handling tag triggers.
+throttle = Throttle(parse_limits(config.THROTTLE_LIMITS), config.THROTTLE_MAX_KEYS)
+Gauge(
+    "tagsy_throttle_buckets",
+    "Token buckets held by the tag trigger throttle, across scopes.",
+    lambda: len(throttle),
+)
@@ -5,3 +5,4 @@ The views in this module are responsible for handling user interactions and rend
 """
 
 from .confirm import YesNoView
+from .tag_pages import TagPagesView
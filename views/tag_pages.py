@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""This module contains the `TagPagesView` class, which is a custom view for
+paging through the tags of a server in a single message.
+Classes:
+- TagPagesView: A custom view with buttons to move between pages of tag embeds.
+"""
+
+# pylint: disable=unused-argument
+
+import asyncio
+
+import disnake
+
+from db.sqlite_handler import get_all_messages
+from helper import build_embed
+from member_cache import display_names
+
+# Discord limits a message to 10 embeds and 6000 characters across them.
+MAX_EMBEDS = 10
+MAX_EMBEDS_LENGTH = 6000
+
+
+class TagPagesView(disnake.ui.View):
+    """A custom view with buttons to move between pages of tag embeds.
+
+    This view provides two buttons: "Previous" and "Next".
+    Only the page being displayed is read from the database,
+    using keyset pagination on the tag name, so memory use and API calls
+    per page stay fixed however many tags the server has.
+    Attributes:
+    - guild (disnake.Guild): The guild whose tags are displayed.
+    - server_id (str): The ID of the server whose tags are displayed.
+    - page_size (Optional[int]): The maximum number of tags per page,
+    at most 10. Defaults to 10.
+    """
+
+    def __init__(self, guild, server_id, page_size=MAX_EMBEDS):
+        super().__init__(timeout=300)
+        self.guild = guild
+        self.server_id = server_id
+        self.page_size = min(page_size, MAX_EMBEDS)
+        self._page_starts = [None]
+        self._last_tag = None
+
+    @property
+    def page_number(self):
+        """int: The number of the displayed page, starting at 1."""
+        return len(self._page_starts)
+
+    async def load_page(self):
+        """Reads the current page and returns its embeds.
+
+        The page is cut short when the next embed would go over the length
+        Discord accepts for a single message,
+        and the next page starts after the last tag actually displayed.
+        Returns:
+        - list: The embeds of the page, empty if there are no tags.
+        """
+        rows = await get_all_messages(
+            self.server_id, after_tag=self._page_starts[-1], limit=self.page_size + 1
+        )
+        names = await asyncio.gather(
+            *(
+                display_names.get(self.guild, int(row["created_by"]))
+                for row in rows[: self.page_size]
+            )
+        )
+
+        embeds = []
+        length = 0
+        for row, username in zip(rows, names):
+            embed = build_embed(row, username, self.server_id)
+            if embeds and length + len(embed) > MAX_EMBEDS_LENGTH:
+                break
+            embeds.append(embed)
+            length += len(embed)
+
+        self._last_tag = rows[len(embeds) - 1]["tag"] if embeds else None
+        self.previous_page.disabled = self.page_number == 1
+        self.next_page.disabled = len(rows) <= len(embeds)
+        return embeds
+
+    async def _show(self, interaction):
+        """Replaces the message with the current page.
+
+        Args:
+        - interaction (disnake.MessageInteraction):
+        The interaction object representing the user's interaction with the view.
+        """
+        embeds = await self.load_page()
+        await interaction.response.edit_message(
+            content=f"Page {self.page_number}" if embeds else "No tags found.",
+            embeds=embeds,
+            view=self,
+        )
+
+    @disnake.ui.button(label="Previous", style=disnake.ButtonStyle.grey)
+    async def previous_page(
+        self, button: disnake.ui.Button, interaction: disnake.MessageInteraction
+    ):
+        """Callback function for the "Previous" button.
+
+        This function is called when the "Previous" button is clicked.
+        It shows the previous page, or the first page again if it is displayed.
+        Args:
+        - button (disnake.ui.Button): The clicked button.
+        - interaction (disnake.MessageInteraction):
+        The interaction object representing the user's interaction with the view.
+        """
+        if self.page_number > 1:
+            self._page_starts.pop()
+        await self._show(interaction)
+
+    @disnake.ui.button(label="Next", style=disnake.ButtonStyle.blurple)
+    async def next_page(
+        self, button: disnake.ui.Button, interaction: disnake.MessageInteraction
+    ):
+        """Callback function for the "Next" button.
+
+        This function is called when the "Next" button is clicked.
+        It shows the next page, or the last page again if it is displayed.
+        Args:
+        - button (disnake.ui.Button): The clicked button.
+        - interaction (disnake.MessageInteraction):
+        The interaction object representing the user's interaction with the view.
+        """
+        if self._last_tag is not None and not button.disabled:
+            self._page_starts.append(self._last_tag)
+        await self._show(interaction)